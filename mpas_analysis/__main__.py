@@ -33,19 +33,25 @@ from collections import OrderedDict
 import progressbar
 import logging
 import xarray
+import threading
+import json
+from multiprocessing.pool import ThreadPool
 
 from mpas_analysis.shared.analysis_task import AnalysisFormatter
 
 from mpas_analysis.configuration import MpasAnalysisConfigParser
 
 from mpas_analysis.shared.io.utility import build_config_full_path, \
-    make_directories
+    make_directories, get_variable_bytes
 
 from mpas_analysis.shared.html import generate_html
 
-from mpas_analysis.shared import AnalysisTask
 from mpas_analysis.shared.analysis_task import \
     update_time_bounds_from_file_names
+from mpas_analysis.shared.scheduler import TaskScheduler, TaskDurations
+from mpas_analysis.shared.manifest import TaskManifest
+from mpas_analysis.shared.resource_usage import write_resource_report, \
+    get_top_consumers
 
 from mpas_analysis.shared.plot.plotting import _register_custom_colormaps, \
     _plot_color_gradients
@@ -210,7 +216,7 @@ def build_analysis_list(config, controlConfig):  # {{{
     return analyses  # }}}
 
 
-def determine_analyses_to_generate(analyses):  # {{{
+def determine_analyses_to_generate(analyses, setupTaskCount=1):  # {{{
     """
     Build a list of analysis tasks to run based on the 'generate' config
     option (or command-line flag) and prerequisites and subtasks of each
@@ -222,6 +228,11 @@ def determine_analyses_to_generate(analyses):  # {{{
     analyses : list of ``AnalysisTask`` objects
         A list of all analysis tasks
 
+    setupTaskCount : int, optional
+        The number of threads used to call ``setup_and_check``.  If more than
+        one, tasks are set up concurrently (see ``setup_tasks_in_parallel``)
+        before the dictionary of tasks to generate is built.
+
     Returns
     -------
     analysesToGenerate : ``OrderedDict`` of ``AnalysisTask`` objects
@@ -231,17 +242,105 @@ def determine_analyses_to_generate(analyses):  # {{{
     # -------
     # Xylar Asay-Davis
 
+    if setupTaskCount > 1:
+        setupResults = setup_tasks_in_parallel(analyses, setupTaskCount)
+    else:
+        setupResults = None
+
     analysesToGenerate = OrderedDict()
     # check which analysis we actually want to generate and only keep those
     for analysisTask in analyses:
         # update the dictionary with this task and perhaps its subtasks
-        add_task_and_subtasks(analysisTask, analysesToGenerate)
+        add_task_and_subtasks(analysisTask, analysesToGenerate,
+                              setupResults=setupResults)
 
     return analysesToGenerate  # }}}
 
 
+def setup_tasks_in_parallel(analyses, setupTaskCount):  # {{{
+    """
+    Call ``setup_and_check`` for the requested tasks, their prerequisites and
+    their subtasks using a pool of threads.  The setup of a task only begins
+    once its prerequisites (and their subtasks) and its parent task (for a
+    subtask) have been set up successfully, as in
+    ``add_task_and_subtasks``.  Errors are not reported here but are
+    returned so they can be reported in the usual order when the tasks are
+    added.
+
+    Parameters
+    ----------
+    analyses : list of ``AnalysisTask`` objects
+        A list of all analysis tasks
+
+    setupTaskCount : int
+        The number of threads used to set up tasks
+
+    Returns
+    -------
+    setupResults : dict
+        The traceback (or ``None`` on success) from ``setup_and_check`` for
+        each task that was set up, with (task, subtask) names as keys
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    # find the tasks to set up in the same order as add_task_and_subtasks,
+    # which guarantees that each task comes after the tasks it depends on
+    setupOrder = OrderedDict()
+    parentKeys = {}
+    for analysisTask in analyses:
+        _find_tasks_to_set_up(analysisTask, setupOrder, parentKeys)
+
+    positions = {}
+    for index, key in enumerate(setupOrder.keys()):
+        positions[key] = index
+
+    setupDependencies = {}
+    for key, analysisTask in setupOrder.items():
+        dependencies = set()
+        for prereq in _get_setup_prereqs(analysisTask):
+            dependencies.update(_get_subtree_keys(prereq))
+        if key in parentKeys:
+            dependencies.add(parentKeys[key])
+        # only earlier tasks can be waited on without risking a deadlock
+        setupDependencies[key] = [
+            dependency for dependency in dependencies
+            if dependency in positions and
+            positions[dependency] < positions[key]]
+
+    setupResults = {}
+    finished = {}
+    for key in setupOrder:
+        finished[key] = threading.Event()
+
+    def setup_task(key):
+        analysisTask = setupOrder[key]
+        try:
+            for dependency in setupDependencies[key]:
+                finished[dependency].wait()
+                if dependency not in setupResults or \
+                        setupResults[dependency] is not None:
+                    # a dependency failed (or was never set up because one of
+                    # its own dependencies failed), so this task won't be set
+                    # up
+                    return
+            setupResults[key] = _setup_task(analysisTask)
+        finally:
+            finished[key].set()
+
+    # tasks are started in order, so a task only waits on tasks that are
+    # already running or done
+    pool = ThreadPool(setupTaskCount)
+    pool.map(setup_task, list(setupOrder.keys()), chunksize=1)
+    pool.close()
+    pool.join()
+
+    return setupResults  # }}}
+
+
 def add_task_and_subtasks(analysisTask, analysesToGenerate,
-                          callCheckGenerate=True):
+                          callCheckGenerate=True, setupResults=None):
     # {{{
     """
     If a task has been requested through the generate config option or
@@ -262,6 +361,11 @@ def add_task_and_subtasks(analysisTask, analysesToGenerate,
         see if it has been requested.  We skip this for subtasks and
         prerequisites, since they are needed by another task regardless of
         whether the user specifically requested them.
+
+    setupResults : dict, optional
+        The results of ``setup_tasks_in_parallel``.  If a task has an entry,
+        its ``setup_and_check`` has already been called and the result is
+        used rather than calling it again.
     """
     # Authors
     # -------
@@ -294,7 +398,8 @@ def add_task_and_subtasks(analysisTask, analysesToGenerate,
 
     for prereq in prereqs:
         add_task_and_subtasks(prereq, analysesToGenerate,
-                              callCheckGenerate=False)
+                              callCheckGenerate=False,
+                              setupResults=setupResults)
         if prereq._setupStatus != 'success':
             # a prereq failed setup_and_check
             print("ERROR: prerequisite task {} of analysis task {}"
@@ -306,10 +411,12 @@ def add_task_and_subtasks(analysisTask, analysesToGenerate,
 
     # make sure all prereqs have been set up successfully before trying to
     # set up this task -- this task's setup may depend on setup in the prereqs
-    try:
-        analysisTask.setup_and_check()
-    except (Exception, BaseException):
-        traceback.print_exc(file=sys.stdout)
+    if setupResults is not None and key in setupResults:
+        stackTrace = setupResults[key]
+    else:
+        stackTrace = _setup_task(analysisTask)
+    if stackTrace is not None:
+        sys.stdout.write(stackTrace)
         print("ERROR: analysis task {} failed during check and "
               "will not be run".format(taskTitle))
         analysisTask._setupStatus = 'fail'
@@ -320,7 +427,8 @@ def add_task_and_subtasks(analysisTask, analysesToGenerate,
     # from the parent task
     for subtask in analysisTask.subtasks:
         add_task_and_subtasks(subtask, analysesToGenerate,
-                              callCheckGenerate=False)
+                              callCheckGenerate=False,
+                              setupResults=setupResults)
         if subtask._setupStatus != 'success':
             # a subtask failed setup_and_check
             print("ERROR: subtask {} of analysis task {}"
@@ -335,6 +443,284 @@ def add_task_and_subtasks(analysisTask, analysesToGenerate,
     # }}}
 
 
+def _get_task_durations(config):  # {{{
+    """
+    The durations of tasks from previous runs, used to start tasks on the
+    critical path first
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    durationFileName = '{}/taskDurations.json'.format(
+        config.get('output', 'baseDirectory'))
+    return TaskDurations(durationFileName)  # }}}
+
+
+def _get_task_manifest(config):  # {{{
+    """
+    The fingerprints of the tasks that ran successfully in previous runs,
+    used to skip tasks that are unchanged, or ``None`` if unchanged tasks
+    should not be skipped
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if not config.getWithDefault('execute', 'skipUnchangedTasks',
+                                 default=False):
+        return None
+
+    logsDirectory = build_config_full_path(config, 'output',
+                                           'logsSubdirectory')
+    return TaskManifest('{}/taskManifest.json'.format(logsDirectory))  # }}}
+
+
+def _format_bytes(byteCount):  # {{{
+    """
+    A human-readable size in bytes
+    """
+    for units in ['B', 'kB', 'MB', 'GB']:
+        if byteCount < 1024.:
+            return '{:.1f} {}'.format(byteCount, units)
+        byteCount /= 1024.
+    return '{:.1f} TB'.format(byteCount)  # }}}
+
+
+def _format_duration(duration):  # {{{
+    """
+    A duration in seconds formatted as hours, minutes and seconds
+    """
+    m, s = divmod(duration, 60)
+    h, m = divmod(int(m), 60)
+    return '{}:{:02d}:{:05.2f}'.format(h, m, s)  # }}}
+
+
+def _print_resource_summary(report, count=10):  # {{{
+    """
+    Print a table of the tasks that used the most CPU time, memory or I/O
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    topConsumers = get_top_consumers(report, count)
+    if len(topConsumers) == 0:
+        return
+
+    def format_value(value, formatter):
+        if value is None:
+            return '-'
+        return formatter(value)
+
+    rows = [['task', 'wall time', 'CPU time', 'peak memory', 'read',
+             'written', 'children']]
+    for entry in topConsumers:
+        if entry['userTime'] is None:
+            cpuTime = None
+        else:
+            cpuTime = entry['userTime'] + entry['systemTime']
+        rows.append([entry['task'],
+                     format_value(entry['wallTime'], _format_duration),
+                     format_value(cpuTime, _format_duration),
+                     format_value(entry['maxRss'], _format_bytes),
+                     format_value(entry['readBytes'], _format_bytes),
+                     format_value(entry['writeBytes'], _format_bytes),
+                     format_value(entry['childProcesses'], str)])
+
+    widths = [max([len(row[column]) for row in rows])
+              for column in range(len(rows[0]))]
+    print('Tasks using the most resources (see taskResources.csv in the '
+          'log directory for all tasks):')
+    for row in rows:
+        print('  {}  {}'.format(row[0].ljust(widths[0]), '  '.join(
+            [value.rjust(width) for value, width in
+             zip(row[1:], widths[1:])])))
+    print('')  # }}}
+
+
+def _setup_task(analysisTask):  # {{{
+    """
+    Call ``setup_and_check`` for a task, returning the traceback as a string
+    if it fails or ``None`` if it succeeds
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    try:
+        analysisTask.setup_and_check()
+    except (Exception, BaseException):
+        return traceback.format_exc()
+    return None  # }}}
+
+
+def _get_setup_prereqs(analysisTask):  # {{{
+    """
+    The prerequisites of a task and of its subtasks (other than the subtasks
+    themselves) that must be set up before the task, as in
+    ``add_task_and_subtasks``
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    prereqs = list(analysisTask.runAfterTasks)
+    for subtask in analysisTask.subtasks:
+        for prereq in subtask.runAfterTasks:
+            if prereq not in analysisTask.subtasks:
+                prereqs.append(prereq)
+    return prereqs  # }}}
+
+
+def _get_subtree_keys(analysisTask):  # {{{
+    """
+    The keys of a task and (recursively) its subtasks
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    keys = [(analysisTask.taskName, analysisTask.subtaskName)]
+    for subtask in analysisTask.subtasks:
+        keys.extend(_get_subtree_keys(subtask))
+    return keys  # }}}
+
+
+def _find_tasks_to_set_up(analysisTask, setupOrder, parentKeys,
+                          callCheckGenerate=True):  # {{{
+    """
+    Find the tasks that ``add_task_and_subtasks`` would set up in the order
+    it would set them up (ignoring failures) and the parent of each subtask
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    key = (analysisTask.taskName, analysisTask.subtaskName)
+    if key in setupOrder:
+        return
+
+    if callCheckGenerate and not analysisTask.check_generate():
+        return
+
+    for prereq in _get_setup_prereqs(analysisTask):
+        _find_tasks_to_set_up(prereq, setupOrder, parentKeys,
+                              callCheckGenerate=False)
+
+    setupOrder[key] = analysisTask
+
+    for subtask in analysisTask.subtasks:
+        subtaskKey = (subtask.taskName, subtask.subtaskName)
+        if subtaskKey not in parentKeys:
+            parentKeys[subtaskKey] = key
+        _find_tasks_to_set_up(subtask, setupOrder, parentKeys,
+                              callCheckGenerate=False)
+    # }}}
+
+
+def plan_analysis(config, analyses, forceTasks=None,
+                  planFileName=None):  # {{{
+    """
+    Print the tasks that would be run or skipped as unchanged, the input files
+    and variables each task reads and how long each task is expected to take,
+    without running any tasks
+
+    Parameters
+    ----------
+    config : ``MpasAnalysisConfigParser`` object
+        contains config options
+
+    analyses : OrderedDict of ``AnalysisTask`` objects
+        A dictionary of analysis tasks that have been set up with (task,
+        subtask) names as keys
+
+    forceTasks : list of str, optional
+        The names of tasks (or full names of subtasks) to run even if they
+        are unchanged since the last run
+
+    planFileName : str, optional
+        A JSON file to write the plan to
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    parallelTaskCount = config.getWithDefault('execute', 'parallelTaskCount',
+                                              default=1)
+
+    logger = logging.getLogger('mpas_analysis.plan')
+    scheduler = TaskScheduler(analyses, parallelTaskCount, logger,
+                              durations=_get_task_durations(config),
+                              manifest=_get_task_manifest(config),
+                              forceTasks=forceTasks)
+    plan = scheduler.plan()
+
+    totals = {'taskCount': len(plan),
+              'runCount': 0,
+              'skipCount': 0,
+              'inputBytes': 0,
+              'expectedDuration': 0.,
+              'criticalPath': 0.}
+
+    print('Execution plan:')
+    for entry in plan:
+        analysisTask = analyses[entry['key']]
+        inputFiles = analysisTask.get_input_files()
+        variableList = analysisTask.get_input_variables()
+        if entry['status'] == 'run':
+            inputBytes = get_variable_bytes(
+                [fileName for fileName in inputFiles
+                 if os.path.exists(fileName)], variableList)
+        else:
+            inputBytes = 0
+
+        entry['name'] = analysisTask.printTaskName
+        entry['prerequisites'] = [analyses[key].printTaskName for key in
+                                  entry['prerequisites'] if key in analyses]
+        entry['inputFiles'] = inputFiles
+        entry['inputVariables'] = variableList
+        entry['inputBytes'] = inputBytes
+        del entry['key']
+
+        totals['{}Count'.format(entry['status'])] += 1
+        if entry['status'] == 'run':
+            totals['inputBytes'] += inputBytes
+            totals['expectedDuration'] += entry['expectedDuration']
+        totals['criticalPath'] = max(totals['criticalPath'],
+                                     entry['criticalPath'])
+
+        print('  {:<8}{}'.format(entry['status'], entry['name']))
+        if len(entry['prerequisites']) > 0:
+            print('          after: {}'.format(
+                ', '.join(entry['prerequisites'])))
+        if entry['status'] == 'run':
+            if len(inputFiles) > 0:
+                if variableList is None:
+                    variables = 'all variables'
+                else:
+                    variables = '{} variables'.format(len(variableList))
+                print('          reads: {} files, {}, {}'.format(
+                    len(inputFiles), variables, _format_bytes(inputBytes)))
+            print('          expected duration: {}'.format(
+                _format_duration(entry['expectedDuration'])))
+
+    print('')
+    print('{} tasks: {} to run, {} to skip'.format(
+        totals['taskCount'], totals['runCount'], totals['skipCount']))
+    print('Total input read: {}'.format(_format_bytes(totals['inputBytes'])))
+    print('Total expected task time: {}'.format(
+        _format_duration(totals['expectedDuration'])))
+    print('Longest chain of dependent tasks: {}'.format(
+        _format_duration(totals['criticalPath'])))
+
+    if planFileName is not None:
+        with open(planFileName, 'w') as planFile:
+            json.dump({'tasks': plan, 'totals': totals}, planFile, indent=2)
+        print('Plan written to {}'.format(planFileName))
+    # }}}
+
+
 def update_generate(config, generate):  # {{{
     """
     Update the 'generate' config option using a string from the command line.
@@ -362,7 +748,7 @@ def update_generate(config, generate):  # {{{
     config.set('output', 'generate', generateString)  # }}}
 
 
-def run_analysis(config, analyses):  # {{{
+def run_analysis(config, analyses, forceTasks=None):  # {{{
     """
     Run all the tasks, either in serial or in parallel
 
@@ -374,6 +760,11 @@ def run_analysis(config, analyses):  # {{{
     analyses : OrderedDict of ``AnalysisTask`` objects
         A dictionary of analysis tasks to run with (task, subtask) names as
         keys
+
+    forceTasks : list of str, optional
+        The names of tasks (or full names of subtasks) to run even if
+        ``skipUnchangedTasks`` is ``True`` and they are unchanged since the
+        last run
     """
     # Authors
     # -------
@@ -393,17 +784,22 @@ def run_analysis(config, analyses):  # {{{
 
     parallelTaskCount = config.getWithDefault('execute', 'parallelTaskCount',
                                               default=1)
-
-    isParallel = parallelTaskCount > 1 and len(analyses) > 1
-
-    for analysisTask in analyses.values():
-        if not analysisTask.runAfterTasks and not analysisTask.subtasks:
-            analysisTask._runStatus.value = AnalysisTask.READY
+    executionMode = config.getWithDefault('execute', 'executionMode',
+                                          default='process')
+
+    # the total cores and memory (in GB) available to running tasks and the
+    # time (in seconds) each task may run, with None meaning no limit
+    limits = {}
+    for option in ['coreBudget', 'memoryBudget', 'taskTimeout',
+                   'taskTimeouts']:
+        if config.has_option('execute', option):
+            limits[option] = config.getExpression('execute', option)
         else:
-            analysisTask._runStatus.value = AnalysisTask.BLOCKED
-
-    tasksWithErrors = []
-    runningTasks = {}
+            limits[option] = None
+    retryCount = config.getWithDefault('execute', 'taskRetryCount',
+                                       default=0)
+    retryDelay = config.getWithDefault('execute', 'taskRetryDelay',
+                                       default=10.)
 
     # redirect output to a log file
     logsDirectory = build_config_full_path(config, 'output',
@@ -425,80 +821,37 @@ def run_analysis(config, analyses):  # {{{
     progress = progressbar.ProgressBar(widgets=widgets,
                                        maxval=totalTaskCount).start()
 
-    # run each analysis task
-    while True:
-        # we still have tasks to run
-        for analysisTask in analyses.values():
-            if analysisTask._runStatus.value == AnalysisTask.BLOCKED:
-                prereqs = analysisTask.runAfterTasks + analysisTask.subtasks
-                prereqStatus = [prereq._runStatus.value for prereq in prereqs]
-                if any([runStatus == AnalysisTask.FAIL for runStatus in
-                        prereqStatus]):
-                    # a prerequisite failed so this task cannot succeed
-                    analysisTask._runStatus.value = AnalysisTask.FAIL
-                if all([runStatus == AnalysisTask.SUCCESS for runStatus in
-                        prereqStatus]):
-                    # no unfinished prerequisites so we can run this task
-                    analysisTask._runStatus.value = AnalysisTask.READY
-
-        unfinishedCount = 0
-        for analysisTask in analyses.values():
-            if analysisTask._runStatus.value not in [AnalysisTask.SUCCESS,
-                                                     AnalysisTask.FAIL]:
-                unfinishedCount += 1
-
-        progress.update(totalTaskCount-unfinishedCount)
-
-        if unfinishedCount <= 0 and len(runningTasks.keys()) == 0:
-            # we're done
-            break
-
-        # launch new tasks
-        for key, analysisTask in analyses.items():
-            if analysisTask._runStatus.value == AnalysisTask.READY:
-                if isParallel:
-                    logger.info('Running {}'.format(
-                            analysisTask.printTaskName))
-                    analysisTask._runStatus.value = AnalysisTask.RUNNING
-                    analysisTask.start()
-                    runningTasks[key] = analysisTask
-                    if len(runningTasks.keys()) >= parallelTaskCount:
-                        break
-                else:
-                    analysisTask.run(writeLogFile=False)
-
-        if isParallel:
-            # wait for a task to finish
-            analysisTask = wait_for_task(runningTasks)
-            key = (analysisTask.taskName, analysisTask.subtaskName)
-            runningTasks.pop(key)
-
-            taskTitle = analysisTask.printTaskName
-
-            if analysisTask._runStatus.value == AnalysisTask.SUCCESS:
-                logger.info("   Task {} has finished successfully.".format(
-                        taskTitle))
-            elif analysisTask._runStatus.value == AnalysisTask.FAIL:
-                message = "ERROR in task {}.  See log file {} for " \
-                          "details".format(taskTitle,
-                                           analysisTask._logFileName)
-                logger.error(message)
-                print(message)
-                tasksWithErrors.append(taskTitle)
-            else:
-                message = "Unexpected status from in task {}.  This may be " \
-                          "a bug.".format(taskTitle)
-                logger.error(message)
-                print(message)
-        else:
-            if analysisTask._runStatus.value == AnalysisTask.FAIL:
-                sys.exit(1)
+    durations = _get_task_durations(config)
+    manifest = _get_task_manifest(config)
+
+    # run each analysis task as soon as its prerequisites have finished
+    scheduler = TaskScheduler(analyses, parallelTaskCount, logger, progress,
+                              coreBudget=limits['coreBudget'],
+                              memoryBudget=limits['memoryBudget'],
+                              durations=durations,
+                              executionMode=executionMode,
+                              manifest=manifest, forceTasks=forceTasks,
+                              timeout=limits['taskTimeout'],
+                              timeouts=limits['taskTimeouts'],
+                              retryCount=retryCount, retryDelay=retryDelay)
+    try:
+        tasksWithErrors = scheduler.run()
+    finally:
+        # in serial mode, the run stops at the first error, so we save what
+        # we learned about the tasks that ran before that
+        durations.write()
+        if manifest is not None:
+            manifest.write()
+        report = write_resource_report(analyses, logsDirectory)
 
     progress.finish()
 
     # blank line to make sure remaining output is on a new line
     print('')
 
+    # list the tasks that used the most resources
+    _print_resource_summary(report)
+
     logger.handlers = []
 
     # raise the last exception so the process exits with an error
@@ -521,35 +874,6 @@ def run_analysis(config, analyses):  # {{{
     # }}}
 
 
-def wait_for_task(runningTasks, timeout=0.1):  # {{{
-    """
-    Build a list of analysis modules based on the 'generate' config option.
-    New tasks should be added here, following the approach used for existing
-    analysis tasks.
-
-    Parameters
-    ----------
-    runningTasks : dict of ``AnalysisTasks``
-        The tasks that are currently running, with task names as keys
-
-    Returns
-    -------
-    analysisTask : ``AnalysisTasks``
-        A task that finished
-    """
-    # Authors
-    # -------
-    # Xylar Asay-Davis
-
-    # necessary to have a timeout so we can kill the whole thing
-    # with a keyboard interrupt
-    while True:
-        for analysisTask in runningTasks.values():
-            analysisTask.join(timeout=timeout)
-            if not analysisTask.is_alive():
-                return analysisTask  # }}}
-
-
 def purge_output(config):
     outputDirectory = config.get('output', 'baseDirectory')
     if not os.path.exists(outputDirectory):
@@ -658,6 +982,18 @@ def main():
     parser.add_argument("-p", "--purge", dest="purge", action='store_true',
                         help="Purge the analysis by deleting the output"
                         "directory before running")
+    parser.add_argument("--force", dest="force",
+                        help="A list of tasks to run even if they are "
+                        "unchanged since the last run (only relevant if "
+                        "skipUnchangedTasks is True)",
+                        metavar="TASK1[,TASK2,TASK3,...]")
+    parser.add_argument("--plan", dest="plan", action='store_true',
+                        help="Set up tasks and print which tasks would run "
+                        "or be skipped, the data they would read and their "
+                        "expected durations, without running them")
+    parser.add_argument("--plan_json", dest="plan_json",
+                        help="Like --plan but also write the plan to the "
+                        "given JSON file", metavar="FILE")
     parser.add_argument('configFiles', metavar='CONFIG',
                         type=str, nargs='*', help='config file')
     parser.add_argument("--plot_colormaps", dest="plot_colormaps",
@@ -756,10 +1092,21 @@ def main():
         pass
 
     analyses = build_analysis_list(config, controlConfig)
-    analyses = determine_analyses_to_generate(analyses)
+    setupTaskCount = config.getWithDefault('execute', 'parallelSetupCount',
+                                           default=1)
+    analyses = determine_analyses_to_generate(analyses, setupTaskCount)
+
+    if args.force:
+        forceTasks = args.force.split(',')
+    else:
+        forceTasks = None
+
+    if args.plan or args.plan_json:
+        plan_analysis(config, analyses, forceTasks, args.plan_json)
+        sys.exit(0)
 
     if not args.setup_only and not args.html_only:
-        run_analysis(config, analyses)
+        run_analysis(config, analyses, forceTasks)
 
     if not args.setup_only:
         generate_html(config, analyses, controlConfig)
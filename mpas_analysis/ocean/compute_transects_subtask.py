@@ -147,6 +147,10 @@ class ComputeTransectsSubtask(RemapMpasClimatologySubtask):  # {{{
 
         self.obsDatasets = obsDatasets
         self.transectCollectionName = transectCollectionName
+
+        # the transect points aren't known until setup but the mapping file
+        # can still be built by its own task
+        self.add_mapping_file_task(transectCollectionName)
         self.verticalComparisonGridName = verticalComparisonGridName
         self.verticalComparisonGrid = verticalComparisonGrid
 
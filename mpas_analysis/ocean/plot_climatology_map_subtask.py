@@ -192,6 +192,10 @@ class PlotClimatologyMapSubtask(AnalysisTask):  # {{{
             config=config, taskName=taskName, subtaskName=subtaskName,
             componentName='ocean', tags=tags)
 
+        # plotting a remapped climatology is relatively lightweight
+        self.memory = 0.5
+        self.expectedDuration = 30.
+
         # this task should not run until the remapping subtasks are done, since
         # it relies on data from those subtasks
         self.run_after(remapMpasClimatologySubtask)
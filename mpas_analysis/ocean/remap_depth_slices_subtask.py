@@ -96,15 +96,40 @@ class RemapDepthSlicesSubtask(RemapMpasClimatologySubtask):  # {{{
             mpasClimatologyTask, parentTask, climatologyName, variableList,
             seasons, comparisonGridNames, iselValues, useNcremap=False)
 
-    def run_task(self):  # {{{
+    def _add_variables_to_climatology(self):  # {{{
         """
-        Compute climatologies of T or S  from ACME/MPAS output
+        Compute the vertical index of each depth slice and add the variables
+        and seasons to ``mpasClimatologyTask``.  If climatologies are computed
+        natively (without ``ncclimo``), only the requested slices are
+        computed, rather than the full 3D fields.
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.depths is not None:
+            self._compute_vertical_indices()
 
-        This function has been overridden to load ``maxLevelCell`` from a
-        restart file for later use in indexing bottom T and S.
-        ``verticalIndex`` is also computed for later indexing of
-        the model level. It then simply calls the run function from
-        ClimatologyMapOcean.
+        if self.depths is None or self.mpasClimatologyTask.useNcclimo:
+            super(RemapDepthSlicesSubtask,
+                  self)._add_variables_to_climatology()
+            return
+
+        # invalid indices give the fill value in the climatology
+        verticalIndices = np.where(self.verticalIndexMask.values,
+                                   self.verticalIndices.values, -1)
+
+        self.sliceName = self.fullTaskName
+        self.mpasClimatologyTask.add_vertical_slices(
+            self.sliceName, self.variableList, verticalIndices, self.seasons)
+
+        # }}}
+
+    def _compute_vertical_indices(self):  # {{{
+        """
+        Load ``maxLevelCell`` from a restart file for later use in indexing
+        bottom T and S and compute ``verticalIndices`` and
+        ``verticalIndexMask`` for indexing each depth slice.
         """
         # Authors
         # -------
@@ -171,14 +196,13 @@ class RemapDepthSlicesSubtask(RemapMpasClimatologySubtask):  # {{{
                                                 'data': depthNames}},
                                     'data': mask})
 
-        # then, call run from the base class (RemapMpasClimatologySubtask),
-        # which will perform the main function of the task
-        super(RemapDepthSlicesSubtask, self).run_task()
+        # }}}
 
     def customize_masked_climatology(self, climatology, season):  # {{{
         """
         Uses ``verticalIndex`` to slice the 3D climatology field at each
-        requested depth.  The resulting field has the depth appended to
+        requested depth (unless the climatology was computed only at the
+        depth slices).  The resulting field has the depth appended to
         the variable name.
 
         Parameters
@@ -201,14 +225,18 @@ class RemapDepthSlicesSubtask(RemapMpasClimatologySubtask):  # {{{
         if self.depths is None:
             return climatology
 
-        climatology.coords['verticalIndex'] = \
-            ('nVertLevels',
-             np.arange(climatology.dims['nVertLevels']))
-
         depthNames = [str(depth) for depth in self.depths]
 
         climatology.coords['depthSlice'] = ('depthSlice', depthNames)
 
+        if self.sliceName is not None:
+            # the climatology was only computed at the depth slices
+            return climatology
+
+        climatology.coords['verticalIndex'] = \
+            ('nVertLevels',
+             np.arange(climatology.dims['nVertLevels']))
+
         for variableName in self.variableList:
             if 'nVertLevels' not in climatology[variableName].dims:
                 continue
@@ -27,6 +27,7 @@ import sys
 from mpas_analysis.shared.io import NameList, StreamsFile
 from mpas_analysis.shared.io.utility import build_config_full_path, \
     make_directories, get_files_year_month
+from mpas_analysis.shared.resource_usage import ResourceUsage
 
 
 class AnalysisTask(Process):  # {{{
@@ -88,6 +89,31 @@ class AnalysisTask(Process):  # {{{
 
     logger : ``logging.Logger``
         A logger for output during the run phase of an analysis task
+
+    cores : int
+        An estimate of the number of cores the task uses while running (e.g.
+        including any subprocesses it launches), used by the scheduler to
+        decide how many tasks can run at once.  For a task with ``minCores``,
+        this is the most cores it can make use of.
+
+    minCores : int or None
+        If not ``None``, the fewest cores the task can run with.  The
+        scheduler allots such a task between ``minCores`` and ``cores``
+        cores, depending on how many are free.
+
+    allottedCores : int or None
+        The number of cores the scheduler allotted to the task, which tasks
+        that launch parallel subprocesses (e.g. ``ncclimo``) should use.
+        ``None`` if the task was not launched by the scheduler, in which
+        case ``cores`` should be used.
+
+    memory : float
+        An estimate of the peak memory (in GB) the task uses while running
+
+    expectedDuration : float
+        An estimate of the run time of the task (in seconds), used by the
+        scheduler to prioritize tasks on the critical path if the task has
+        not been timed in a previous run
     '''
     # Authors
     # -------
@@ -156,12 +182,28 @@ class AnalysisTask(Process):  # {{{
         self.runAfterTasks = []
         self.xmlFileNames = []
 
+        # estimates of the resources the task needs, which subclasses should
+        # change if they are more or less demanding than a typical task
+        self.cores = 1
+        self.minCores = None
+        self.allottedCores = None
+        self.memory = 1.0
+        self.expectedDuration = 60.
+
+        # how long the task took to run (in seconds)
+        self._runDuration = None
+        self._resourceUsage = None
+        self._runInOwnProcess = False
+
         # non-public attributes related to multiprocessing and logging
         self.daemon = True
         self._setupStatus = None
         self._runStatus = Value('i', AnalysisTask.UNSET)
         self._stackTrace = None
         self._logFileName = None
+        # the writing end of a pipe used to report to the scheduler that this
+        # task has finished
+        self._completionConnection = None
         # }}}
 
     def setup_and_check(self):  # {{{
@@ -280,6 +322,83 @@ class AnalysisTask(Process):  # {{{
             self.subtasks.append(subtask)
         # }}}
 
+    def get_input_files(self):  # {{{
+        '''
+        Get the input files (other than output from prerequisites) that
+        determine the results of this task.  If any of these files is
+        modified, the task will be rerun even if it completed successfully
+        in a previous run.  Tasks that read model output or observations
+        directly should override this method; the default is no files.
+
+        Returns
+        -------
+        inputFiles : list of str
+            The input files, available after ``setup_and_check()`` has been
+            called
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return []  # }}}
+
+    def get_input_variables(self):  # {{{
+        '''
+        Get the variables this task reads from the files returned by
+        ``get_input_files()``, used to estimate how much data the task reads.
+        The default, ``None``, means the variables are not known, so all
+        variables are assumed to be read.
+
+        Returns
+        -------
+        variableList : list of str or None
+            The variables read from the input files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return None  # }}}
+
+    def get_output_files(self):  # {{{
+        '''
+        Get the files this task writes.  If any of these files is missing,
+        the task will be rerun even if its inputs are unchanged since it
+        completed successfully in a previous run.  Tasks that write files
+        other than plots should override this method; the default is the
+        XML file of each plot in ``xmlFileNames``.
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files, available after ``setup_and_check()`` has been
+            called
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.xmlFileNames)  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        '''
+        Get any parameters (beyond config options) that determine the results
+        of this task, such as variables requested by other tasks.  If these
+        change, the task will be rerun even if it completed successfully in a
+        previous run.  The default is no parameters.
+
+        Returns
+        -------
+        parameters : dict
+            Parameters that can be converted to JSON, available after
+            ``setup_and_check()`` has been called
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return {}  # }}}
+
     def run(self, writeLogFile=True):  # {{{
         '''
         Sets up logging and then runs the analysis task.
@@ -316,6 +435,7 @@ class AnalysisTask(Process):  # {{{
             sys.stderr = StreamToLogger(self.logger, logging.ERROR)
 
         startTime = time.time()
+        resourceUsage = ResourceUsage(ownProcess=self._runInOwnProcess)
         try:
             self.run_task()
             self._runStatus.value = AnalysisTask.SUCCESS
@@ -328,9 +448,18 @@ class AnalysisTask(Process):  # {{{
             self._runStatus.value = AnalysisTask.FAIL
 
         runDuration = time.time() - startTime
+        self._runDuration = runDuration
         m, s = divmod(runDuration, 60)
         h, m = divmod(int(m), 60)
         self.logger.info('Execution time: {}:{:02d}:{:05.2f}'.format(h, m, s))
+        self._resourceUsage = resourceUsage.stop()
+        usageStrings = []
+        for key in sorted(self._resourceUsage.keys()):
+            value = self._resourceUsage[key]
+            if isinstance(value, float):
+                value = '{:.2f}'.format(value)
+            usageStrings.append('{}={}'.format(key, value))
+        self.logger.info('Resource usage: {}'.format(', '.join(usageStrings)))
 
         if writeLogFile:
             # restore stdout and stderr
@@ -341,6 +470,14 @@ class AnalysisTask(Process):  # {{{
         # writeLogFile==False)
         self.logger.handlers = []
 
+        if self._completionConnection is not None:
+            # let the scheduler know we're done
+            self._completionConnection.send(
+                {'status': self._runStatus.value,
+                 'duration': runDuration,
+                 'usage': self._resourceUsage})
+            self._completionConnection.close()
+
         # }}}
 
     def check_generate(self):
@@ -1,10 +1,11 @@
 from mpas_analysis.shared.climatology.climatology import get_remapper, \
     compute_monthly_climatology, compute_climatology, \
-    add_years_months_days_in_month, remap_and_write_climatology, \
+    compute_seasonal_climatologies, add_years_months_days_in_month, \
+    remap_and_write_climatology, remap_and_write_climatologies, \
     get_unmasked_mpas_climatology_directory, \
     get_unmasked_mpas_climatology_file_name, \
     get_masked_mpas_climatology_file_name, \
-    get_remapped_mpas_climatology_file_name
+    get_remapped_mpas_climatology_file_name, get_statistic_variable_name
 
 from mpas_analysis.shared.climatology.mpas_climatology_task import \
     MpasClimatologyTask
@@ -14,5 +15,7 @@ from mpas_analysis.shared.climatology.remap_mpas_climatology_subtask import \
     RemapMpasClimatologySubtask
 from mpas_analysis.shared.climatology.remap_observed_climatology_subtask \
     import RemapObservedClimatologySubtask
+from mpas_analysis.shared.climatology.mapping_file_task import \
+    MappingFileTask, get_mapping_file_task
 from mpas_analysis.shared.climatology.comparison_descriptors import \
     get_comparison_descriptor, get_antarctic_stereographic_projection
@@ -21,6 +21,7 @@ from __future__ import absolute_import, division, print_function, \
 import xarray as xr
 import os
 import numpy
+from collections import OrderedDict
 
 from mpas_analysis.shared.constants import constants
 
@@ -31,6 +32,8 @@ from mpas_analysis.shared.io.utility import build_config_full_path, \
 from mpas_analysis.shared.io import write_netcdf
 
 from mpas_analysis.shared.interpolation import Remapper
+from mpas_analysis.shared.interpolation.native_weights import \
+    supports_native_weights
 from mpas_analysis.shared.grid import LatLonGridDescriptor, \
     ProjectionGridDescriptor
 from mpas_analysis.shared.climatology.comparison_descriptors import \
@@ -38,14 +41,26 @@ from mpas_analysis.shared.climatology.comparison_descriptors import \
 
 
 def get_remapper(config, sourceDescriptor, comparisonDescriptor,
-                 mappingFilePrefix, method, logger=None):  # {{{
+                 mappingFilePrefix, method, logger=None,
+                 mappingFileTask=None):  # {{{
     """
     Given config options and descriptions of the source and comparison grids,
     returns a ``Remapper`` object that can be used to remap from source files
     or data sets to corresponding data sets on the comparison grid.
 
     If necessary, creates the mapping file containing weights and indices
-    needed to perform remapping.
+    needed to perform remapping.  If the config option
+    ``useNativeMappingWeights`` is ``True`` and ``useNcremap`` is ``False``,
+    ``bilinear`` weights from MPAS meshes and ``neareststod`` weights are
+    computed in MPAS-Analysis rather than with ``ESMF_RegridWeightGen``.
+
+    If a ``mappingFileTask`` is supplied, the mapping file is not created
+    right away but is instead built when that task runs.
+
+    New mapping files are written to the ``mappingSubdirectory`` in the
+    ``output`` section unless ``writeMappingFiles = True`` in the
+    ``diagnostics`` section and the ``mappingSubdirectory`` there is
+    writable, in which case they are shared with other runs.
 
     Parameters
     ----------
@@ -67,6 +82,10 @@ def get_remapper(config, sourceDescriptor, comparisonDescriptor,
     logger : ``logging.Logger``, optional
         A logger to which ncclimo output should be redirected
 
+    mappingFileTask : ``MappingFileTask``, optional
+        A task that will build the mapping file, which the caller must run
+        after
+
     Returns
     -------
     remapper : ``Remapper`` object
@@ -79,20 +98,34 @@ def get_remapper(config, sourceDescriptor, comparisonDescriptor,
 
     mappingFileName = None
 
+    # ncremap needs the cell corners, which native mapping files don't have
+    useNative = config.getWithDefault('climatology',
+                                      'useNativeMappingWeights',
+                                      default=False) and \
+        not config.getboolean('climatology', 'useNcremap') and \
+        supports_native_weights(sourceDescriptor, comparisonDescriptor,
+                                method)
+
     if not _matches_comparison(sourceDescriptor, comparisonDescriptor):
         # we need to remap because the grids don't match
 
-        mappingBaseName = '{}_{}_to_{}_{}.nc'.format(
+        mappingBaseName = '{}_{}_to_{}_{}'.format(
                 mappingFilePrefix,
                 sourceDescriptor.meshName,
                 comparisonDescriptor.meshName,
                 method)
+        if useNative:
+            # native mapping files must never be mistaken for those from
+            # ESMF_RegridWeightGen, e.g. by a run that uses ncremap
+            mappingBaseName = '{}_native'.format(mappingBaseName)
+        mappingBaseName = '{}.nc'.format(mappingBaseName)
 
         mappingSubdirectory = build_config_full_path(config, 'diagnostics',
                                                      'mappingSubdirectory')
 
-        mappingFileName = '{}/{}'.format(mappingSubdirectory,
-                                         mappingBaseName)
+        sharedMappingFileName = '{}/{}'.format(mappingSubdirectory,
+                                               mappingBaseName)
+        mappingFileName = sharedMappingFileName
         if not os.path.exists(mappingFileName):
             # we don't have a mapping file yet, so get ready to create one
             # in the output subfolder if needed
@@ -103,10 +136,21 @@ def get_remapper(config, sourceDescriptor, comparisonDescriptor,
             mappingFileName = '{}/{}'.format(mappingSubdirectory,
                                              mappingBaseName)
 
+            writeShared = config.getWithDefault(
+                'diagnostics', 'writeMappingFiles', default=False) and \
+                os.access(os.path.dirname(sharedMappingFileName), os.W_OK)
+            if writeShared and not os.path.exists(mappingFileName):
+                # build the mapping file where other runs can find it
+                mappingFileName = sharedMappingFileName
+
     remapper = Remapper(sourceDescriptor, comparisonDescriptor,
                         mappingFileName)
 
-    remapper.build_mapping_file(method=method, logger=logger)
+    if mappingFileTask is None:
+        remapper.build_mapping_file(method=method, logger=logger,
+                                    useNative=useNative)
+    else:
+        mappingFileTask.add_remapper(remapper, method, useNative=useNative)
 
     return remapper  # }}}
 
@@ -160,7 +204,7 @@ def compute_monthly_climatology(ds, calendar=None, maskVaries=True):  # {{{
 
 
 def compute_climatology(ds, monthValues, calendar=None,
-                        maskVaries=True):  # {{{
+                        maskVaries=True, statistics=None):  # {{{
     """
     Compute a monthly, seasonal or annual climatology data set from a data
     set.  The mean is weighted but the number of days in each month of
@@ -189,17 +233,40 @@ def compute_climatology(ds, monthValues, calendar=None,
         time, whereas observations may sometimes be present only at some
         times and not at others, requiring ``maskVaries = True``.
 
+    statistics : list of str, optional
+        Statistics (any of ``constants.climatologyStatistics``) to compute
+        along with the mean while reading each time slice, added to the
+        climatology as variables named with
+        ``get_statistic_variable_name()``.  The ``'variance'`` is the
+        variance of the monthly values weighted by the number of days in each
+        month, computed with a numerically stable streaming update, and
+        ``'min'`` and ``'max'`` are the extremes of the monthly values.
+        NaNs are ignored in all statistics.  Only supported if ``ds`` is an
+        ``xarray.Dataset``.
+
     Returns
     -------
     climatology : object of same type as ``ds``
         A data set without the ``'Time'`` coordinate containing the mean
         of ds over all months in monthValues, weighted by the number of days
         in each month.
+
+    Raises
+    ------
+    ValueError
+        If ``statistics`` are requested for an ``xarray.DataArray`` or one
+        of the statistics is not supported
     """
     # Authors
     # -------
     # Xylar Asay-Davis
 
+    if statistics is not None:
+        check_statistics(statistics)
+        if not isinstance(ds, xr.Dataset):
+            raise ValueError('statistics can only be computed for a '
+                             'xarray.Dataset')
+
     ds = add_years_months_days_in_month(ds, calendar)
 
     mask = xr.zeros_like(ds.month, bool)
@@ -209,11 +276,167 @@ def compute_climatology(ds, monthValues, calendar=None,
 
     climatologyMonths = ds.where(mask, drop=True)
 
-    climatology = _compute_masked_mean(climatologyMonths, maskVaries)
+    climatology = _compute_masked_mean(climatologyMonths, maskVaries,
+                                       statistics)
 
     return climatology  # }}}
 
 
+def get_statistic_variable_name(variableName, statistic):  # {{{
+    """
+    Get the name of the variable in a climatology containing a statistic
+    other than the mean
+
+    Parameters
+    ----------
+    variableName : str
+        The name of the variable the statistic was computed from
+
+    statistic : str
+        One of ``constants.climatologyStatistics``
+
+    Returns
+    -------
+    statisticName : str
+        The name of the variable containing the statistic
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    return '{}_{}'.format(variableName, statistic)  # }}}
+
+
+def get_statistic_attributes(attributes, statistic):  # {{{
+    """
+    Get the attributes of a variable containing a statistic from those of
+    the variable it was computed from
+
+    Parameters
+    ----------
+    attributes : dict
+        The attributes of the original variable
+
+    statistic : str
+        One of ``constants.climatologyStatistics``
+
+    Returns
+    -------
+    attributes : dict
+        The attributes of the statistic
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    attributes = dict(attributes)
+    if 'long_name' in attributes:
+        attributes['long_name'] = '{} of {}'.format(statistic,
+                                                    attributes['long_name'])
+    if statistic == 'variance' and 'units' in attributes:
+        attributes['units'] = '({})^2'.format(attributes['units'])
+    return attributes  # }}}
+
+
+def check_statistics(statistics):  # {{{
+    """
+    Check that statistics other than the mean are supported in climatologies
+
+    Parameters
+    ----------
+    statistics : list of str
+        The statistics to check
+
+    Raises
+    ------
+    ValueError
+        If one of the statistics is not in
+        ``constants.climatologyStatistics``
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    for statistic in statistics:
+        if statistic not in constants.climatologyStatistics:
+            raise ValueError('Unsupported climatology statistic {}, must be '
+                             'one of {}'.format(
+                                 statistic, constants.climatologyStatistics))
+    # }}}
+
+
+def compute_seasonal_climatologies(ds, seasons, calendar=None,
+                                   maskVaries=True):  # {{{
+    """
+    Compute monthly, seasonal and/or annual climatologies for several seasons
+    from a data set in one pass.  The days-weighted sum of each month is
+    computed only once and shared between all seasons that include that
+    month.  The results are the same as calling ``compute_climatology()``
+    for each season.
+
+    Parameters
+    ----------
+    ds : ``xarray.Dataset`` or ``xarray.DataArray`` object
+        A data set with a ``Time`` coordinate expressed as days since
+        0001-01-01 or ``month`` coordinate
+
+    seasons : list of str
+        A list of seasons (keys in ``shared.constants.monthDictionary``) to
+        be computed
+
+    calendar : ``{'gregorian', 'gregorian_noleap'}``, optional
+        The name of one of the calendars supported by MPAS cores, used to
+        determine ``month`` from ``Time`` coordinate, so must be supplied if
+        ``ds`` does not already have a ``month`` coordinate or data array
+
+    maskVaries : bool, optional
+        If the mask (where variables in ``ds`` are ``NaN``) varies with time.
+        If not, the weighted average does not need make extra effort to account
+        for the mask.
+
+    Returns
+    -------
+    climatologies : ``OrderedDict``
+        For each season, an object of the same type as ``ds`` without the
+        ``'Time'`` coordinate containing the mean of ds over all months in the
+        season, weighted by the number of days in each month.
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    ds = add_years_months_days_in_month(ds, calendar)
+
+    months = ds.month.values
+
+    # the days-weighted sums and weights of each month that is needed
+    monthlySums = {}
+    for season in seasons:
+        for month in constants.monthDictionary[season]:
+            if month in monthlySums:
+                continue
+            timeIndices = numpy.nonzero(months == month)[0]
+            monthlySums[month] = _compute_masked_sums(
+                ds.isel(Time=timeIndices), maskVaries)
+
+    climatologies = OrderedDict()
+    for season in seasons:
+        dsWeightedSum = None
+        for month in constants.monthDictionary[season]:
+            monthSum, monthWeight = monthlySums[month]
+            if dsWeightedSum is None:
+                dsWeightedSum = monthSum
+                weightSum = monthWeight
+            else:
+                dsWeightedSum = dsWeightedSum + monthSum
+                weightSum = weightSum + monthWeight
+
+        climatologies[season] = \
+            dsWeightedSum / weightSum.where(weightSum > 0.)
+
+    return climatologies  # }}}
+
+
 def add_years_months_days_in_month(ds, calendar=None):  # {{{
     '''
     Add ``year``, ``month`` and ``daysInMonth`` as data arrays in ``ds``.
@@ -280,7 +503,7 @@ def add_years_months_days_in_month(ds, calendar=None):  # {{{
 
 def remap_and_write_climatology(config, climatologyDataSet,
                                 climatologyFileName, remappedFileName,
-                                remapper, logger=None):  # {{{
+                                remapper, logger=None, cores=None):  # {{{
     """
     Given a field in a climatology data set, use the ``remapper`` to remap
     horizontal dimensions of all fields, write the results to an output file,
@@ -317,6 +540,10 @@ def remap_and_write_climatology(config, climatologyDataSet,
     logger : ``logging.Logger``, optional
         A logger to which ncclimo output should be redirected
 
+    cores : int, optional
+        The number of cores ``ncremap`` or the remapper may use (see
+        ``Remapper.remap()``)
+
     Returns
     -------
     remappedClimatology : ``xarray.DataSet`` or ``xarray.DataArray`` object
@@ -347,16 +574,92 @@ def remap_and_write_climatology(config, climatologyDataSet,
                                 outFileName=remappedFileName,
                                 overwrite=True,
                                 renormalize=renormalizationThreshold,
-                                logger=logger)
+                                logger=logger, cores=cores)
             remappedClimatology = xr.open_dataset(remappedFileName)
         else:
 
             remappedClimatology = remapper.remap(climatologyDataSet,
-                                                 renormalizationThreshold)
+                                                 renormalizationThreshold,
+                                                 cores=cores)
             write_netcdf(remappedClimatology, remappedFileName)
     return remappedClimatology  # }}}
 
 
+def remap_and_write_climatologies(config, climatologies,
+                                  climatologyFileNames, remappedFileNames,
+                                  remapper, logger=None,
+                                  cores=None):  # {{{
+    """
+    Given climatology data sets for several seasons, use the ``remapper`` to
+    remap horizontal dimensions of all fields and write the results to output
+    files.  Unless ``ncremap`` is used, all seasons are remapped together in
+    a single call to the remapper.
+
+    Note that ``climatologyFileNames`` and ``remappedFileNames`` will be
+    overwritten if they exist.
+
+    Parameters
+    ----------
+    config :  instance of ``MpasAnalysisConfigParser``
+        Contains configuration options
+
+    climatologies : dict of ``xarray.DataSet`` objects
+        A data set containing a climatology for each season
+
+    climatologyFileNames : dict of str
+        For each season, the name of the output file to which the data set
+        should be written before remapping (if using ncremap).
+
+    remappedFileNames : dict of str
+        For each season, the name of the output file to which the remapped
+        data set should be written.
+
+    remapper : ``Remapper`` object
+        A remapper that can be used to remap files or data sets to a
+        comparison grid.
+
+    logger : ``logging.Logger``, optional
+        A logger to which ncclimo output should be redirected
+
+    cores : int, optional
+        The number of cores ``ncremap`` or the remapper may use (see
+        ``Remapper.remap()``)
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    seasons = list(remappedFileNames.keys())
+
+    useNcremap = config.getboolean('climatology', 'useNcremap')
+
+    if (isinstance(remapper.sourceDescriptor, ProjectionGridDescriptor) or
+            isinstance(remapper.destinationDescriptor,
+                       ProjectionGridDescriptor)):
+        # ncremap doesn't support projection grids
+        useNcremap = False
+
+    if useNcremap or remapper.mappingFileName is None or len(seasons) == 1:
+        for season in seasons:
+            remap_and_write_climatology(
+                config, climatologies[season], climatologyFileNames[season],
+                remappedFileNames[season], remapper, logger=logger,
+                cores=cores)
+        return
+
+    renormalizationThreshold = config.getfloat(
+        'climatology', 'renormalizationThreshold')
+
+    remappedClimatologies = remapper.remap_datasets(
+        [climatologies[season] for season in seasons],
+        renormalizationThreshold, cores=cores)
+
+    for season, remappedClimatology in zip(seasons, remappedClimatologies):
+        write_netcdf(remappedClimatology, remappedFileNames[season])
+
+    # }}}
+
+
 def get_unmasked_mpas_climatology_directory(config):  # {{{
     """
     Get the directory for an unmasked MPAS climatology produced by ncclimo,
@@ -570,47 +873,244 @@ def get_remapped_mpas_climatology_file_name(config, season, componentName,
     return fileName  # }}}
 
 
-def _compute_masked_mean(ds, maskVaries):  # {{{
+def _compute_masked_mean(ds, maskVaries, statistics=None):  # {{{
     '''
     Compute the time average of data set, masked out where the variables in ds
     are NaN and, if ``maskVaries == True``, weighting by the number of days
-    used to compute each monthly mean time in ds.
+    used to compute each monthly mean time in ds.  The requested
+    ``statistics`` of each variable are added to the result.
+
+    The weighted sums and weights are accumulated one variable and one time
+    slice at a time, so memory usage is roughly twice the size of the result
+    for the largest variable (plus the size of the statistics).
     '''
     # Authors
     # -------
     # Xylar Asay-Davis
 
-    def ds_to_weights(ds):
-        # make an identical data set to ds but replacing all data arrays with
-        # nonnull applied to that data array
-        weights = ds.copy(deep=True)
-        if isinstance(ds, xr.core.dataarray.DataArray):
-            weights = ds.notnull()
-        elif isinstance(ds, xr.core.dataset.Dataset):
-            for var in ds.data_vars:
-                weights[var] = ds[var].notnull()
+    statisticFields = OrderedDict()
+
+    def compute_one_mean(da):
+        weightedSum, weightSum, moments = _accumulate_masked_sums(
+            da, ds.daysInMonth, maskVaries,
+            computeMoments=statistics is not None)
+        if moments is not None:
+            for statistic in statistics:
+                field = _remove_time(da, moments[statistic])
+                field.attrs = get_statistic_attributes(da.attrs, statistic)
+                statisticFields[get_statistic_variable_name(
+                    da.name, statistic)] = field
+        # divide in place, leaving NaNs where there is no weight
+        invalid = numpy.logical_not(weightSum > 0.)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            numpy.divide(weightedSum, weightSum, out=weightedSum)
+        if numpy.ndim(invalid) == 0:
+            if invalid:
+                weightedSum[...] = numpy.nan
         else:
-            raise TypeError('ds must be an instance of either xarray.Dataset '
-                            'or xarray.DataArray.')
+            weightedSum[invalid] = numpy.nan
+        return _remove_time(da, weightedSum)
+
+    climatology = _apply_to_variables(ds, compute_one_mean)
+    for variableName, field in statisticFields.items():
+        climatology[variableName] = field
+    return climatology  # }}}
 
-        return weights
+
+def _compute_masked_sums(ds, maskVaries):  # {{{
+    '''
+    Compute the sum of a data set over time, weighted by the number of days
+    used to compute each monthly mean time in ds, and the sum of the weights,
+    which, if ``maskVaries == True``, excludes the days where the variables
+    in ds are NaN.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if not maskVaries:
+        weightSum = ds.daysInMonth.sum(dim='Time')
+
+    weights = {}
+
+    def compute_one_sum(da):
+        weightedSum, weight, _ = _accumulate_masked_sums(da, ds.daysInMonth,
+                                                         maskVaries)
+        if maskVaries:
+            weights[da.name] = _remove_time(da, weight)
+        return _remove_time(da, weightedSum)
+
+    dsWeightedSum = _apply_to_variables(ds, compute_one_sum)
 
     if maskVaries:
-        dsWeightedSum = (ds * ds.daysInMonth).sum(dim='Time', keep_attrs=True)
+        if isinstance(ds, xr.DataArray):
+            weightSum = weights[ds.name]
+        else:
+            weightSum = xr.Dataset(weights)
+
+    return dsWeightedSum, weightSum  # }}}
+
+
+def _apply_to_variables(ds, function):  # {{{
+    '''
+    Apply a function to a data array or to each variable in a data set
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if isinstance(ds, xr.core.dataarray.DataArray):
+        return function(ds)
+    elif isinstance(ds, xr.core.dataset.Dataset):
+        dsOut = xr.Dataset(attrs=ds.attrs)
+        for var in ds.data_vars:
+            dsOut[var] = function(ds[var])
+        return dsOut
+    else:
+        raise TypeError('ds must be an instance of either xarray.Dataset '
+                        'or xarray.DataArray.')  # }}}
+
+
+def _accumulate_masked_sums(da, daysInMonth, maskVaries,
+                            computeMoments=False):  # {{{
+    '''
+    Accumulate the sum over time of a data array weighted by the days in
+    each month, ignoring NaNs, and the sum of the weights (excluding NaNs if
+    ``maskVaries == True``), reading one time slice at a time.  The results
+    are numpy arrays without the ``Time`` dimension (or a scalar for the
+    weights if ``maskVaries == False``).
+
+    If ``computeMoments == True``, a dictionary with the days-weighted
+    ``'variance'`` (from West's weighted version of Welford's update), the
+    ``'min'`` and the ``'max'`` over time, all ignoring NaNs, is also
+    returned (otherwise ``None``).
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
 
-        weights = ds_to_weights(ds)
+    days = numpy.asarray(daysInMonth.values, dtype=float)
 
-        weightSum = (weights * ds.daysInMonth).sum(dim='Time')
+    if maskVaries:
+        weightSum = None
+    else:
+        weightSum = numpy.sum(days)
 
-        timeMean = dsWeightedSum / weightSum.where(weightSum > 0.)
+    if 'Time' not in da.dims:
+        # the field is the same at all times
+        timeIndices = [None]
+        days = [numpy.sum(days)]
     else:
-        days = ds.daysInMonth.sum(dim='Time')
+        timeIndices = range(len(days))
+
+    weightedSum = None
+    moments = None
+    for timeIndex, weight in zip(timeIndices, days):
+        if timeIndex is None:
+            field = da.values
+        else:
+            field = da.isel(Time=timeIndex).values
+        field = numpy.array(field, dtype=float)
+        invalid = numpy.isnan(field)
+        if computeMoments:
+            if moments is None:
+                moments = _get_empty_moments(field.shape)
+            _update_moments(moments, field, numpy.logical_not(invalid),
+                            weight)
+        # the weighted field, with NaNs treated as zeros
+        field[invalid] = 0.
+        field *= weight
+        if weightedSum is None:
+            weightedSum = field
+        else:
+            weightedSum += field
+        if maskVaries:
+            if weightSum is None:
+                weightSum = numpy.zeros(field.shape)
+            weightSum[numpy.logical_not(invalid)] += weight
+
+    if weightedSum is None:
+        # there are no time slices
+        outShape = tuple(size for dim, size in zip(da.dims, da.shape)
+                         if dim != 'Time')
+        weightedSum = numpy.zeros(outShape)
+        if maskVaries:
+            weightSum = numpy.zeros(outShape)
+        if computeMoments:
+            moments = _get_empty_moments(outShape)
+
+    if computeMoments:
+        moments = _finalize_moments(moments)
+
+    return weightedSum, weightSum, moments  # }}}
+
+
+def _get_empty_moments(shape):  # {{{
+    '''
+    Running weights, mean, sum of squared deviations from the mean and
+    extremes of a field with no valid values yet
+    '''
+    return {'weight': numpy.zeros(shape),
+            'mean': numpy.zeros(shape),
+            'm2': numpy.zeros(shape),
+            'min': numpy.full(shape, numpy.nan),
+            'max': numpy.full(shape, numpy.nan)}  # }}}
 
-        dsWeightedSum = (ds * ds.daysInMonth).sum(dim='Time', keep_attrs=True)
 
-        timeMean = dsWeightedSum / days.where(days > 0.)
+def _update_moments(moments, field, valid, weight):  # {{{
+    '''
+    Update the running moments in place with a field (valid where ``valid``)
+    with the given weight
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    numpy.fmin(moments['min'], field, out=moments['min'])
+    numpy.fmax(moments['max'], field, out=moments['max'])
+
+    runningWeight = moments['weight']
+    mean = moments['mean']
+    runningWeight[valid] += weight
+    delta = field[valid] - mean[valid]
+    mean[valid] += delta*weight/runningWeight[valid]
+    moments['m2'][valid] += weight*delta*(field[valid] - mean[valid])
+    # }}}
+
+
+def _finalize_moments(moments):  # {{{
+    '''
+    The variance, minimum and maximum from running moments, with NaNs where
+    there were no valid values
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    variance = moments['m2']
+    valid = moments['weight'] > 0.
+    variance[valid] /= moments['weight'][valid]
+    variance[numpy.logical_not(valid)] = numpy.nan
+    return {'variance': variance, 'min': moments['min'],
+            'max': moments['max']}  # }}}
+
+
+def _remove_time(da, data):  # {{{
+    '''
+    A data array like ``da`` (with the same name, attributes and coordinates)
+    but without the ``Time`` dimension, containing ``data``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
 
-    return timeMean  # }}}
+    dims = [dim for dim in da.dims if dim != 'Time']
+    coords = OrderedDict()
+    for coord in da.coords:
+        if 'Time' not in da.coords[coord].dims:
+            coords[coord] = da.coords[coord]
+    return xr.DataArray(data, dims=dims, coords=coords, attrs=da.attrs,
+                        name=da.name)  # }}}
 
 
 def _matches_comparison(obsDescriptor, comparisonDescriptor):  # {{{
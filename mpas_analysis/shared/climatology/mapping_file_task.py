@@ -0,0 +1,237 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+Tasks for building the mapping files needed to remap climatologies, so that
+mapping files are built in parallel and only once, no matter how many tasks
+need them
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import threading
+import weakref
+from collections import OrderedDict
+
+from mpas_analysis.shared.analysis_task import AnalysisTask
+
+from mpas_analysis.shared.io.utility import build_config_full_path, \
+    make_directories
+
+# the mapping-file tasks for each config, with the id of the config as the
+# key and a weak reference to the config and a dictionary of tasks as values
+_mappingFileTasks = {}
+_mappingFileTasksLock = threading.Lock()
+
+
+def get_mapping_file_task(config, componentName, mappingName):  # {{{
+    '''
+    Get the task that builds the mapping file(s) with the given name,
+    creating it the first time it is requested, so that every subtask that
+    needs a mapping file can run after the same task
+
+    Parameters
+    ----------
+    config :  instance of ``MpasAnalysisConfigParser``
+        Contains configuration options
+
+    componentName :  {'ocean', 'seaIce'}
+        The name of the component of the first subtask that needs the mapping
+        file(s)
+
+    mappingName : str
+        A name that identifies the source mesh or grid (or the observations
+        on it), the comparison grid and the method of interpolation, e.g.
+        ``map_oQU240_to_latlon_bilinear``
+
+    Returns
+    -------
+    mappingFileTask : ``MappingFileTask``
+        The task that builds the mapping file(s)
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    with _mappingFileTasksLock:
+        configRef, tasks = _mappingFileTasks.get(id(config), (None, None))
+        if configRef is None or configRef() is not config:
+            # this config hasn't been seen before (though another config that
+            # has since been deleted may have had the same id)
+            tasks = OrderedDict()
+            _mappingFileTasks[id(config)] = (weakref.ref(config), tasks)
+
+        if mappingName not in tasks:
+            tasks[mappingName] = MappingFileTask(config, componentName,
+                                                 mappingName)
+        return tasks[mappingName]  # }}}
+
+
+class MappingFileTask(AnalysisTask):  # {{{
+    '''
+    A task for building the mapping files for remapping from one source mesh
+    or grid to one comparison grid with one method of interpolation.  Tasks
+    that remap climatologies register their remappers with
+    ``add_remapper()`` during setup and run after this task, which builds
+    the mapping files that don't already exist.  Building each mapping file
+    is guarded by a lock file, so other runs sharing the same mapping
+    directory won't build it at the same time.
+
+    Attributes
+    ----------
+    remappers : ``OrderedDict``
+        The remappers (``shared.interpolation.Remapper``) and the arguments to
+        ``build_mapping_file()`` for each mapping file to build
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, config, componentName, mappingName):  # {{{
+        '''
+        Construct the task.  Typically, ``get_mapping_file_task()`` should be
+        used instead so each mapping file has only one task
+
+        Parameters
+        ----------
+        config :  instance of ``MpasAnalysisConfigParser``
+            Contains configuration options
+
+        componentName :  {'ocean', 'seaIce'}
+            The name of the component
+
+        mappingName : str
+            A name that identifies the source, comparison grid and method of
+            interpolation, used as the name of the subtask
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # call the constructor from the base class (AnalysisTask)
+        super(MappingFileTask, self).__init__(
+            config=config,
+            taskName='mappingFile',
+            subtaskName=mappingName,
+            componentName=componentName,
+            tags=['mapping'])
+
+        # ESMF_RegridWeightGen can take a while and a lot of memory for
+        # high-resolution meshes
+        self.memory = 2.0
+        self.expectedDuration = 300.
+
+        self.remappers = OrderedDict()
+        self._lock = threading.Lock()
+        # }}}
+
+    def setup_and_check(self):  # {{{
+        '''
+        Make the directory for mapping files in the output directory
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # first, call setup_and_check from the base class (AnalysisTask),
+        # which will perform some common setup
+        super(MappingFileTask, self).setup_and_check()
+
+        mappingSubdirectory = build_config_full_path(self.config, 'output',
+                                                     'mappingSubdirectory')
+        make_directories(mappingSubdirectory)
+        # }}}
+
+    def add_remapper(self, remapper, method, useNative=False):  # {{{
+        '''
+        Add a remapper whose mapping file this task should build.  This is
+        called during the setup of the tasks that will use the remapper.
+
+        Parameters
+        ----------
+        remapper : ``shared.interpolation.Remapper``
+            The remapper, with the mapping file name that will be built
+
+        method : {'bilinear', 'neareststod', 'conserve'}
+            The method of interpolation
+
+        useNative : bool, optional
+            Whether to compute supported weights in MPAS-Analysis rather than
+            with ``ESMF_RegridWeightGen``
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if remapper.mappingFileName is None:
+            # no remapping is needed
+            return
+
+        # tasks may be set up in several threads at once
+        with self._lock:
+            if remapper.mappingFileName not in self.remappers:
+                self.remappers[remapper.mappingFileName] = \
+                    (remapper, method, useNative)
+        # }}}
+
+    def get_output_files(self):  # {{{
+        '''
+        Get the mapping files
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.remappers.keys())  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        '''
+        Get the mapping files and methods of interpolation
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return {'mappingFiles': [[mappingFileName, method, useNative] for
+                                 mappingFileName, (_, method, useNative) in
+                                 self.remappers.items()]}  # }}}
+
+    def run_task(self):  # {{{
+        '''
+        Build the mapping files that don't exist yet
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        for remapper, method, useNative in self.remappers.values():
+            self.logger.info('Mapping file: {}'.format(
+                remapper.mappingFileName))
+            remapper.build_mapping_file(method=method, logger=self.logger,
+                                        useNative=useNative)
+        # }}}
+
+    # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -14,20 +14,32 @@ from __future__ import absolute_import, division, print_function, \
 
 import xarray
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import hashlib
+import numpy
+from collections import OrderedDict
 from distutils.spawn import find_executable
 
 from mpas_analysis.shared.analysis_task import AnalysisTask
 
 from mpas_analysis.shared.climatology.climatology import \
     get_unmasked_mpas_climatology_directory, \
-    get_unmasked_mpas_climatology_file_name
+    get_unmasked_mpas_climatology_file_name, get_statistic_variable_name, \
+    check_statistics
+from mpas_analysis.shared.climatology.native_climatology import \
+    compute_native_climatologies, add_climatology_variables
 
 from mpas_analysis.shared.io.utility import build_config_full_path, \
     make_directories, get_files_year_month
 
 from mpas_analysis.shared.constants import constants
 
+# tasks may be set up in parallel threads, each adding variables and seasons
+_addVariablesLock = threading.Lock()
+
 
 class MpasClimatologyTask(AnalysisTask):  # {{{
     '''
@@ -50,12 +62,25 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
         over which the climatology should be computed or ``[]`` if only
         monthly climatologies are needed.
 
+    statistics : ``OrderedDict``
+        For each variable, a list of statistics (from
+        ``constants.climatologyStatistics``) to compute along with the mean
+
+    verticalSlices : ``OrderedDict``
+        For each slice name, a dictionary with the ``variableList``,
+        ``verticalIndices`` and ``seasons`` of climatologies that are only
+        computed at a given vertical index in each cell
+
     inputFiles : list of str
         A list of input files used to compute the climatologies.
 
     ncclimoModel : {'mpaso', 'mpascice'}
         The name of the component expected by ``ncclimo``
 
+    useNcclimo : bool
+        Whether climatologies are computed with ``ncclimo`` or with
+        ``compute_native_climatologies()``
+
     startDate, endDate : str
         The start and end dates of the climatology as strings
 
@@ -89,6 +114,8 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
 
         self.variableList = []
         self.seasons = []
+        self.statistics = OrderedDict()
+        self.verticalSlices = OrderedDict()
 
         tags = ['climatology']
 
@@ -114,9 +141,37 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
             componentName=componentName,
             tags=tags)
 
+        self.useNcclimo = config.getWithDefault('climatology', 'useNcclimo',
+                                                default=True)
+
+        # ncclimo spawns one process per month in "bck" and "mpi" modes, each
+        # holding a month's worth of data in memory.  It can make do with
+        # fewer parallel jobs (down to running in serial) if fewer cores are
+        # free.
+        # Likewise, the native climatology code can split variables among
+        # as many processes as are free.
+        parallelMode = config.getWithDefault('execute', 'ncclimoParallelMode',
+                                             default='serial')
+        if not self.useNcclimo:
+            self.cores = config.getWithDefault(
+                'execute', 'climatologyProcessCount', default=1)
+            self.minCores = 1
+            self.memory = 2.0*self.cores
+        elif parallelMode in ['bck', 'mpi']:
+            self.cores = 12
+            self.minCores = 1
+            self.memory = 12.0
+        else:
+            self.cores = 1
+            self.memory = 2.0
+
+        # computing climatologies is typically the slowest step of a run
+        self.expectedDuration = 1800.
+
         # }}}
 
-    def add_variables(self, variableList, seasons=None):  # {{{
+    def add_variables(self, variableList, seasons=None,
+                      statistics=None):  # {{{
         '''
         Add one or more variables and optionally one or more seasons for which
         to compute climatologies.
@@ -132,13 +187,22 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
             to be computed or ``None`` if only monthly
             climatologies are needed.
 
+        statistics : list of str, optional
+            A list of statistics (from ``constants.climatologyStatistics``)
+            of each variable to compute along with the mean, without reading
+            the ``timeSeriesStatsMonthly`` output again.  Statistics are
+            stored in the climatology files as variables named with
+            ``get_statistic_variable_name()``.
+
         Raises
         ------
         ValueError
             if this funciton is called before this task has been set up (so
-            the list of available variables has not yet been set) or if one
+            the list of available variables has not yet been set), if one
             or more of the requested variables is not available in the
-            ``timeSeriesStatsMonthly`` output.
+            ``timeSeriesStatsMonthly`` output or if statistics are requested
+            but climatologies are computed with ``ncclimo`` or a statistic is
+            not supported.
         '''
         # Authors
         # -------
@@ -151,19 +215,100 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
                              'or add_variables() is being called in the wrong '
                              'place.')
 
-        for variable in variableList:
-            if variable not in self.allVariables:
-                raise ValueError(
-                        '{} is not available in timeSeriesStatsMonthly '
-                        'output:\n{}'.format(variable, self.allVariables))
+        if statistics is not None:
+            check_statistics(statistics)
+            if self.useNcclimo:
+                raise ValueError('Climatology statistics other than the mean '
+                                 'are only supported when useNcclimo = False')
+
+        with _addVariablesLock:
+            for variable in variableList:
+                if variable not in self.allVariables:
+                    raise ValueError(
+                            '{} is not available in timeSeriesStatsMonthly '
+                            'output:\n{}'.format(variable, self.allVariables))
+
+                if variable not in self.variableList:
+                    self.variableList.append(variable)
+
+                if statistics is not None:
+                    variableStatistics = self.statistics.setdefault(variable,
+                                                                    [])
+                    for statistic in statistics:
+                        if statistic not in variableStatistics:
+                            variableStatistics.append(statistic)
+
+            if seasons is not None:
+                for season in seasons:
+                    if season not in self.seasons:
+                        self.seasons.append(season)
+
+        # }}}
+
+    def add_vertical_slices(self, sliceName, variableList, verticalIndices,
+                            seasons):  # {{{
+        '''
+        Add variables for which climatologies are only needed at a given
+        vertical index in each cell (e.g. at a set of depths or at the sea
+        floor).  Only the needed levels are read and averaged, and the
+        resulting climatologies (see ``get_slice_file_name()``) have
+        dimensions ``depthSlice`` and ``nCells`` in place of ``nCells`` and
+        ``nVertLevels``.  Variables without a vertical dimension are included
+        unchanged.
+
+        Parameters
+        ----------
+        sliceName : str
+            A unique name for the slices, used in file names
+
+        variableList : list of str
+            A list of variable names in ``timeSeriesStatsMonthly`` to be
+            included in the climatologies
 
-            if variable not in self.variableList:
-                self.variableList.append(variable)
+        verticalIndices : numpy.ndarray
+            The zero-based vertical index in each cell (second dimension) of
+            each slice (first dimension).  Invalid indices (e.g. -1) give
+            the MPAS fill value.
 
-        if seasons is not None:
-            for season in seasons:
-                if season not in self.seasons:
-                    self.seasons.append(season)
+        seasons : list of str
+            A list of seasons (keys in ``shared.constants.monthDictionary``)
+            to be computed
+
+        Raises
+        ------
+        ValueError
+            if this function is called before this task has been set up, if
+            climatologies are computed with ``ncclimo`` (which doesn't
+            support vertical slices) or if one or more of the requested
+            variables is not available in the ``timeSeriesStatsMonthly``
+            output.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.allVariables is None:
+            raise ValueError('add_vertical_slices() can only be called after '
+                             'setup_and_check() in MpasClimatologyTask.')
+
+        if self.useNcclimo:
+            raise ValueError('Vertical slices are only supported when '
+                             'useNcclimo = False')
+
+        with _addVariablesLock:
+            for variable in variableList:
+                if variable not in self.allVariables:
+                    raise ValueError(
+                            '{} is not available in timeSeriesStatsMonthly '
+                            'output:\n{}'.format(variable, self.allVariables))
+
+            verticalIndices = numpy.array(verticalIndices)
+            self.verticalSlices[sliceName] = \
+                {'variableList': list(variableList),
+                 'verticalIndices': verticalIndices,
+                 'seasons': list(seasons),
+                 'hash': _get_vertical_slice_hash(verticalIndices,
+                                                  variableList)}
 
         # }}}
 
@@ -210,13 +355,99 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
                           '{}.'.format(streamName, self.startDate,
                                        self.endDate))
 
-        self.symlinkDirectory = self._create_symlinks()
+        if self.useNcclimo:
+            self.symlinkDirectory = self._create_symlinks()
+        else:
+            # the native climatology code reads the files directly
+            self.symlinkDirectory = None
 
         with xarray.open_dataset(self.inputFiles[0]) as ds:
             self.allVariables = list(ds.data_vars.keys())
 
         # }}}
 
+    def get_input_files(self):  # {{{
+        '''
+        Get the history files the climatology is computed from
+
+        Returns
+        -------
+        inputFiles : list of str
+            The input files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.inputFiles)  # }}}
+
+    def get_input_variables(self):  # {{{
+        '''
+        Get the variables read from the history files
+
+        Returns
+        -------
+        variableList : list of str
+            The variables in the climatology
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.variableList)  # }}}
+
+    def get_output_files(self):  # {{{
+        '''
+        Get the climatology file of each season and of each season of the
+        vertical slices
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        outputFiles = [self.get_file_name(season) for season in self.seasons]
+        for sliceName, verticalSlice in self.verticalSlices.items():
+            outputFiles.extend([self.get_slice_file_name(season, sliceName)
+                                for season in verticalSlice['seasons']])
+        return outputFiles  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        '''
+        Get the variables, seasons and years of the climatology
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        verticalSlices = {}
+        for sliceName, verticalSlice in self.verticalSlices.items():
+            verticalSlices[sliceName] = {
+                'variableList': sorted(verticalSlice['variableList']),
+                'seasons': sorted(verticalSlice['seasons']),
+                'verticalIndices': verticalSlice['hash']}
+
+        statistics = dict([(variableName, sorted(variableStatistics))
+                           for variableName, variableStatistics in
+                           self.statistics.items()])
+
+        # the order variables and seasons were added doesn't matter
+        return {'variableList': sorted(self.variableList),
+                'seasons': sorted(self.seasons),
+                'statistics': statistics,
+                'verticalSlices': verticalSlices,
+                'startYear': self.startYear,
+                'endYear': self.endYear}  # }}}
+
     def run_task(self):  # {{{
         '''
         Compute the requested climatologies
@@ -225,7 +456,7 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
         # -------
         # Xylar Asay-Davis
 
-        if len(self.variableList) == 0:
+        if len(self.variableList) == 0 and len(self.verticalSlices) == 0:
             # nothing to do
             return
 
@@ -239,30 +470,43 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
             if season not in seasonsToCheck:
                 seasonsToCheck.append(season)
 
-        allExist = True
-        for season in seasonsToCheck:
+        climatologyDirectory = get_unmasked_mpas_climatology_directory(
+                self.config)
 
-            climatologyFileName = self.get_file_name(season)
-            climatologyDirectory = get_unmasked_mpas_climatology_directory(
-                    self.config)
+        if not self.config.getWithDefault('climatology', 'cachePartialSums',
+                                          default=False):
+            self._purge_partial_sums()
+        elif self.useNcclimo:
+            self.logger.warning('Warning: cachePartialSums = True has no '
+                                'effect because climatologies are computed '
+                                'with ncclimo.  Set useNcclimo = False to '
+                                'store and reuse the sums for each year.')
 
-            if not os.path.exists(climatologyFileName):
-                allExist = False
-                break
+        self._compute_vertical_slices()
 
-        if allExist:
-            # make sure all the necessary variables are also present
-            ds = xarray.open_dataset(self.get_file_name(seasonsToCheck[0]))
+        if len(self.variableList) == 0:
+            variableList = []
+        else:
+            variableList = self._get_missing_variables(seasonsToCheck)
+        if len(variableList) == 0:
+            self.logger.info('All climatologies already exist.')
+            return
 
-            for variableName in self.variableList:
-                if variableName not in ds.variables:
-                    allExist = False
-                    break
+        # if the climatology files already exist, the missing variables are
+        # computed on their own and added to the existing files
+        addVariables = variableList != self.variableList
+        if addVariables:
+            self.logger.info('Adding variables to existing climatologies:\n'
+                             '    {}'.format(', '.join(variableList)))
 
-        if not allExist:
+        if self.useNcclimo:
             self._compute_climatologies_with_ncclimo(
                     inDirectory=self.symlinkDirectory,
-                    outDirectory=climatologyDirectory)
+                    outDirectory=climatologyDirectory,
+                    variableList=variableList, addVariables=addVariables)
+        else:
+            self._compute_climatologies_natively(seasonsToCheck, variableList,
+                                                 addVariables)
 
         # }}}
 
@@ -314,6 +558,178 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
 
         # }}}
 
+    def get_slice_file_name(self, season, sliceName):  # {{{
+        """
+        Returns the full path for the MPAS climatology file of variables
+        added with ``add_vertical_slices()``.  The directory name includes a
+        hash of the vertical indices and variables, so a file computed for
+        other levels or variables is never reused.
+
+        Parameters
+        ----------
+        season : str
+            One of the seasons in ``constants.monthDictionary``
+
+        sliceName : str
+            The name of the slices
+
+        Returns
+        -------
+        fileName : str
+            The path to the climatology file for the specified season.
+
+        Raises
+        ------
+        ValueError
+            If no slices with this name have been added
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if sliceName not in self.verticalSlices:
+            raise ValueError('Vertical slices {} have not been added with '
+                             'add_vertical_slices()'.format(sliceName))
+
+        fileName = self.get_file_name(season)
+        directory = '{}/slices/{}'.format(
+            os.path.dirname(fileName),
+            _get_slice_directory_name(sliceName,
+                                      self.verticalSlices[sliceName]))
+        make_directories(directory)
+        return '{}/{}'.format(directory, os.path.basename(fileName))
+
+        # }}}
+
+    def _get_missing_variables(self, seasons):  # {{{
+        '''
+        Find the variables that are missing from the climatology files
+
+        Parameters
+        ----------
+        seasons : list of str
+            The months and seasons to check
+
+        Returns
+        -------
+        variableList : list of str
+            The variables that need to be computed: all variables if any of
+            the climatology files doesn't exist, otherwise those missing from
+            any of the files (or with missing statistics)
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        missingVariables = set()
+        for season in seasons:
+            climatologyFileName = self.get_file_name(season)
+            if not os.path.exists(climatologyFileName):
+                return list(self.variableList)
+
+            with xarray.open_dataset(climatologyFileName) as ds:
+                for variableName in self.variableList:
+                    names = [variableName] + \
+                        [get_statistic_variable_name(variableName, statistic)
+                         for statistic in
+                         self.statistics.get(variableName, [])]
+                    if any([name not in ds.variables for name in names]):
+                        missingVariables.add(variableName)
+
+        # keep the order in which variables were added
+        return [variableName for variableName in self.variableList
+                if variableName in missingVariables]  # }}}
+
+    def _compute_vertical_slices(self):  # {{{
+        '''
+        Compute the climatologies added with ``add_vertical_slices()`` that
+        don't already exist
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if len(self.verticalSlices) == 0:
+            return
+
+        fileNames = sorted(self.inputFiles)
+        years, months = get_files_year_month(fileNames,
+                                             self.historyStreams,
+                                             'timeSeriesStatsMonthlyOutput')
+
+        processCount = self.allottedCores
+        if processCount is None:
+            processCount = self.cores
+
+        for sliceName, verticalSlice in self.verticalSlices.items():
+            outFileNames = {}
+            for season in verticalSlice['seasons']:
+                fileName = self.get_slice_file_name(season, sliceName)
+                if not os.path.exists(fileName):
+                    outFileNames[season] = fileName
+
+            if len(outFileNames) == 0:
+                continue
+
+            self.logger.info('Computing climatologies of {} at vertical '
+                             'slices {}'.format(
+                                 ', '.join(verticalSlice['variableList']),
+                                 sliceName))
+
+            cacheDirectory = self._get_partial_sums_directory(
+                'slices/{}'.format(_get_slice_directory_name(sliceName,
+                                                             verticalSlice)))
+
+            compute_native_climatologies(
+                inputFiles=fileNames, years=years, months=months,
+                variableList=verticalSlice['variableList'],
+                outFileNames=outFileNames, calendar=self.calendar,
+                processCount=processCount, cacheDirectory=cacheDirectory,
+                verticalIndices=verticalSlice['verticalIndices'],
+                logger=self.logger)
+
+        # }}}
+
+    def _get_partial_sums_directory(self, subdirectory=None):  # {{{
+        '''
+        The directory where partial sums for each year are cached, or
+        ``None`` if ``cachePartialSums`` is ``False``
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if not self.config.getWithDefault('climatology', 'cachePartialSums',
+                                          default=False):
+            return None
+
+        climatologyBaseDirectory = build_config_full_path(
+            self.config, 'output', 'mpasClimatologySubdirectory')
+        cacheDirectory = '{}/partialSums/{}'.format(climatologyBaseDirectory,
+                                                    self.ncclimoModel)
+        if subdirectory is not None:
+            cacheDirectory = '{}/{}'.format(cacheDirectory, subdirectory)
+        return cacheDirectory  # }}}
+
+    def _purge_partial_sums(self):  # {{{
+        '''
+        Remove the partial sums cached by earlier runs, freeing the disk
+        space once ``cachePartialSums`` has been turned off
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        climatologyBaseDirectory = build_config_full_path(
+            self.config, 'output', 'mpasClimatologySubdirectory')
+        cacheDirectory = '{}/partialSums/{}'.format(climatologyBaseDirectory,
+                                                    self.ncclimoModel)
+        if os.path.exists(cacheDirectory):
+            self.logger.info('Removing cached partial sums in {}'.format(
+                cacheDirectory))
+            shutil.rmtree(cacheDirectory, ignore_errors=True)
+        # }}}
+
     def _create_symlinks(self):  # {{{
         """
         Create symlinks to monthly mean files so they have the expected file
@@ -356,11 +772,85 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
 
         # }}}
 
+    def _compute_climatologies_natively(self, seasons, variableList,
+                                        addVariables):  # {{{
+        '''
+        Compute monthly and seasonal climatologies directly in MPAS-Analysis,
+        without ``ncclimo``, splitting variables among the cores allotted to
+        this task.  If ``cachePartialSums`` is ``True``, partial sums for
+        each year are kept in the ``partialSums`` subdirectory of the MPAS
+        climatology directory so that climatologies over other year ranges
+        only need to read years that haven't been read before.
+
+        Parameters
+        ----------
+        seasons : list of str
+            The months and seasons to compute
+
+        variableList : list of str
+            The variables to compute
+
+        addVariables : bool
+            Whether to add the variables to existing climatology files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        fileNames = sorted(self.inputFiles)
+        years, months = get_files_year_month(fileNames,
+                                             self.historyStreams,
+                                             'timeSeriesStatsMonthlyOutput')
+
+        processCount = self.allottedCores
+        if processCount is None:
+            processCount = self.cores
+
+        if addVariables:
+            tempDirectory = tempfile.mkdtemp(
+                dir=get_unmasked_mpas_climatology_directory(self.config),
+                prefix='.climatology')
+        outFileNames = {}
+        for season in seasons:
+            outFileNames[season] = self.get_file_name(season)
+            if addVariables:
+                outFileNames[season] = '{}/{}'.format(
+                    tempDirectory, os.path.basename(outFileNames[season]))
+
+        cacheDirectory = self._get_partial_sums_directory()
+
+        statistics = dict([(variableName, self.statistics[variableName])
+                           for variableName in variableList
+                           if variableName in self.statistics])
+
+        try:
+            compute_native_climatologies(
+                inputFiles=fileNames, years=years, months=months,
+                variableList=variableList, outFileNames=outFileNames,
+                calendar=self.calendar, processCount=processCount,
+                cacheDirectory=cacheDirectory, statistics=statistics,
+                logger=self.logger)
+
+            if addVariables:
+                for season in seasons:
+                    add_climatology_variables(self.get_file_name(season),
+                                              outFileNames[season])
+        finally:
+            if addVariables:
+                shutil.rmtree(tempDirectory, ignore_errors=True)
+
+        # }}}
+
     def _compute_climatologies_with_ncclimo(self, inDirectory, outDirectory,
+                                            variableList=None,
+                                            addVariables=False,
                                             remapper=None,
                                             remappedDirectory=None):  # {{{
         '''
         Uses ncclimo to compute monthly, seasonal and/or annual climatologies.
+        ncclimo writes to temporary directories and the climatologies are
+        moved to the output directories once it has finished, so that a run
+        that is killed part way through doesn't leave partial files behind.
 
         Parameters
         ----------
@@ -370,6 +860,14 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
         outDirectory : str
             The output directory where climatologies will be written
 
+        variableList : list of str, optional
+            The variables to compute, by default all variables in the
+            climatology
+
+        addVariables : bool, optional
+            Whether to add the variables to existing climatology files
+            rather than replacing them
+
         remapper : ``shared.intrpolation.Remapper`` object, optional
             If present, a remapper that defines the source and desitnation
             grids for remapping the climatologies.
@@ -397,31 +895,53 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
                           'Note: this presumes use of the conda-forge '
                           'channel.')
 
+        if variableList is None:
+            variableList = self.variableList
+
         parallelMode = self.config.get('execute', 'ncclimoParallelMode')
 
+        # use the cores the scheduler allotted to this task (if any)
+        cores = self.allottedCores
+        if cores is None:
+            cores = self.cores
+
+        if parallelMode in ['bck', 'mpi'] and cores > 1:
+            # ncclimo runs this many jobs at once, each in its own process
+            parallelArgs = ['-p', parallelMode, '-j', '{}'.format(cores)]
+            threads = 1
+        else:
+            parallelArgs = ['-p', 'serial']
+            threads = cores
+
         seasons = [season for season in self.seasons
                    if season not in constants.abrevMonthNames]
 
         if len(seasons) == 0:
             seasons = ['none']
 
+        tempDirectories = {outDirectory: tempfile.mkdtemp(
+            dir=outDirectory, prefix='.ncclimo')}
+        if remapper is not None and remappedDirectory is not None and \
+                remappedDirectory not in tempDirectories:
+            tempDirectories[remappedDirectory] = tempfile.mkdtemp(
+                dir=remappedDirectory, prefix='.ncclimo')
+
         args = ['ncclimo',
                 '-4',
                 '--clm_md=mth',
                 '-a', 'sdd',
-                '-m', self.ncclimoModel,
-                '-p', parallelMode,
-                '-v', ','.join(self.variableList),
+                '-m', self.ncclimoModel] + parallelArgs + [
+                '-v', ','.join(variableList),
                 '--seasons={}'.format(','.join(seasons)),
                 '-s', '{:04d}'.format(self.startYear),
                 '-e', '{:04d}'.format(self.endYear),
                 '-i', inDirectory,
-                '-o', outDirectory]
+                '-o', tempDirectories[outDirectory]]
 
         if remapper is not None:
             args.extend(['-r', remapper.mappingFileName])
             if remappedDirectory is not None:
-                args.extend(['-O', remappedDirectory])
+                args.extend(['-O', tempDirectories[remappedDirectory]])
 
         self.logger.info('running: {}'.format(' '.join(args)))
         for handler in self.logger.handlers:
@@ -431,26 +951,62 @@ class MpasClimatologyTask(AnalysisTask):  # {{{
         # local version of NCO instead of one we have intentionally loaded
         env = os.environ.copy()
         env['NCO_PATH_OVERRIDE'] = 'No'
+        # keep any OpenMP threading within the cores allotted to this task,
+        # which are already shared among jobs if there are several
+        env['OMP_NUM_THREADS'] = '{}'.format(threads)
+
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, env=env)
+            stdout, stderr = process.communicate()
+
+            if stdout:
+                stdout = stdout.decode('utf-8')
+                for line in stdout.split('\n'):
+                    self.logger.info(line)
+            if stderr:
+                stderr = stderr.decode('utf-8')
+                for line in stderr.split('\n'):
+                    self.logger.error(line)
+
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode,
+                                                    ' '.join(args))
+
+            for directory, tempDirectory in tempDirectories.items():
+                for fileName in os.listdir(tempDirectory):
+                    inFileName = '{}/{}'.format(tempDirectory, fileName)
+                    outFileName = '{}/{}'.format(directory, fileName)
+                    if addVariables and os.path.exists(outFileName):
+                        add_climatology_variables(outFileName, inFileName)
+                    else:
+                        os.rename(inFileName, outFileName)
+        finally:
+            for tempDirectory in tempDirectories.values():
+                shutil.rmtree(tempDirectory, ignore_errors=True)
 
-        process = subprocess.Popen(args, stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE, env=env)
-        stdout, stderr = process.communicate()
+        # }}}
+    # }}}
 
-        if stdout:
-            stdout = stdout.decode('utf-8')
-            for line in stdout.split('\n'):
-                self.logger.info(line)
-        if stderr:
-            stderr = stderr.decode('utf-8')
-            for line in stderr.split('\n'):
-                self.logger.error(line)
 
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode,
-                                                ' '.join(args))
+def _get_vertical_slice_hash(verticalIndices, variableList):  # {{{
+    '''
+    A hash of the vertical indices and variables of vertical slices
+    '''
+    verticalIndices = numpy.ascontiguousarray(verticalIndices,
+                                              dtype=numpy.int64)
+    sliceHash = hashlib.md5(verticalIndices.tobytes())
+    sliceHash.update(str(verticalIndices.shape).encode('utf-8'))
+    sliceHash.update(','.join(sorted(variableList)).encode('utf-8'))
+    return sliceHash.hexdigest()  # }}}
 
-        # }}}
-    # }}}
+
+def _get_slice_directory_name(sliceName, verticalSlice):  # {{{
+    '''
+    The name of the directory for climatologies (or partial sums) of
+    vertical slices
+    '''
+    return '{}_{}'.format(sliceName, verticalSlice['hash'][0:12])  # }}}
 
 
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,1083 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+Computing monthly and seasonal climatologies from ``timeSeriesStatsMonthly``
+output directly in MPAS-Analysis, as an alternative to ``ncclimo``
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import shutil
+import hashlib
+import multiprocessing
+from calendar import isleap
+
+import numpy
+import netCDF4
+import xarray
+
+from mpas_analysis.shared.constants import constants
+from mpas_analysis.shared.io.utility import get_temp_file_name, \
+    make_directories
+from mpas_analysis.shared.climatology.climatology import \
+    get_statistic_variable_name, get_statistic_attributes
+
+# the value MPAS uses for invalid (e.g. land) points
+mpasFillValue = -9.99999979021476795361e+33
+
+
+def compute_native_climatologies(inputFiles, years, months, variableList,
+                                 outFileNames, calendar, processCount=1,
+                                 cacheDirectory=None, verticalIndices=None,
+                                 statistics=None, logger=None):  # {{{
+    '''
+    Compute monthly and seasonal climatologies of monthly-mean MPAS output,
+    reading each input file once.
+
+    The days-weighted sums for each year are computed first and then added
+    together.  If ``cacheDirectory`` is given, these partial sums are stored
+    there (one file per variable and year) and reused for any other
+    climatology that includes the same year, so that only years that have
+    not been seen before are read from the input files.
+
+    The monthly climatology for each month is the mean over years of that
+    month, weighted by the number of days in the month in each year.
+    Seasonal climatologies are the mean of the monthly climatologies in the
+    season, weighted by the number of days in each month (as in ``ncclimo``).
+    Points that are masked or have the MPAS fill value in a given month don't
+    contribute to the mean, and points with no valid values are given the
+    MPAS fill value.
+
+    Other statistics can be accumulated while the files are read for the
+    mean.  The variance is the variance of the monthly means in each month
+    or season about their mean, weighted by the number of days in each
+    month.  It is computed from the sum of squared deviations from the mean,
+    which is updated with each month and combined across years and months
+    with the pairwise formula of Chan et al. (1979), so that it is
+    numerically stable and can be cached along with the sums.  The minimum
+    and maximum are the extremes of the monthly means.
+
+    Parameters
+    ----------
+    inputFiles : list of str
+        The ``timeSeriesStatsMonthly`` files, each containing one month
+
+    years, months : list of int
+        The year and month of each input file
+
+    variableList : list of str
+        The variables to include in the climatologies
+
+    outFileNames : dict
+        The output file name for each season (keys in
+        ``constants.monthDictionary``), including each month for which a
+        monthly climatology is needed
+
+    calendar : {'gregorian', 'gregorian_noleap'}
+        The calendar used to determine the number of days in each month
+
+    processCount : int, optional
+        The number of processes among which the variables are split
+
+    cacheDirectory : str, optional
+        A directory where the partial sums for each variable and year are
+        stored
+
+    verticalIndices : numpy.ndarray, optional
+        An array of vertical indices with dimensions ``depthSlice`` and
+        ``nCells``.  If present, variables with dimensions ``nCells`` and
+        ``nVertLevels`` are only read and averaged at the given index in each
+        cell, and their climatologies have dimensions ``depthSlice`` and
+        ``nCells`` in place of ``nCells`` and ``nVertLevels``.  Indices
+        outside of the range of vertical levels give the MPAS fill value.
+
+    statistics : dict, optional
+        For each variable (a subset of ``variableList``), a list of
+        statistics (from ``constants.climatologyStatistics``) to compute in
+        addition to the mean.  Statistics are written as variables named
+        with ``get_statistic_variable_name()``.
+
+    logger : ``logging.Logger``, optional
+        A logger for progress messages
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if statistics is None:
+        statistics = {}
+
+    groups = _split_variables(inputFiles[0], variableList, processCount)
+
+    if logger is not None:
+        logger.info('Computing climatologies of {} variables from {} files '
+                    'in {} process(es)'.format(len(variableList),
+                                               len(inputFiles), len(groups)))
+
+    # each group of variables is written to its own set of temporary files
+    groupFileNames = []
+    argsList = []
+    for groupIndex, group in enumerate(groups):
+        fileNames = {}
+        for season, outFileName in outFileNames.items():
+            fileNames[season] = get_temp_file_name(
+                '{}.group{}.nc'.format(os.path.splitext(outFileName)[0],
+                                       groupIndex))
+        groupFileNames.append(fileNames)
+        argsList.append((inputFiles, years, months, group, fileNames,
+                         calendar, cacheDirectory, verticalIndices,
+                         statistics))
+
+    try:
+        if len(groups) == 1:
+            _compute_group(argsList[0])
+        else:
+            pool = multiprocessing.Pool(len(groups))
+            try:
+                pool.map(_compute_group, argsList)
+            finally:
+                pool.terminate()
+                pool.join()
+
+        for season, outFileName in outFileNames.items():
+            if len(groups) == 1:
+                os.rename(groupFileNames[0][season], outFileName)
+            else:
+                tempFileName = get_temp_file_name(outFileName)
+                _merge_files([fileNames[season]
+                              for fileNames in groupFileNames], tempFileName)
+                os.rename(tempFileName, outFileName)
+    finally:
+        for fileNames in groupFileNames:
+            for fileName in fileNames.values():
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+    # }}}
+
+
+def compute_native_climatology_windows(inputFiles, years, months,
+                                       variableList, windows, seasons,
+                                       calendar, cacheDirectory=None,
+                                       logger=None):  # {{{
+    '''
+    Compute climatologies over several ranges of years with one pass through
+    the monthly-mean MPAS output.
+
+    The days-weighted sums for each month are accumulated over years in
+    order, and the running sums are kept at the start and end of each range.
+    The climatology over a range of years is the difference between the
+    running sums at its end and just before its start, so the cost is a
+    single read of each input file regardless of the number of ranges.
+    Climatologies are otherwise computed as in
+    ``compute_native_climatologies()``, though differencing running sums
+    may change results by round-off.
+
+    This function is only an API for analysis that needs several ranges of
+    years: no task calls it yet, so ``MpasClimatologyTask`` and
+    ``RefYearMpasClimatologyTask`` still each read the history files for
+    their own range of years (though with ``useNcclimo = False`` and
+    ``cachePartialSums = True``, a year whose partial sums one of them has
+    cached is not read again by the other).  Unlike
+    ``compute_native_climatologies()``, it does not support statistics
+    other than the mean or vertical slices, and climatologies are returned
+    rather than written to files.
+
+    Parameters
+    ----------
+    inputFiles : list of str
+        The ``timeSeriesStatsMonthly`` files, each containing one month
+
+    years, months : list of int
+        The year and month of each input file
+
+    variableList : list of str
+        The variables to include in the climatologies
+
+    windows : list of tuple of int
+        The start and end year (inclusive) of each climatology
+
+    seasons : list of str
+        The months and seasons (keys in ``constants.monthDictionary``) to
+        compute for each range of years
+
+    calendar : {'gregorian', 'gregorian_noleap'}
+        The calendar used to determine the number of days in each month
+
+    cacheDirectory : str, optional
+        A directory where the partial sums for each variable and year are
+        stored
+
+    logger : ``logging.Logger``, optional
+        A logger for progress messages
+
+    Returns
+    -------
+    climatologies : dict of dict of ``xarray.Dataset``
+        The climatologies for each ``(startYear, endYear)`` in ``windows``
+        and each season
+
+    Raises
+    ------
+    ValueError
+        If there are no input files in one of the ranges of years
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    # only read years that are in at least one window
+    inWindow = [any([startYear <= year <= endYear
+                     for startYear, endYear in windows]) for year in years]
+    inputFiles = [fileName for fileName, keep in zip(inputFiles, inWindow)
+                  if keep]
+    months = [month for month, keep in zip(months, inWindow) if keep]
+    years = [year for year, keep in zip(years, inWindow) if keep]
+
+    # the last year with data at the end of each window and before its start
+    dataYears = sorted(set(years))
+    boundaries = {}
+    for startYear, endYear in windows:
+        before = [year for year in dataYears if year < startYear]
+        within = [year for year in dataYears if startYear <= year <= endYear]
+        if len(within) == 0:
+            raise ValueError('No input files were found between years {} and '
+                             '{}'.format(startYear, endYear))
+        if len(before) == 0:
+            boundaries[(startYear, endYear)] = (None, within[-1])
+        else:
+            boundaries[(startYear, endYear)] = (before[-1], within[-1])
+    snapshotYears = set()
+    for startBoundary, endBoundary in boundaries.values():
+        snapshotYears.update([startBoundary, endBoundary])
+
+    if logger is not None:
+        logger.info('Computing climatologies over {} ranges of years from {} '
+                    'files'.format(len(windows), len(inputFiles)))
+
+    sums, weights = _get_empty_sums()
+    snapshots = {None: _get_empty_sums()}
+    for year, yearSums, yearWeights, _ in _iterate_year_sums(
+            inputFiles, years, months, variableList, calendar,
+            cacheDirectory):
+        _add_sums(sums, weights, yearSums, yearWeights)
+        if year in snapshotYears:
+            snapshots[year] = _copy_sums(sums, weights)
+
+    dimensions = _get_dimensions(inputFiles[0], variableList)
+
+    climatologies = {}
+    for window in windows:
+        startBoundary, endBoundary = boundaries[window]
+        endSums, endWeights = snapshots[endBoundary]
+        startSums, startWeights = snapshots[startBoundary]
+        windowSums, windowWeights = _get_empty_sums()
+        for month in range(1, 13):
+            for variableName in endSums[month]:
+                fieldSum = endSums[month][variableName]
+                weight = endWeights[month][variableName]
+                if variableName in startSums[month]:
+                    fieldSum = fieldSum - startSums[month][variableName]
+                    weight = weight - startWeights[month][variableName]
+                    if numpy.isscalar(weight) and weight == 0.:
+                        # no files for this month in the window
+                        continue
+                windowSums[month][variableName] = fieldSum
+                windowWeights[month][variableName] = weight
+
+        monthlyMeans = _get_monthly_means(windowSums, windowWeights)
+        climatologies[window] = {}
+        for season in seasons:
+            ds = xarray.Dataset()
+            for variableName in variableList:
+                field = _get_season_mean(monthlyMeans, variableName, season)
+                field = numpy.where(field == mpasFillValue, numpy.nan, field)
+                ds[variableName] = (dimensions[variableName], field)
+            climatologies[window][season] = ds
+
+    return climatologies  # }}}
+
+
+def add_climatology_variables(fileName, inFileName):  # {{{
+    '''
+    Add the variables from one climatology file to another that doesn't
+    already have them.  The file is copied, the variables are added to the
+    copy and the copy then replaces the original, so that readers never see a
+    partially updated file.
+
+    Parameters
+    ----------
+    fileName : str
+        The climatology file to add variables to
+
+    inFileName : str
+        A climatology file with the same dimensions containing the variables
+        to add.  Variables that are already in ``fileName`` are skipped.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    tempFileName = get_temp_file_name(fileName)
+    shutil.copyfile(fileName, tempFileName)
+    try:
+        with netCDF4.Dataset(tempFileName, 'a') as outDs:
+            _copy_variables(inFileName, outDs)
+        os.rename(tempFileName, fileName)
+    finally:
+        if os.path.exists(tempFileName):
+            os.remove(tempFileName)
+    # }}}
+
+
+def get_days_in_month(year, month, calendar):  # {{{
+    '''
+    Get the number of days in a month of a given year
+
+    Parameters
+    ----------
+    year, month : int
+        The year and month (1-12)
+
+    calendar : {'gregorian', 'gregorian_noleap'}
+        The calendar
+
+    Returns
+    -------
+    days : int
+        The number of days in the month
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    days = int(constants.daysInMonth[month - 1])
+    if month == 2 and calendar == 'gregorian' and isleap(year):
+        days += 1
+    return days  # }}}
+
+
+def _split_variables(fileName, variableList, processCount):  # {{{
+    '''
+    Split the variables into at most ``processCount`` groups of roughly equal
+    size
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    groupCount = max(1, min(processCount, len(variableList)))
+    with netCDF4.Dataset(fileName, 'r') as ds:
+        sizes = [ds.variables[variableName].size
+                 for variableName in variableList]
+
+    groups = [[] for groupIndex in range(groupCount)]
+    groupSizes = [0]*groupCount
+    # the largest variables first, each to the smallest group so far
+    for index in numpy.argsort(sizes)[::-1]:
+        groupIndex = int(numpy.argmin(groupSizes))
+        groups[groupIndex].append(variableList[index])
+        groupSizes[groupIndex] += sizes[index]
+
+    # keep the variables in their original order within each group
+    for group in groups:
+        group.sort(key=variableList.index)
+
+    return groups  # }}}
+
+
+def _compute_group(args):  # {{{
+    '''
+    Compute the climatologies of a group of variables and write them to the
+    given files, one per season
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    inputFiles, years, months, variableList, outFileNames, calendar, \
+        cacheDirectory, verticalIndices, statistics = args
+
+    statistics = dict([(variableName, statistics[variableName])
+                       for variableName in variableList
+                       if variableName in statistics])
+
+    # the days-weighted sum of each variable for each month, and the total
+    # weight (a scalar unless some points are invalid in some months)
+    sums, weights = _get_empty_sums()
+    # the sum of squared deviations and extremes of variables with statistics
+    moments = _get_empty_moments()
+
+    for year, yearSums, yearWeights, yearMoments in _iterate_year_sums(
+            inputFiles, years, months, variableList, calendar,
+            cacheDirectory, verticalIndices, statistics):
+        _add_sums(sums, weights, yearSums, yearWeights, moments, yearMoments)
+
+    monthlyMeans = _get_monthly_means(sums, weights)
+
+    template = inputFiles[0]
+    for season, outFileName in outFileNames.items():
+        fields = {}
+        statisticFields = {}
+        for variableName in variableList:
+            fields[variableName] = _get_season_mean(monthlyMeans,
+                                                    variableName, season)
+            if variableName in statistics:
+                statisticFields[variableName] = _get_season_statistics(
+                    sums, weights, moments, variableName, season,
+                    statistics[variableName])
+        _write_climatology(template, outFileName, fields, verticalIndices,
+                           statisticFields)
+    # }}}
+
+
+def _iterate_year_sums(inputFiles, years, months, variableList, calendar,
+                       cacheDirectory, verticalIndices=None,
+                       statistics=None):  # {{{
+    '''
+    Yield the year and the days-weighted sums, weights and (for variables in
+    ``statistics``) moments of the variables for each month of that year, in
+    order of increasing year, reading from the cache where possible
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    for year in sorted(set(years)):
+        yearFiles = [(fileName, month) for fileName, fileYear, month in
+                     zip(inputFiles, years, months) if fileYear == year]
+        sources = _get_sources(yearFiles, calendar, verticalIndices)
+
+        yearSums, yearWeights = _get_empty_sums()
+        yearMoments = _get_empty_moments()
+        variablesToRead = []
+        for variableName in variableList:
+            if cacheDirectory is None or not _read_partial_sums(
+                    cacheDirectory, variableName, year, sources, yearSums,
+                    yearWeights, _get_variable_moments(
+                        yearMoments, variableName, statistics)):
+                variablesToRead.append(variableName)
+
+        if len(variablesToRead) > 0:
+            dimensions = _sum_year(yearFiles, year, variablesToRead, calendar,
+                                   yearSums, yearWeights, verticalIndices,
+                                   yearMoments, statistics)
+            if cacheDirectory is not None:
+                for variableName in variablesToRead:
+                    _write_partial_sums(
+                        cacheDirectory, variableName, year, sources,
+                        dimensions[variableName], yearSums, yearWeights,
+                        _get_variable_moments(yearMoments, variableName,
+                                              statistics))
+
+        yield year, yearSums, yearWeights, yearMoments
+    # }}}
+
+
+def _add_sums(sums, weights, yearSums, yearWeights, moments=None,
+              yearMoments=None):  # {{{
+    '''
+    Add the sums, weights and (optionally) moments for a year to running
+    totals.  Adding whole years in order gives the same result whether or not
+    the partial sums for each year came from the cache.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    # the totals are replaced rather than updated in place, so copies of the
+    # dictionaries serve as snapshots of the running totals
+    for month in range(1, 13):
+        for variableName, fieldSum in yearSums[month].items():
+            weight = yearWeights[month][variableName]
+            if yearMoments is not None and \
+                    variableName in yearMoments[month]:
+                if variableName in moments[month]:
+                    moments[month][variableName] = _merge_moments(
+                        sums[month][variableName],
+                        weights[month][variableName],
+                        moments[month][variableName], fieldSum, weight,
+                        yearMoments[month][variableName])
+                else:
+                    moments[month][variableName] = \
+                        yearMoments[month][variableName]
+            if variableName in sums[month]:
+                sums[month][variableName] = \
+                    sums[month][variableName] + fieldSum
+                weights[month][variableName] = \
+                    weights[month][variableName] + weight
+            else:
+                sums[month][variableName] = fieldSum
+                weights[month][variableName] = weight
+    # }}}
+
+
+def _get_monthly_means(sums, weights):  # {{{
+    '''
+    The monthly climatologies from the days-weighted sums over years
+    '''
+    monthlyMeans = {}
+    for month in range(1, 13):
+        monthlyMeans[month] = {}
+        for variableName in sums[month]:
+            monthlyMeans[month][variableName] = _get_mean(
+                sums[month][variableName], weights[month][variableName])
+    return monthlyMeans  # }}}
+
+
+def _get_season_mean(monthlyMeans, variableName, season):  # {{{
+    '''
+    The mean of the monthly climatologies in a season, weighted by the
+    number of days in each month
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    seasonSums = {}
+    seasonWeights = {}
+    for month in constants.monthDictionary[season]:
+        if variableName not in monthlyMeans[month]:
+            continue
+        _accumulate(seasonSums, seasonWeights, variableName,
+                    monthlyMeans[month][variableName],
+                    int(constants.daysInMonth[month - 1]))
+    if variableName not in seasonSums:
+        raise ValueError('No input files for season {} were '
+                         'found'.format(season))
+    return _get_mean(seasonSums[variableName],
+                     seasonWeights[variableName])  # }}}
+
+
+def _get_season_statistics(sums, weights, moments, variableName, season,
+                           statistics):  # {{{
+    '''
+    Statistics other than the mean of a variable over all the months in a
+    season, combining the moments of each month.  Points with no valid
+    values are given the MPAS fill value.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    seasonSum = None
+    for month in constants.monthDictionary[season]:
+        if variableName not in moments[month]:
+            continue
+        fieldSum = sums[month][variableName]
+        weight = weights[month][variableName]
+        fieldMoments = moments[month][variableName]
+        if seasonSum is None:
+            seasonSum = fieldSum
+            seasonWeight = weight
+            seasonMoments = fieldMoments
+        else:
+            seasonMoments = _merge_moments(seasonSum, seasonWeight,
+                                           seasonMoments, fieldSum, weight,
+                                           fieldMoments)
+            seasonSum = seasonSum + fieldSum
+            seasonWeight = seasonWeight + weight
+
+    fields = {}
+    for statistic in statistics:
+        if statistic == 'variance':
+            fields[statistic] = _get_mean(seasonMoments['m2'], seasonWeight)
+        else:
+            field = seasonMoments[statistic]
+            fields[statistic] = numpy.where(numpy.isnan(field),
+                                            mpasFillValue, field)
+    return fields  # }}}
+
+
+def _merge_moments(sumA, weightA, momentsA, sumB, weightB,
+                   momentsB):  # {{{
+    '''
+    Combine the sums of squared deviations from the mean and the extremes of
+    two sets of values given their weighted sums and weights, using the
+    pairwise update of Chan et al. (1979)
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    m2 = momentsA['m2'] + momentsB['m2']
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        delta = sumB/weightB - sumA/weightA
+        correction = delta**2*weightA*weightB/(weightA + weightB)
+    both = numpy.logical_and(weightA > 0., weightB > 0.)
+    m2 = m2 + numpy.where(both, correction, 0.)
+
+    return {'m2': m2,
+            'min': numpy.fmin(momentsA['min'], momentsB['min']),
+            'max': numpy.fmax(momentsA['max'], momentsB['max'])}  # }}}
+
+
+def _get_variable_moments(moments, variableName, statistics):  # {{{
+    '''
+    The moments for each month if statistics are needed for the variable,
+    otherwise ``None``
+    '''
+    if statistics is None or variableName not in statistics:
+        return None
+    return moments  # }}}
+
+
+def _get_empty_moments():  # {{{
+    '''
+    A dictionary of moments for each month
+    '''
+    return dict([(month, {}) for month in range(1, 13)])  # }}}
+
+
+def _get_empty_sums():  # {{{
+    '''
+    Dictionaries of sums and weights for each month
+    '''
+    sums = {}
+    weights = {}
+    for month in range(1, 13):
+        sums[month] = {}
+        weights[month] = {}
+    return sums, weights  # }}}
+
+
+def _sum_year(yearFiles, year, variableList, calendar, sums, weights,
+              verticalIndices=None, moments=None, statistics=None):  # {{{
+    '''
+    Compute the days-weighted sums (and, for variables in ``statistics``,
+    the moments) of variables for each month of a year, returning the
+    dimensions (other than ``Time``) of each variable
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    dimensions = {}
+    for fileName, month in yearFiles:
+        days = get_days_in_month(year, month, calendar)
+        with netCDF4.Dataset(fileName, 'r') as ds:
+            for variableName in variableList:
+                variable = ds.variables[variableName]
+                dimensions[variableName] = _get_output_dimensions(
+                    ds, variable, verticalIndices)[1:]
+                variableMoments = _get_variable_moments(
+                    moments, variableName, statistics)
+                if variableMoments is not None:
+                    variableMoments = variableMoments[month]
+                if _is_sliced(variable, verticalIndices):
+                    # only read the range of levels that is needed
+                    minLevel, maxLevel = _get_level_range(
+                        verticalIndices, variable.shape[2])
+                    for timeIndex in range(variable.shape[0]):
+                        field = _slice_levels(
+                            variable[timeIndex, :, minLevel:maxLevel],
+                            verticalIndices, minLevel)
+                        _accumulate(sums[month], weights[month],
+                                    variableName, field, days,
+                                    variableMoments)
+                else:
+                    for timeIndex in range(variable.shape[0]):
+                        _accumulate(sums[month], weights[month],
+                                    variableName, variable[timeIndex], days,
+                                    variableMoments)
+    return dimensions  # }}}
+
+
+def _is_sliced(variable, verticalIndices):  # {{{
+    '''
+    Whether a variable is only needed at the given vertical indices
+    '''
+    return verticalIndices is not None and \
+        tuple(variable.dimensions[1:]) == ('nCells', 'nVertLevels')  # }}}
+
+
+def _get_output_dimensions(ds, variable, verticalIndices):  # {{{
+    '''
+    The names and sizes of the dimensions of a variable's climatology
+    '''
+    if _is_sliced(variable, verticalIndices):
+        return [('Time', None),
+                ('depthSlice', verticalIndices.shape[0]),
+                ('nCells', len(ds.dimensions['nCells']))]
+
+    dimensions = []
+    for dimension in variable.dimensions:
+        if ds.dimensions[dimension].isunlimited():
+            dimensions.append((dimension, None))
+        else:
+            dimensions.append((dimension, len(ds.dimensions[dimension])))
+    return dimensions  # }}}
+
+
+def _get_level_range(verticalIndices, levelCount):  # {{{
+    '''
+    The range of vertical levels that includes all valid vertical indices
+    '''
+    valid = numpy.logical_and(verticalIndices >= 0,
+                              verticalIndices < levelCount)
+    if not numpy.any(valid):
+        return 0, 1
+    return int(verticalIndices[valid].min()), \
+        int(verticalIndices[valid].max()) + 1  # }}}
+
+
+def _slice_levels(field, verticalIndices, minLevel):  # {{{
+    '''
+    Extract the values at the given vertical index in each cell from a field
+    with dimensions ``nCells`` and ``nVertLevels`` (starting at level
+    ``minLevel``), masking invalid indices
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    levelIndices = verticalIndices - minLevel
+    valid = numpy.logical_and(levelIndices >= 0,
+                              levelIndices < field.shape[1])
+    levelIndices = numpy.where(valid, levelIndices, 0)
+    cellIndices = numpy.arange(field.shape[0])[numpy.newaxis, :]
+    field = numpy.ma.array(field[cellIndices, levelIndices])
+    field[numpy.logical_not(valid)] = numpy.ma.masked
+    return field  # }}}
+
+
+def _copy_sums(sums, weights):  # {{{
+    '''
+    A snapshot of running totals of sums and weights
+    '''
+    sumsCopy = {}
+    weightsCopy = {}
+    for month in range(1, 13):
+        sumsCopy[month] = dict(sums[month])
+        weightsCopy[month] = dict(weights[month])
+    return sumsCopy, weightsCopy  # }}}
+
+
+def _get_dimensions(fileName, variableList):  # {{{
+    '''
+    The dimensions (other than ``Time``) of each variable in a file
+    '''
+    with netCDF4.Dataset(fileName, 'r') as ds:
+        return dict([(variableName, ds.variables[variableName].dimensions[1:])
+                     for variableName in variableList])  # }}}
+
+
+def _get_sources(yearFiles, calendar, verticalIndices=None):  # {{{
+    '''
+    A description of the input files for a year, used to check whether
+    partial sums in the cache are still valid
+    '''
+    sources = ['calendar={}'.format(calendar)]
+    if verticalIndices is not None:
+        sources.append('verticalIndices={}'.format(hashlib.md5(
+            numpy.ascontiguousarray(verticalIndices,
+                                    dtype=numpy.int64).tobytes()).hexdigest()))
+    for fileName, month in yearFiles:
+        fileName = os.path.abspath(fileName)
+        sources.append('{:02d}:{}:{}:{!r}'.format(
+            month, fileName, os.path.getsize(fileName),
+            os.path.getmtime(fileName)))
+    return '\n'.join(sources)  # }}}
+
+
+def _get_partial_sums_file_name(cacheDirectory, variableName, year):  # {{{
+    '''
+    The file name for cached partial sums of a variable in a year
+    '''
+    return '{}/{}/{:04d}.nc'.format(cacheDirectory, variableName, year)  # }}}
+
+
+def _read_partial_sums(cacheDirectory, variableName, year, sources, sums,
+                       weights, moments=None):  # {{{
+    '''
+    Read the partial sums (and moments, if ``moments`` is not ``None``) of a
+    variable for each month of a year from the cache, returning ``False`` if
+    they aren't available or the input files have changed since they were
+    computed
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    fileName = _get_partial_sums_file_name(cacheDirectory, variableName, year)
+    if not os.path.exists(fileName):
+        return False
+
+    with netCDF4.Dataset(fileName, 'r') as ds:
+        if ds.getncattr('sources') != sources:
+            return False
+        if moments is not None and 'm2' not in ds.variables:
+            # the moments weren't cached with the sums
+            return False
+        ds.set_auto_mask(False)
+        fieldSums = ds.variables['sum'][:]
+        fieldWeights = ds.variables['weight'][:]
+        if moments is not None:
+            fieldMoments = dict([(name, ds.variables[name][:])
+                                 for name in ['m2', 'min', 'max']])
+
+    for monthIndex in range(12):
+        weight = fieldWeights[monthIndex]
+        if numpy.isscalar(weight) or weight.ndim == 0:
+            if weight == 0.:
+                # there was no input file for this month
+                continue
+            weight = float(weight)
+        sums[monthIndex + 1][variableName] = fieldSums[monthIndex]
+        weights[monthIndex + 1][variableName] = weight
+        if moments is not None:
+            moments[monthIndex + 1][variableName] = dict(
+                [(name, field[monthIndex])
+                 for name, field in fieldMoments.items()])
+
+    return True  # }}}
+
+
+def _write_partial_sums(cacheDirectory, variableName, year, sources,
+                        dimensions, sums, weights, moments=None):  # {{{
+    '''
+    Write the partial sums (and moments, if ``moments`` is not ``None``) of a
+    variable for each month of a year to the cache
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    fileName = _get_partial_sums_file_name(cacheDirectory, variableName, year)
+    make_directories(os.path.dirname(fileName))
+
+    shape = tuple([size for dimension, size in dimensions])
+    fieldSums = numpy.zeros((12,) + shape)
+    scalarWeights = all([numpy.isscalar(weights[month][variableName])
+                         for month in range(1, 13)
+                         if variableName in weights[month]])
+    if scalarWeights:
+        fieldWeights = numpy.zeros(12)
+    else:
+        fieldWeights = numpy.zeros((12,) + shape)
+    for month in range(1, 13):
+        if variableName in sums[month]:
+            fieldSums[month - 1] = sums[month][variableName]
+            fieldWeights[month - 1] = weights[month][variableName]
+
+    if moments is not None:
+        fieldMoments = {'m2': numpy.zeros((12,) + shape),
+                        'min': numpy.full((12,) + shape, numpy.nan),
+                        'max': numpy.full((12,) + shape, numpy.nan)}
+        for month in range(1, 13):
+            if variableName in moments[month]:
+                for name, field in fieldMoments.items():
+                    field[month - 1] = moments[month][variableName][name]
+
+    dimensionNames = tuple([dimension for dimension, size in dimensions])
+    tempFileName = get_temp_file_name(fileName)
+    with netCDF4.Dataset(tempFileName, 'w') as ds:
+        ds.setncattr('sources', sources)
+        ds.createDimension('month', 12)
+        for dimension, size in dimensions:
+            ds.createDimension(dimension, size)
+        variable = ds.createVariable('sum', 'f8', ('month',) + dimensionNames)
+        variable[:] = fieldSums
+        if scalarWeights:
+            variable = ds.createVariable('weight', 'f8', ('month',))
+        else:
+            variable = ds.createVariable('weight', 'f8',
+                                         ('month',) + dimensionNames)
+        variable[:] = fieldWeights
+        if moments is not None:
+            for name, field in fieldMoments.items():
+                variable = ds.createVariable(name, 'f8',
+                                             ('month',) + dimensionNames)
+                variable[:] = field
+    os.rename(tempFileName, fileName)  # }}}
+
+
+def _accumulate(sums, weights, variableName, field, weight,
+                moments=None):  # {{{
+    '''
+    Add a weighted field to a running sum, skipping invalid points, and
+    update the running moments if ``moments`` is not ``None``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    mask = numpy.ma.getmaskarray(field)
+    field = numpy.ma.getdata(field).astype(numpy.float64)
+    mask = numpy.logical_or(mask, field == mpasFillValue)
+
+    if variableName not in sums:
+        sums[variableName] = numpy.zeros(field.shape, numpy.float64)
+        weights[variableName] = 0.
+        if moments is not None:
+            moments[variableName] = {
+                'm2': numpy.zeros(field.shape),
+                'min': numpy.full(field.shape, numpy.nan),
+                'max': numpy.full(field.shape, numpy.nan)}
+
+    if moments is not None:
+        # a single field has no spread of its own, so it only adds to the
+        # squared deviations through the difference from the running mean
+        valid = numpy.logical_not(mask)
+        extreme = numpy.where(valid, field, numpy.nan)
+        moments[variableName] = _merge_moments(
+            sums[variableName], weights[variableName], moments[variableName],
+            weight*field, weight*valid,
+            {'m2': 0., 'min': extreme, 'max': extreme})
+
+    if numpy.any(mask):
+        if numpy.isscalar(weights[variableName]):
+            weights[variableName] = numpy.full(field.shape,
+                                               weights[variableName])
+        field[mask] = 0.
+        weights[variableName] += weight*numpy.logical_not(mask)
+    else:
+        weights[variableName] += weight
+
+    sums[variableName] += weight*field  # }}}
+
+
+def _get_mean(fieldSum, weight):  # {{{
+    '''
+    Divide a weighted sum by its weight, giving points with zero weight the
+    MPAS fill value
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if numpy.isscalar(weight):
+        if weight == 0.:
+            return numpy.full(fieldSum.shape, mpasFillValue)
+        return fieldSum/weight
+
+    valid = weight > 0.
+    mean = numpy.full(fieldSum.shape, mpasFillValue)
+    mean[valid] = fieldSum[valid]/weight[valid]
+    return mean  # }}}
+
+
+def _write_climatology(templateFileName, outFileName, fields,
+                       verticalIndices=None, statisticFields=None):  # {{{
+    '''
+    Write climatologies to a file with the same dimensions, attributes and
+    data types as the MPAS file they were computed from, with a Time
+    dimension of size 1 (as in ``ncclimo`` output), followed by any other
+    statistics of each variable
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    with netCDF4.Dataset(templateFileName, 'r') as inDs:
+        with netCDF4.Dataset(outFileName, 'w') as outDs:
+            outDs.setncatts(_get_attributes(inDs))
+            for variableName, field in fields.items():
+                inVariable = inDs.variables[variableName]
+                dtype = inVariable.dtype
+                if not numpy.issubdtype(dtype, numpy.floating):
+                    dtype = numpy.float64
+                dimensions = _get_output_dimensions(inDs, inVariable,
+                                                    verticalIndices)
+                _create_variable(outDs, inVariable, variableName, dtype,
+                                 dimensions)
+                outDs.variables[variableName][0, ...] = field
+
+                if statisticFields is None or \
+                        variableName not in statisticFields:
+                    continue
+                for statistic, field in \
+                        statisticFields[variableName].items():
+                    statisticName = get_statistic_variable_name(
+                        variableName, statistic)
+                    _create_variable(outDs, inVariable, statisticName,
+                                     dtype, dimensions)
+                    attributes = get_statistic_attributes(
+                        _get_attributes(inVariable), statistic)
+                    attributes.pop('_FillValue', None)
+                    outVariable = outDs.variables[statisticName]
+                    outVariable.setncatts(attributes)
+                    outVariable[0, ...] = field
+    # }}}
+
+
+def _merge_files(inFileNames, outFileName):  # {{{
+    '''
+    Copy the variables from several climatology files into one
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    shutil.copyfile(inFileNames[0], outFileName)
+    with netCDF4.Dataset(outFileName, 'a') as outDs:
+        for inFileName in inFileNames[1:]:
+            _copy_variables(inFileName, outDs)
+    # }}}
+
+
+def _copy_variables(inFileName, outDs):  # {{{
+    '''
+    Copy the variables from a file to an open data set, skipping those
+    already in the data set
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    with netCDF4.Dataset(inFileName, 'r') as inDs:
+        inDs.set_auto_maskandscale(False)
+        for variableName, inVariable in inDs.variables.items():
+            if variableName in outDs.variables:
+                continue
+            _create_variable(outDs, inVariable, variableName,
+                             inVariable.dtype,
+                             _get_output_dimensions(inDs, inVariable, None))
+            outDs.variables[variableName][:] = inVariable[:]
+    # }}}
+
+
+def _create_variable(outDs, inVariable, variableName, dtype,
+                     dimensions):  # {{{
+    '''
+    Create a variable (and any dimensions it needs) with the attributes of
+    one in another file and the given dimension names and sizes
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    for dimension, size in dimensions:
+        if dimension not in outDs.dimensions:
+            outDs.createDimension(dimension, size)
+
+    attributes = _get_attributes(inVariable)
+    fillValue = attributes.pop('_FillValue', None)
+    outVariable = outDs.createVariable(
+        variableName, dtype, [dimension for dimension, size in dimensions],
+        fill_value=fillValue)
+    # don't let netCDF4 mask or scale the values we write
+    outVariable.set_auto_maskandscale(False)
+    outVariable.setncatts(attributes)  # }}}
+
+
+def _get_attributes(ncObject):  # {{{
+    '''
+    The attributes of a NetCDF file or variable as a dictionary
+    '''
+    return dict([(name, ncObject.getncattr(name))
+                 for name in ncObject.ncattrs()])  # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
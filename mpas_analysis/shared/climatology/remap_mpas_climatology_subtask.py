@@ -15,22 +15,26 @@ from __future__ import absolute_import, division, print_function, \
 import xarray as xr
 import numpy
 import os
+from collections import OrderedDict
 
 from mpas_analysis.shared.analysis_task import AnalysisTask
 
 from mpas_analysis.shared.constants import constants
 
 from mpas_analysis.shared.io.utility import build_config_full_path, \
-    make_directories
+    make_directories, get_variable_bytes
 from mpas_analysis.shared.io import write_netcdf
 
 from mpas_analysis.shared.climatology.climatology import get_remapper, \
     get_masked_mpas_climatology_file_name, \
-    get_remapped_mpas_climatology_file_name
+    get_remapped_mpas_climatology_file_name, get_statistic_variable_name
 from mpas_analysis.shared.climatology.comparison_descriptors import \
     get_comparison_descriptor
+from mpas_analysis.shared.climatology.mapping_file_task import \
+    get_mapping_file_task
 
 from mpas_analysis.shared.grid import MpasMeshDescriptor
+from mpas_analysis.shared.interpolation import Remapper
 
 from mpas_analysis.shared.mpas_xarray import mpas_xarray
 
@@ -69,6 +73,19 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
         If ``comparisonGridName`` is not ``None``, the name of a restart
         file from which the MPAS mesh can be read.
 
+    sliceName : str
+        The name of the vertical slices added to ``mpasClimatologyTask`` with
+        ``add_vertical_slices()`` or ``None`` if the full climatology is used
+
+    statistics : list of str
+        Statistics (from ``constants.climatologyStatistics``) of each
+        variable that are masked and remapped along with the mean, or
+        ``None`` for only the mean
+
+    mappingFileTasks : dict of ``MappingFileTask``
+        The tasks that build the mapping files from the MPAS mesh to each
+        comparison grid, with grid names as keys
+
     useNcremap : bool, optional
         Whether to use ncremap to do the remapping (the other option being
         an internal python code that handles more grid types and extra
@@ -81,7 +98,7 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
     def __init__(self, mpasClimatologyTask, parentTask, climatologyName,
                  variableList, seasons, comparisonGridNames=None,
                  iselValues=None, subtaskName='remapMpasClimatology',
-                 useNcremap=None):
+                 useNcremap=None, statistics=None):
         # {{{
         '''
         Construct the analysis task and adds it as a subtask of the
@@ -129,6 +146,12 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
             if it is not explicitly given.  If a comparison grid other than
             ``latlon`` is given, ncremap is not supported so this flag is set
             to ``False``.
+
+        statistics : list of str, optional
+            Statistics (from ``constants.climatologyStatistics``) of each
+            variable to compute in ``mpasClimatologyTask`` and to mask and
+            remap along with the mean.  The statistics are named with
+            ``get_statistic_variable_name()``.
         '''
         # Authors
         # -------
@@ -144,6 +167,18 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
             componentName=parentTask.componentName,
             tags=tags)
 
+        # masking and remapping reads full climatologies on the MPAS mesh, so
+        # the memory is estimated from their size in setup_and_check()
+        self.memory = 2.0
+        self.expectedDuration = 120.
+
+        # remapping splits the rows of the mapping matrix among threads (or
+        # ncremap uses OpenMP threads), making do with fewer if fewer cores
+        # are free
+        self.cores = self.config.getWithDefault(
+            'execute', 'remapThreadCount', default=1)
+        self.minCores = 1
+
         self.variableList = variableList
         self.seasons = seasons
         self.comparisonDescriptors = {}
@@ -155,11 +190,17 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
                     comparisonDescriptor
 
         self.iselValues = iselValues
+        self.statistics = statistics
+        self.sliceName = None
         self.climatologyName = climatologyName
         self.mpasClimatologyTask = mpasClimatologyTask
 
         self.run_after(mpasClimatologyTask)
 
+        self.mappingFileTasks = {}
+        for comparisonGridName in self.comparisonDescriptors:
+            self.add_mapping_file_task(comparisonGridName)
+
         parentTask.add_subtask(self)
 
         # this is a stopgap until MPAS implements the _FillValue attribute
@@ -203,22 +244,80 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
                           'restart file to perform remapping of '
                           'climatologies.')
 
-        # we set up the remapper here because ESFM_RegridWeightGen seems to
-        # have trouble if it runs in another process (or in several at once)
+        # the mapping files are built by the mapping-file tasks, which run
+        # before this one
         self._setup_remappers()
 
+        self.memory = self._estimate_memory()
+
         # don't add the variables and seasons to mpasClimatologyTask until
         # we're sure this subtask is supposed to run
-        self.mpasClimatologyTask.add_variables(self.variableList, self.seasons)
-
-        # make the mapping directory, because doing so within each process
-        # seems to be giving ESMF_RegridWeightGen some trouble
-        mappingSubdirectory = build_config_full_path(self.config, 'output',
-                                                     'mappingSubdirectory')
-        make_directories(mappingSubdirectory)
+        self._add_variables_to_climatology()
 
         # }}}
 
+    def get_input_files(self):  # {{{
+        '''
+        Get the restart file defining the MPAS mesh
+
+        Returns
+        -------
+        inputFiles : list of str
+            The input files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return [self.restartFileName]  # }}}
+
+    def get_output_files(self):  # {{{
+        '''
+        Get the masked climatology of each season (if it is written out) and
+        the remapped climatology of each season on each comparison grid
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        outputFiles = []
+        if self._get_write_masked():
+            outputFiles.extend([self.get_masked_file_name(season)
+                                for season in self.seasons])
+        for comparisonGridName in self.comparisonDescriptors:
+            if self.remappers[comparisonGridName].mappingFileName is None:
+                # no remapping is needed
+                continue
+            outputFiles.extend([self.get_remapped_file_name(
+                season, comparisonGridName) for season in self.seasons])
+        return outputFiles  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        '''
+        Get the variables, seasons, comparison grids and slices of the
+        climatology
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return {'climatologyName': self.climatologyName,
+                'variableList': self.variableList,
+                'seasons': self.seasons,
+                'comparisonGridNames': sorted(self.comparisonDescriptors),
+                'iselValues': self.iselValues,
+                'statistics': self.statistics}  # }}}
+
     def run_task(self):  # {{{
         '''
         Compute the requested climatologies
@@ -239,25 +338,7 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
         # slice
         dsMask = dsMask.isel(**iselValues)
 
-        for season in self.seasons:
-            self._mask_climatologies(season, dsMask)
-
-        for comparisonGridName in self.comparisonDescriptors:
-
-            for season in self.seasons:
-
-                maskedClimatologyFileName = self.get_masked_file_name(
-                        season)
-
-                remappedFileName = self.get_remapped_file_name(
-                        season, comparisonGridName)
-
-                if not os.path.exists(remappedFileName):
-                    self._remap(inFileName=maskedClimatologyFileName,
-                                outFileName=remappedFileName,
-                                remapper=self.remappers[comparisonGridName],
-                                comparisonGridName=comparisonGridName,
-                                season=season)
+        self._mask_and_remap(dsMask, self._get_write_masked())
         # }}}
 
     def add_comparison_grid_descriptor(self, comparisonGridName,
@@ -279,6 +360,34 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
         self.comparisonDescriptors[comparisonGridName] = \
             comparisonDescriptor  # }}}
 
+    def add_mapping_file_task(self, comparisonGridName):  # {{{
+        '''
+        Run after the task that builds the mapping file from the MPAS mesh to
+        the given comparison grid (shared with other tasks that need the same
+        mapping file).  This is called in the constructor for each comparison
+        grid given there.  Subclasses that call
+        ``add_comparison_grid_descriptor()`` during setup should call this
+        method in their constructors so the mapping file is built by a
+        separate task.  Otherwise, it is built during setup.
+
+        Parameters
+        ----------
+        comparisonGridName : str
+            The name of the comparison grid
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        config = self.config
+        mappingName = 'map_{}_to_{}_{}'.format(
+            config.get('input', 'mpasMeshName'), comparisonGridName,
+            config.get('climatology', 'mpasInterpolationMethod'))
+        mappingFileTask = get_mapping_file_task(config, self.componentName,
+                                                mappingName)
+        self.mappingFileTasks[comparisonGridName] = mappingFileTask
+        self.run_after(mappingFileTask)  # }}}
+
     def get_masked_file_name(self, season):  # {{{
         """
         Given config options, the name of a field and a string identifying the
@@ -418,7 +527,8 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
                 comparisonDescriptor=comparisonDescriptor,
                 mappingFilePrefix=mappingFilePrefix,
                 method=config.get('climatology', 'mpasInterpolationMethod'),
-                logger=self.logger)
+                logger=self.logger,
+                mappingFileTask=self.mappingFileTasks.get(comparisonGridName))
 
         # }}}
 
@@ -493,9 +603,217 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
             self._outputFiles[key] = fileName
         # }}}
 
-    def _mask_climatologies(self, season, dsMask):  # {{{
+    def _add_variables_to_climatology(self):  # {{{
+        '''
+        Add the variables and seasons needed by this subtask to
+        ``mpasClimatologyTask``
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.mpasClimatologyTask.add_variables(self.variableList, self.seasons,
+                                               statistics=self.statistics)
+
+        # }}}
+
+    def _get_write_masked(self):  # {{{
         '''
-        For each season, creates a masked version of the climatology
+        Whether the masked climatologies are written out.  They are only
+        needed on disk if ncremap will read them, if no remapping is needed or
+        if they have been requested explicitly.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        writeMasked = self.config.getWithDefault(
+            'climatology', 'writeMaskedClimatology', default=False)
+        for comparisonGridName in self.comparisonDescriptors:
+            remapper = self.remappers[comparisonGridName]
+            if self._use_ncremap(comparisonGridName) or \
+                    remapper.mappingFileName is None:
+                writeMasked = True
+        return writeMasked  # }}}
+
+    def _get_season_batch_size(self):  # {{{
+        '''
+        Get the number of seasons to mask and remap at the same time
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        batchSize = self.config.getWithDefault(
+            'climatology', 'remapSeasonBatchSize', default=4)
+        return max(1, batchSize)  # }}}
+
+    def _estimate_memory(self):  # {{{
+        '''
+        Estimate the peak memory (in GB) of masking and remapping a batch of
+        seasons: the climatologies of the batch on the MPAS mesh and on the
+        largest comparison grid, the blocks of columns remapped together, and
+        1 GB for the mapping weights and the rest of the process.  The size
+        of a climatology is that of its variables (and statistics) in the
+        first history file.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        inputFiles = self.mpasClimatologyTask.get_input_files()
+        seasonBytes = get_variable_bytes(inputFiles[0:1], self.variableList)
+        if self.statistics is not None:
+            seasonBytes *= 1 + len(self.statistics)
+
+        # the ratio of the size of the largest comparison grid to the MPAS
+        # mesh
+        gridRatio = 0.
+        for remapper in self.remappers.values():
+            sourceCount = numpy.prod(remapper.sourceDescriptor.dimSize)
+            destCount = numpy.prod(remapper.destinationDescriptor.dimSize)
+            gridRatio = max(gridRatio, destCount/sourceCount)
+
+        batchBytes = self._get_season_batch_size()*seasonBytes*(1. + gridRatio)
+        return 1. + (batchBytes + Remapper.maxBlockBytes)/1024.**3  # }}}
+
+    def _mask_and_remap(self, dsMask, writeMasked):  # {{{
+        '''
+        Mask the climatology of each season and remap it to each comparison
+        grid, keeping the masked climatologies in memory between the two
+        steps.  Seasons are masked and remapped in batches of
+        ``remapSeasonBatchSize`` and, without ncremap, the seasons in a batch
+        are remapped to a comparison grid together with
+        ``Remapper.remap_datasets()``.
+
+        Parameters
+        ----------
+        dsMask : ``xarray.Dataset`` object
+            A data set (from the first input file) that can be used to
+            determine the mask in MPAS output files.
+
+        writeMasked : bool
+            Whether to write out the masked climatologies
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # the remapped climatologies that don't exist yet for each comparison
+        # grid
+        remappedFileNames = OrderedDict()
+        for comparisonGridName in self.comparisonDescriptors:
+            if self.remappers[comparisonGridName].mappingFileName is None:
+                # no remapping is needed
+                continue
+            fileNames = OrderedDict()
+            for season in self.seasons:
+                remappedFileName = self.get_remapped_file_name(
+                        season, comparisonGridName)
+                if not os.path.exists(remappedFileName):
+                    fileNames[season] = remappedFileName
+            if len(fileNames) > 0:
+                remappedFileNames[comparisonGridName] = fileNames
+
+        # mask and remap a few seasons at a time so only their climatologies
+        # (and the remapped climatologies) are in memory at once
+        batchSize = self._get_season_batch_size()
+        for batchStart in range(0, len(self.seasons), batchSize):
+            self._mask_and_remap_batch(
+                self.seasons[batchStart:batchStart + batchSize], dsMask,
+                writeMasked, remappedFileNames)
+        # }}}
+
+    def _mask_and_remap_batch(self, batchSeasons, dsMask, writeMasked,
+                              remappedFileNames):  # {{{
+        '''
+        Mask the climatologies of a batch of seasons and remap them to each
+        comparison grid
+
+        Parameters
+        ----------
+        batchSeasons : list of str
+            The seasons in the batch
+
+        dsMask : ``xarray.Dataset`` object
+            A data set (from the first input file) that can be used to
+            determine the mask in MPAS output files.
+
+        writeMasked : bool
+            Whether to write out the masked climatologies
+
+        remappedFileNames : ``OrderedDict``
+            The remapped climatologies that don't exist yet for each season on
+            each comparison grid
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        climatologies = OrderedDict()
+        for season in batchSeasons:
+            maskedClimatologyFileName = self.get_masked_file_name(season)
+            maskedExists = os.path.exists(maskedClimatologyFileName)
+            remap = any([season in fileNames for fileNames in
+                         remappedFileNames.values()])
+            if maskedExists:
+                if remap:
+                    climatologies[season] = \
+                        xr.open_dataset(maskedClimatologyFileName)
+                continue
+
+            if not remap and not writeMasked:
+                continue
+
+            climatology = self._mask_climatology(season, dsMask)
+            if writeMasked:
+                write_netcdf(climatology, maskedClimatologyFileName)
+            if remap:
+                climatologies[season] = climatology
+
+        # remap to all comparison grids from the same arrays in memory
+        for climatology in climatologies.values():
+            climatology.load()
+
+        for comparisonGridName, fileNames in remappedFileNames.items():
+            remapper = self.remappers[comparisonGridName]
+            seasons = [season for season in fileNames
+                       if season in climatologies]
+            if len(seasons) == 0:
+                continue
+            if self._use_ncremap(comparisonGridName):
+                for season in seasons:
+                    self._remap(
+                        inFileName=self.get_masked_file_name(season),
+                        climatology=climatologies[season],
+                        outFileName=fileNames[season],
+                        remapper=remapper,
+                        comparisonGridName=comparisonGridName,
+                        season=season)
+                continue
+
+            renormalizationThreshold = self.config.getfloat(
+                'climatology', 'renormalizationThreshold')
+
+            remappedClimatologies = remapper.remap_datasets(
+                [climatologies[season] for season in seasons],
+                renormalizationThreshold, cores=self._get_cores())
+
+            for season, remappedClimatology in zip(seasons,
+                                                   remappedClimatologies):
+                # customize (if this function has been overridden)
+                remappedClimatology = self.customize_remapped_climatology(
+                        remappedClimatology, comparisonGridName, season)
+
+                write_netcdf(remappedClimatology, fileNames[season])
+
+        for climatology in climatologies.values():
+            climatology.close()
+        # }}}
+
+    def _mask_climatology(self, season, dsMask):  # {{{
+        '''
+        For a given season, creates a masked version of the climatology
 
         Parameters
         ----------
@@ -506,46 +824,83 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
             A data set (from the first input file) that can be used to
             determine the mask in MPAS output files.
 
+        Returns
+        -------
+        climatology : ``xarray.Dataset`` object
+            The masked climatology data set
+
         Author
         ------
         Xylar Asay-Davis
         '''
 
-        climatologyFileName = self.mpasClimatologyTask.get_file_name(season)
-
-        maskedClimatologyFileName = self.get_masked_file_name(season)
-
-        if not os.path.exists(maskedClimatologyFileName):
-            # slice and mask the data set
-            climatology = xr.open_dataset(climatologyFileName)
-            climatology = mpas_xarray.subset_variables(climatology,
-                                                       self.variableList)
-            iselValues = {'Time': 0}
-            if self.iselValues is not None:
-                iselValues.update(self.iselValues)
-            # select only Time=0 and possibly only the desired vertical
-            # slice
-            climatology = climatology.isel(**iselValues)
-
-            # add valid mask as a variable, useful for remapping later
-            climatology['validMask'] = \
-                xr.DataArray(numpy.ones(climatology.dims['nCells']),
-                             dims=['nCells'])
-            # mask the data set
-            for variableName in self.variableList:
-                climatology[variableName] = \
-                    climatology[variableName].where(
-                        dsMask[variableName] != self._fillValue)
-
-            # customize (if this function has been overridden)
-            climatology = self.customize_masked_climatology(climatology,
-                                                            season)
-
-            write_netcdf(climatology, maskedClimatologyFileName)
-        # }}}
+        if self.sliceName is None:
+            climatologyFileName = self.mpasClimatologyTask.get_file_name(
+                season)
+        else:
+            climatologyFileName = self.mpasClimatologyTask.get_slice_file_name(
+                season, self.sliceName)
+
+        # the statistics of each variable share its mask
+        maskedVariables = OrderedDict()
+        for variableName in self.variableList:
+            maskedVariables[variableName] = variableName
+            if self.statistics is not None:
+                for statistic in self.statistics:
+                    maskedVariables[get_statistic_variable_name(
+                        variableName, statistic)] = variableName
+
+        # slice and mask the data set
+        climatology = xr.open_dataset(climatologyFileName)
+        climatology = mpas_xarray.subset_variables(
+            climatology, list(maskedVariables.keys()))
+        iselValues = {'Time': 0}
+        if self.iselValues is not None:
+            iselValues.update(self.iselValues)
+        # select only Time=0 and possibly only the desired vertical
+        # slice
+        climatology = climatology.isel(**iselValues)
+
+        # add valid mask as a variable, useful for remapping later
+        climatology['validMask'] = \
+            xr.DataArray(numpy.ones(climatology.dims['nCells']),
+                         dims=['nCells'])
+        # mask the data set
+        for variableName, maskName in maskedVariables.items():
+            if self.sliceName is None:
+                mask = dsMask[maskName] != self._fillValue
+            else:
+                # sliced climatologies have the fill value wherever the
+                # vertical index is invalid
+                mask = climatology[variableName] != self._fillValue
+            climatology[variableName] = \
+                climatology[variableName].where(mask)
+
+        # customize (if this function has been overridden)
+        climatology = self.customize_masked_climatology(climatology,
+                                                        season)
+
+        return climatology  # }}}
 
-    def _remap(self, inFileName, outFileName, remapper, comparisonGridName,
-               season):  # {{{
+    def _get_cores(self):  # {{{
+        """
+        The number of threads to use for remapping: the cores allotted by the
+        scheduler or, if the task wasn't launched by the scheduler,
+        ``self.cores``
+        """
+        if self.allottedCores is None:
+            return self.cores
+        return self.allottedCores  # }}}
+
+    def _use_ncremap(self, comparisonGridName):  # {{{
+        """
+        Whether ``ncremap`` is used to remap to the given comparison grid
+        """
+        # ncremap doesn't support grids other than lat/lon
+        return self.useNcremap and comparisonGridName == 'latlon'  # }}}
+
+    def _remap(self, inFileName, climatology, outFileName, remapper,
+               comparisonGridName, season):  # {{{
         """
         Performs remapping either using ``ncremap`` or the native python code,
         depending on the requested setting and the comparison grid
@@ -553,7 +908,12 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
         Parameters
         ----------
         inFileName : str
-            The name of the input file to be remapped.
+            The name of the masked climatology file to be remapped (if using
+            ``ncremap``).
+
+        climatology : ``xarray.Dataset`` object
+            The masked climatology data set to be remapped (if not using
+            ``ncremap``)
 
         outFileName : str
             The name of the output file to which the remapped data set should
@@ -580,23 +940,21 @@ class RemapMpasClimatologySubtask(AnalysisTask):  # {{{
         renormalizationThreshold = self.config.getfloat(
             'climatology', 'renormalizationThreshold')
 
-        # ncremap doesn't support grids other than lat/lon
-        if self.useNcremap and comparisonGridName == 'latlon':
+        if self._use_ncremap(comparisonGridName):
             remapper.remap_file(inFileName=inFileName,
                                 outFileName=outFileName,
                                 overwrite=True,
                                 renormalize=renormalizationThreshold,
-                                logger=self.logger)
+                                logger=self.logger,
+                                cores=self.allottedCores)
 
             remappedClimatology = xr.open_dataset(outFileName)
             remappedClimatology.load()
             remappedClimatology.close()
         else:
-
-            climatologyDataSet = xr.open_dataset(inFileName)
-
-            remappedClimatology = remapper.remap(climatologyDataSet,
-                                                 renormalizationThreshold)
+            remappedClimatology = remapper.remap(climatology,
+                                                 renormalizationThreshold,
+                                                 cores=self._get_cores())
 
         # customize (if this function has been overridden)
         remappedClimatology = self.customize_remapped_climatology(
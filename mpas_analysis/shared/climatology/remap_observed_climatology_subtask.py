@@ -14,20 +14,23 @@ from __future__ import absolute_import, division, print_function, \
 import os
 import os.path
 import xarray as xr
+from collections import OrderedDict
 
 from mpas_analysis.shared.analysis_task import AnalysisTask
 
-from mpas_analysis.shared.constants import constants
-
 from mpas_analysis.shared.io.utility import build_config_full_path, \
     make_directories
 from mpas_analysis.shared.io import write_netcdf
 
 from mpas_analysis.shared.climatology.climatology import get_remapper, \
-    remap_and_write_climatology, compute_climatology
+    remap_and_write_climatologies, compute_seasonal_climatologies
 
 from mpas_analysis.shared.climatology.comparison_descriptors import \
     get_comparison_descriptor
+from mpas_analysis.shared.climatology.remapped_obs_cache import \
+    RemappedObsCache, compute_checksum
+from mpas_analysis.shared.climatology.mapping_file_task import \
+    get_mapping_file_task
 
 
 class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
@@ -49,6 +52,10 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
 
     comparisonGridNames : list of {'latlon', 'antarctic'}
         The name(s) of the comparison grid to use for remapping.
+
+    mappingFileTasks : dict of ``MappingFileTask``
+        The tasks that build the mapping files from the observation grid to
+        each comparison grid, with grid names as keys
     """
     # Authors
     # -------
@@ -102,6 +109,29 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
         super(RemapObservedClimatologySubtask, self).__init__(
                 config=config, taskName=taskName, subtaskName=subtaskName,
                 componentName=componentName, tags=tags)
+
+        # computing climatologies and remapping reads the full observations
+        self.memory = 2.0
+        self.expectedDuration = 120.
+
+        # remapping splits the rows of the mapping matrix among threads,
+        # making do with fewer if fewer cores are free
+        self.cores = config.getWithDefault('execute', 'remapThreadCount',
+                                           default=1)
+        self.minCores = 1
+
+        # the observation grid isn't known until setup, so the mapping files
+        # are identified by the prefix instead
+        method = config.get('{}Observations'.format(componentName),
+                            'interpolationMethod')
+        self.mappingFileTasks = {}
+        for comparisonGridName in comparisonGridNames:
+            mappingName = 'map_obs_{}_to_{}_{}'.format(
+                outFilePrefix, comparisonGridName, method)
+            mappingFileTask = get_mapping_file_task(config, componentName,
+                                                    mappingName)
+            self.mappingFileTasks[comparisonGridName] = mappingFileTask
+            self.run_after(mappingFileTask)
         # }}}
 
     def setup_and_check(self):  # {{{
@@ -119,8 +149,8 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
         #     self.calendar
         super(RemapObservedClimatologySubtask, self).setup_and_check()
 
-        # we set up the remappers here because ESFM_RegridWeightGen seems to
-        # have trouble if it runs in another process (or in several at once)
+        # the mapping files are built by the mapping-file tasks, which run
+        # before this one
         self._setup_remappers(self.fileName)
 
         # build the observational data set and write it out to a file, to
@@ -132,6 +162,55 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
 
         # }}}
 
+    def get_input_files(self):  # {{{
+        """
+        Get the observations file
+
+        Returns
+        -------
+        inputFiles : list of str
+            The input files
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return [self.fileName]  # }}}
+
+    def get_output_files(self):  # {{{
+        """
+        Get the remapped climatology of each season on each comparison grid
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return [self.get_file_name(stage='remapped', season=season,
+                                   comparisonGridName=comparisonGridName)
+                for comparisonGridName in self.comparisonGridNames
+                for season in self.seasons]  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        """
+        Get the seasons and comparison grids of the climatology
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return {'seasons': self.seasons,
+                'comparisonGridNames': self.comparisonGridNames}  # }}}
+
     def run_task(self):  # {{{
         """
         Performs remapping of obsrevations to the comparsion grid
@@ -147,48 +226,96 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
             raise OSError('Obs file {} not found.'.format(
                 obsFileName))
 
+        # remapped observations don't depend on the simulation, so they may
+        # be available from a cache shared between runs
+        cache = RemappedObsCache.from_config(config, logger=self.logger)
+        if cache is not None:
+            obsChecksum = compute_checksum(obsFileName)
+            cacheKeys = {}
+
+        # the seasons that still need to be remapped to each comparison grid
+        seasonsToRemap = OrderedDict()
         for comparisonGridName in self.comparisonGridNames:
+            seasons = []
             for season in self.seasons:
-
                 remappedFileName = self.get_file_name(
                         stage='remapped',
                         season=season,
                         comparisonGridName=comparisonGridName)
+                if os.path.exists(remappedFileName):
+                    continue
+                if cache is not None:
+                    key = cache.get_key(self._get_cache_parameters(
+                        obsChecksum, season, comparisonGridName))
+                    if cache.fetch(key, remappedFileName):
+                        continue
+                    cacheKeys[(comparisonGridName, season)] = key
+                seasons.append(season)
+            if len(seasons) > 0:
+                seasonsToRemap[comparisonGridName] = seasons
+
+        if len(seasonsToRemap) == 0:
+            return
+
+        allSeasons = [season for season in self.seasons if
+                      any([season in seasons for seasons in
+                           seasonsToRemap.values()])]
+
+        with xr.open_dataset(obsFileName) as ds:
+            if 'month' in ds.variables.keys() and \
+                    'year' in ds.variables.keys():
+                # this data set is not yet a climatology, so compute the
+                # climatologies of all seasons in one pass
+                climatologies = compute_seasonal_climatologies(
+                    ds, allSeasons, maskVaries=True)
+            else:
+                # We don't have month or year arrays to compute a climatology
+                # so assume this already is one
+                climatologies = OrderedDict()
+                for season in allSeasons:
+                    climatologies[season] = ds
+
+            # the climatology on the observation grid doesn't depend on the
+            # comparison grid
+            climatologyFileNames = OrderedDict()
+            for season in allSeasons:
+                climatologyFileName = self.get_file_name(
+                        stage='climatology',
+                        season=season,
+                        comparisonGridName=self.comparisonGridNames[0])
+                write_netcdf(climatologies[season], climatologyFileName)
+                climatologyFileNames[season] = climatologyFileName
 
-                if not os.path.exists(remappedFileName):
-
-                    ds = xr.open_dataset(obsFileName)
+            for comparisonGridName, seasons in seasonsToRemap.items():
+                remapper = self.remappers[comparisonGridName]
 
-                    climatologyFileName = self.get_file_name(
-                            stage='climatology',
+                remappedFileNames = OrderedDict()
+                for season in seasons:
+                    remappedFileNames[season] = self.get_file_name(
+                            stage='remapped',
                             season=season,
                             comparisonGridName=comparisonGridName)
-                    if 'month' in ds.variables.keys() and \
-                            'year' in ds.variables.keys():
-                        # this data set is not yet a climatology, so compute
-                        # the climatology
-                        monthValues = constants.monthDictionary[season]
-                        seasonalClimatology = compute_climatology(
-                            ds, monthValues, maskVaries=True)
-                    else:
-                        # We don't have month or year arrays to compute a
-                        # climatology so assume this already is one
-                        seasonalClimatology = ds
-
-                    write_netcdf(seasonalClimatology, climatologyFileName)
-
-                    remapper = self.remappers[comparisonGridName]
-
-                    if remapper.mappingFileName is None:
-                        # no need to remap because the observations are on the
-                        # comparison grid already
-                        os.symlink(climatologyFileName, remappedFileName)
-                    else:
-                        remap_and_write_climatology(
-                            config, seasonalClimatology,
-                            climatologyFileName,
-                            remappedFileName, remapper,
-                            logger=self.logger)
+
+                if remapper.mappingFileName is None:
+                    # no need to remap because the observations are on the
+                    # comparison grid already
+                    for season in seasons:
+                        os.symlink(climatologyFileNames[season],
+                                   remappedFileNames[season])
+                else:
+                    cores = self.allottedCores
+                    if cores is None:
+                        cores = self.cores
+                    remap_and_write_climatologies(
+                        config, climatologies, climatologyFileNames,
+                        remappedFileNames, remapper, logger=self.logger,
+                        cores=cores)
+
+                    if cache is not None:
+                        for season in seasons:
+                            cache.publish(
+                                cacheKeys[(comparisonGridName, season)],
+                                remappedFileNames[season])
 
         # }}}
 
@@ -311,6 +438,45 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
 
         return fileName  # }}}
 
+    def _get_cache_parameters(self, obsChecksum, season,
+                              comparisonGridName):  # {{{
+        """
+        Get the parameters that determine the contents of a remapped
+        climatology, used to look it up in the remapped observations cache
+
+        Parameters
+        ----------
+        obsChecksum : str
+            A checksum of the observational data set
+
+        season : str
+            One of the seasons in ``constants.monthDictionary``
+
+        comparisonGridName : {'latlon', 'antarctic'}
+            The name of the comparison grid
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        """
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        config = self.config
+        sectionName = '{}Observations'.format(self.componentName)
+        remapper = self.remappers[comparisonGridName]
+
+        return {'observations': obsChecksum,
+                'season': season,
+                'sourceGrid': remapper.sourceDescriptor.meshName,
+                'comparisonGrid': remapper.destinationDescriptor.meshName,
+                'method': config.get(sectionName, 'interpolationMethod'),
+                'useNcremap': config.getboolean('climatology', 'useNcremap'),
+                'renormalizationThreshold': config.getfloat(
+                    'climatology', 'renormalizationThreshold')}  # }}}
+
     def _setup_remappers(self, fileName):  # {{{
         """
         Set up the remappers for remapping from observations to the comparison
@@ -345,7 +511,8 @@ class RemapObservedClimatologySubtask(AnalysisTask):  # {{{
                     mappingFilePrefix='map_obs_{}'.format(outFilePrefix),
                     method=config.get(sectionName,
                                       'interpolationMethod'),
-                    logger=self.logger)
+                    logger=self.logger,
+                    mappingFileTask=self.mappingFileTasks[comparisonGridName])
         # }}}
     # }}}
 
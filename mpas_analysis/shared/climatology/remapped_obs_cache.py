@@ -0,0 +1,314 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+A cache of observational climatologies remapped to comparison grids, shared
+between runs because these climatologies don't depend on the simulation
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import json
+import shutil
+import hashlib
+import fcntl
+from contextlib import contextmanager
+
+from mpas_analysis.shared.io.utility import make_directories, \
+    get_temp_file_name, build_config_full_path
+
+
+class RemappedObsCache(object):  # {{{
+    '''
+    A directory of remapped observational climatologies, each stored in a
+    file named after a hash of the parameters that determine its contents
+    (see ``get_key()``).  Files are published atomically while holding a lock
+    on the directory and, if the size of the cache is limited, the least
+    recently used files are removed once the limit is exceeded.
+
+    Attributes
+    ----------
+    directory : str
+        The directory containing the cache
+
+    maxSize : float
+        The maximum size of the cache in bytes or ``None`` for no limit
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, directory, maxSize=None, logger=None):  # {{{
+        '''
+        Construct the cache
+
+        Parameters
+        ----------
+        directory : str
+            The directory containing the cache
+
+        maxSize : float, optional
+            The maximum size of the cache in bytes
+
+        logger : ``logging.Logger``, optional
+            A logger for messages about the cache
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.directory = directory
+        self.maxSize = maxSize
+        self._logger = logger
+        # }}}
+
+    @classmethod
+    def from_config(cls, config, logger=None):  # {{{
+        '''
+        Get the cache configured with the ``remappedObsCacheSubdirectory``
+        and ``remappedObsCacheMaxSize`` options in the ``diagnostics``
+        section
+
+        Parameters
+        ----------
+        config :  instance of ``MpasAnalysisConfigParser``
+            Contains configuration options
+
+        logger : ``logging.Logger``, optional
+            A logger for messages about the cache
+
+        Returns
+        -------
+        cache : ``RemappedObsCache``
+            The cache or ``None`` if no cache directory is configured
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if not config.has_option('diagnostics',
+                                 'remappedObsCacheSubdirectory'):
+            return None
+
+        directory = build_config_full_path(config, 'diagnostics',
+                                           'remappedObsCacheSubdirectory')
+
+        maxSize = None
+        if config.has_option('diagnostics', 'remappedObsCacheMaxSize'):
+            # the size is given in GB
+            maxSize = 1e9*config.getfloat('diagnostics',
+                                          'remappedObsCacheMaxSize')
+
+        return cls(directory, maxSize=maxSize, logger=logger)  # }}}
+
+    def get_key(self, parameters):  # {{{
+        '''
+        Get the key of a remapped climatology in the cache
+
+        Parameters
+        ----------
+        parameters : dict
+            The parameters (e.g. checksum of the observations, season,
+            comparison grid and remapping method) that determine the
+            contents of the remapped climatology.  Values must be
+            serializable to JSON.
+
+        Returns
+        -------
+        key : str
+            A hash of the parameters
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return hashlib.sha256(json.dumps(
+            parameters, sort_keys=True).encode('utf-8')).hexdigest()  # }}}
+
+    def fetch(self, key, fileName):  # {{{
+        '''
+        Copy a remapped climatology from the cache, if it is there
+
+        Parameters
+        ----------
+        key : str
+            The key of the remapped climatology in the cache
+
+        fileName : str
+            The file the remapped climatology should be copied to
+
+        Returns
+        -------
+        found : bool
+            Whether the remapped climatology was in the cache
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        cacheFileName = self._get_cache_file_name(key)
+        tempFileName = get_temp_file_name(fileName)
+        try:
+            shutil.copyfile(cacheFileName, tempFileName)
+        except (IOError, OSError):
+            # not in the cache (or evicted while we were copying it)
+            if os.path.exists(tempFileName):
+                os.remove(tempFileName)
+            return False
+
+        os.rename(tempFileName, fileName)
+
+        try:
+            # mark the file as recently used
+            os.utime(cacheFileName, None)
+        except OSError:
+            pass
+
+        if self._logger is not None:
+            self._logger.info('  Using {} from the remapped observations '
+                              'cache'.format(os.path.basename(fileName)))
+        return True  # }}}
+
+    def publish(self, key, fileName):  # {{{
+        '''
+        Add a remapped climatology to the cache, removing the least recently
+        used other files if the cache is too large.  The new file is kept even
+        if it is larger than ``maxSize`` on its own (with a warning).
+        Failures (e.g. because the cache is read-only for this user) are
+        logged but not raised.
+
+        Parameters
+        ----------
+        key : str
+            The key of the remapped climatology in the cache
+
+        fileName : str
+            The file containing the remapped climatology
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        cacheFileName = self._get_cache_file_name(key)
+        try:
+            make_directories(self.directory)
+            with self._lock():
+                if os.path.exists(cacheFileName):
+                    return
+                tempFileName = get_temp_file_name(cacheFileName)
+                try:
+                    shutil.copyfile(fileName, tempFileName)
+                    os.rename(tempFileName, cacheFileName)
+                finally:
+                    if os.path.exists(tempFileName):
+                        os.remove(tempFileName)
+                self._evict(keep=cacheFileName)
+        except (IOError, OSError) as e:
+            if self._logger is not None:
+                self._logger.warning('Could not add {} to the remapped '
+                                     'observations cache: {}'.format(
+                                         os.path.basename(fileName), e))
+        # }}}
+
+    def _get_cache_file_name(self, key):  # {{{
+        '''
+        The name of the file in the cache with the given key
+        '''
+        return '{}/{}.nc'.format(self.directory, key)  # }}}
+
+    @contextmanager
+    def _lock(self):  # {{{
+        '''
+        Hold an exclusive lock on the cache, shared between processes
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        with open('{}/.lock'.format(self.directory), 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+        # }}}
+
+    def _evict(self, keep):  # {{{
+        '''
+        Remove the least recently used files other than ``keep`` (the file
+        just added) until the cache is no larger than ``maxSize``.  The lock
+        must be held.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.maxSize is None:
+            return
+
+        files = []
+        totalSize = 0
+        for fileName in os.listdir(self.directory):
+            if not fileName.endswith('.nc'):
+                continue
+            fileName = '{}/{}'.format(self.directory, fileName)
+            fileStat = os.stat(fileName)
+            files.append((fileStat.st_mtime, fileStat.st_size, fileName))
+            totalSize += fileStat.st_size
+
+        # oldest first
+        for _, size, fileName in sorted(files):
+            if totalSize <= self.maxSize:
+                break
+            if fileName == keep:
+                if size > self.maxSize and self._logger is not None:
+                    self._logger.warning(
+                        'Warning: {} ({} bytes) is larger than the maximum '
+                        'size of the remapped observations cache ({} '
+                        'bytes)'.format(os.path.basename(fileName), size,
+                                        int(self.maxSize)))
+                continue
+            os.remove(fileName)
+            totalSize -= size
+        # }}}
+
+    # }}}
+
+
+def compute_checksum(fileName):  # {{{
+    '''
+    Compute a checksum of the contents of a file
+
+    Parameters
+    ----------
+    fileName : str
+        The file
+
+    Returns
+    -------
+    checksum : str
+        The SHA-256 hash of the file
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    sha = hashlib.sha256()
+    with open(fileName, 'rb') as inFile:
+        for block in iter(lambda: inFile.read(2**20), b''):
+            sha.update(block)
+    return sha.hexdigest()  # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -42,6 +42,9 @@ daysInMonth = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
 abrevMonthNames = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug",
                    "Sep", "Oct", "Nov", "Dec"]
 
+# statistics that can be computed along with the mean in climatologies
+climatologyStatistics = ['variance', 'min', 'max']
+
 # conversion factor from m^3/s to Sverdrups
 m3ps_to_Sv = 1e-6
 
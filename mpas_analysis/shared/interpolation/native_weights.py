@@ -0,0 +1,375 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+Computing nearest-neighbor and barycentric (linear) interpolation weights
+directly in MPAS-Analysis, as an alternative to ``ESMF_RegridWeightGen``
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import numpy
+import netCDF4
+import xarray
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+from mpas_analysis.shared.grid import MpasMeshDescriptor, \
+    LatLonGridDescriptor, ProjectionGridDescriptor, PointCollectionDescriptor
+from mpas_analysis.shared.io.utility import get_temp_file_name
+
+# the number of destination points processed at once when searching for the
+# triangles that contain them
+_chunkSize = 10000
+
+# the number of triangles (those with the nearest centers) searched for the
+# one that contains each destination point
+_candidateCount = 10
+
+
+def supports_native_weights(sourceDescriptor, destinationDescriptor,
+                            method):  # {{{
+    '''
+    Whether interpolation weights with the given method and grids can be
+    computed with ``compute_native_weights()``
+
+    Parameters
+    ----------
+    sourceDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the source mesh or grid
+
+    destinationDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the destination mesh, grid or point collection
+
+    method : {'bilinear', 'neareststod', 'conserve'}
+        The method of interpolation
+
+    Returns
+    -------
+    supported : bool
+        ``True`` for ``neareststod`` interpolation between any supported
+        grids and for ``bilinear`` interpolation from an MPAS mesh
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if not isinstance(sourceDescriptor, (MpasMeshDescriptor,
+                                         LatLonGridDescriptor,
+                                         ProjectionGridDescriptor)):
+        return False
+    if not isinstance(destinationDescriptor, (MpasMeshDescriptor,
+                                              LatLonGridDescriptor,
+                                              ProjectionGridDescriptor,
+                                              PointCollectionDescriptor)):
+        return False
+    if method == 'neareststod':
+        return True
+    if method == 'bilinear':
+        return isinstance(sourceDescriptor, MpasMeshDescriptor)
+    return False  # }}}
+
+
+def compute_native_weights(sourceDescriptor, destinationDescriptor,
+                           method):  # {{{
+    '''
+    Compute interpolation weights between a source and a destination grid.
+
+    For ``neareststod``, each destination point takes the value at the
+    nearest source cell center, found with a KD-tree of the cell centers on
+    the unit sphere.  For ``bilinear`` from an MPAS mesh, the source cell
+    centers are triangulated with the dual mesh (the Delaunay triangulation
+    of the cell centers), and the weights are the barycentric coordinates of
+    each destination point in the triangle that contains it.  Destination
+    points outside of all triangles (e.g. over land) are not mapped and
+    have ``frac_b == 0``.
+
+    Parameters
+    ----------
+    sourceDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the source mesh or grid
+
+    destinationDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the destination mesh, grid or point collection
+
+    method : {'bilinear', 'neareststod'}
+        The method of interpolation
+
+    Returns
+    -------
+    src_grid_dims, dst_grid_dims : numpy.ndarray
+        The dimensions of the source and destination grids
+
+    frac_b : numpy.ndarray
+        The fraction of each destination cell that is mapped
+
+    matrix : ``scipy.sparse.csr_matrix``
+        The interpolation weights, with a row for each destination cell and a
+        column for each source cell
+
+    Raises
+    ------
+    ValueError
+        If the method or grids are not supported (see
+        ``supports_native_weights()``)
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if not supports_native_weights(sourceDescriptor, destinationDescriptor,
+                                   method):
+        raise ValueError('Interpolation weights with method {} from {} to {} '
+                         'can only be computed with '
+                         'ESMF_RegridWeightGen'.format(
+                             method, type(sourceDescriptor).__name__,
+                             type(destinationDescriptor).__name__))
+
+    sourceLat, sourceLon, src_grid_dims = _get_centers(sourceDescriptor)
+    destLat, destLon, dst_grid_dims = _get_centers(destinationDescriptor)
+    sourcePoints = _lat_lon_to_cartesian(sourceLat, sourceLon)
+    destPoints = _lat_lon_to_cartesian(destLat, destLon)
+
+    if method == 'neareststod':
+        _, cols = cKDTree(sourcePoints).query(destPoints)
+        rows = numpy.arange(len(destPoints))
+        weights = numpy.ones(len(destPoints))
+    else:
+        triangles = _get_mpas_triangles(sourceDescriptor.fileName)
+        rows, cols, weights = _compute_barycentric_weights(
+            sourcePoints, triangles, destPoints)
+
+    matrix = csr_matrix((weights, (rows, cols)),
+                        shape=(len(destPoints), len(sourcePoints)))
+    frac_b = numpy.asarray(matrix.sum(axis=1)).ravel()
+
+    return src_grid_dims, dst_grid_dims, frac_b, matrix  # }}}
+
+
+def write_esmf_mapping_file(mappingFileName, sourceDescriptor,
+                            destinationDescriptor, mapping, method):  # {{{
+    '''
+    Write interpolation weights to a mapping file in the format produced by
+    ``ESMF_RegridWeightGen``.  The file contains the weights, masks,
+    fractions and cell centers but not the cell corners or areas.
+
+    Parameters
+    ----------
+    mappingFileName : str
+        The mapping file to write
+
+    sourceDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the source mesh or grid
+
+    destinationDescriptor : ``shared.grid.MeshDescriptor``
+        A description of the destination mesh, grid or point collection
+
+    mapping : tuple
+        The ``src_grid_dims``, ``dst_grid_dims``, ``frac_b`` and ``matrix``
+        returned by ``compute_native_weights()``
+
+    method : {'bilinear', 'neareststod'}
+        The method of interpolation
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    src_grid_dims, dst_grid_dims, frac_b, matrix = mapping
+
+    sourceLat, sourceLon, _ = _get_centers(sourceDescriptor)
+    destLat, destLon, _ = _get_centers(destinationDescriptor)
+
+    cooMatrix = matrix.tocoo()
+    frac_a = numpy.asarray(matrix.sum(axis=0)).ravel() > 0.
+
+    degrees = {'units': 'degrees'}
+    ds = xarray.Dataset()
+    ds['S'] = ('n_s', cooMatrix.data)
+    # indices are one-based, as in Fortran
+    ds['row'] = ('n_s', numpy.int32(cooMatrix.row + 1))
+    ds['col'] = ('n_s', numpy.int32(cooMatrix.col + 1))
+    ds['frac_a'] = ('n_a', numpy.array(frac_a, float))
+    ds['frac_b'] = ('n_b', frac_b)
+    ds['mask_a'] = ('n_a', numpy.ones(len(sourceLat), numpy.int32))
+    ds['mask_b'] = ('n_b', numpy.ones(len(destLat), numpy.int32))
+    ds['yc_a'] = ('n_a', numpy.rad2deg(sourceLat), degrees)
+    ds['xc_a'] = ('n_a', numpy.rad2deg(sourceLon), degrees)
+    ds['yc_b'] = ('n_b', numpy.rad2deg(destLat), degrees)
+    ds['xc_b'] = ('n_b', numpy.rad2deg(destLon), degrees)
+    # grid dimensions are in Fortran order
+    ds['src_grid_dims'] = ('src_grid_rank',
+                           numpy.int32(src_grid_dims[::-1]))
+    ds['dst_grid_dims'] = ('dst_grid_rank',
+                           numpy.int32(dst_grid_dims[::-1]))
+    ds.attrs['title'] = 'MPAS-Analysis interpolation weights'
+    ds.attrs['map_method'] = method
+    ds.attrs['domain_a'] = sourceDescriptor.meshName
+    ds.attrs['domain_b'] = destinationDescriptor.meshName
+
+    tempFileName = get_temp_file_name(mappingFileName)
+    try:
+        ds.to_netcdf(tempFileName)
+        os.rename(tempFileName, mappingFileName)
+    finally:
+        if os.path.exists(tempFileName):
+            os.remove(tempFileName)
+    # }}}
+
+
+def _get_centers(descriptor):  # {{{
+    '''
+    The latitude and longitude (in radians) of the cell centers of a mesh or
+    grid, in the order of the flattened grid dimensions, and the grid
+    dimensions in the order used in mapping files (reversed from the SCRIP
+    ``grid_dims``)
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if isinstance(descriptor, MpasMeshDescriptor):
+        lat = descriptor.coords['latCell']['data']
+        lon = descriptor.coords['lonCell']['data']
+        dims = [len(lat)]
+        units = 'radians'
+    elif isinstance(descriptor, LatLonGridDescriptor):
+        lon, lat = numpy.meshgrid(descriptor.lon, descriptor.lat)
+        dims = [len(descriptor.lat), len(descriptor.lon)]
+        units = descriptor.units
+    elif isinstance(descriptor, ProjectionGridDescriptor):
+        # the same order as the SCRIP file for the grid
+        X, Y = numpy.meshgrid(descriptor.x, descriptor.y)
+        lat, lon = descriptor.project_to_lat_lon(X, Y)
+        dims = [len(descriptor.y), len(descriptor.x)]
+        units = 'degrees'
+    elif isinstance(descriptor, PointCollectionDescriptor):
+        lat = descriptor.lat
+        lon = descriptor.lon
+        dims = [len(lat)]
+        units = descriptor.units
+    else:
+        raise TypeError('descriptor is not of a recognized type.')
+
+    lat = numpy.array(lat, float).ravel()
+    lon = numpy.array(lon, float).ravel()
+    if units == 'degrees':
+        lat = numpy.deg2rad(lat)
+        lon = numpy.deg2rad(lon)
+
+    return lat, lon, numpy.array(dims)  # }}}
+
+
+def _lat_lon_to_cartesian(lat, lon):  # {{{
+    '''
+    Points on the unit sphere with the given latitude and longitude in
+    radians
+    '''
+    return numpy.stack([numpy.cos(lat)*numpy.cos(lon),
+                        numpy.cos(lat)*numpy.sin(lon),
+                        numpy.sin(lat)], axis=-1)  # }}}
+
+
+def _get_mpas_triangles(meshFileName):  # {{{
+    '''
+    The three cells around each vertex of an MPAS mesh (the triangles of the
+    dual mesh), skipping vertices on the boundary of the mesh (e.g. next to
+    land), found from ``verticesOnCell``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    with netCDF4.Dataset(meshFileName, 'r') as ds:
+        verticesOnCell = numpy.asarray(ds.variables['verticesOnCell'][:]) - 1
+        nEdgesOnCell = numpy.asarray(ds.variables['nEdgesOnCell'][:])
+
+    nCells, maxEdges = verticesOnCell.shape
+    valid = numpy.arange(maxEdges)[numpy.newaxis, :] < \
+        nEdgesOnCell[:, numpy.newaxis]
+    vertices = verticesOnCell[valid]
+    cells = numpy.repeat(numpy.arange(nCells), nEdgesOnCell)
+
+    # group the cells by vertex, keeping vertices with a full triangle
+    order = numpy.argsort(vertices, kind='mergesort')
+    vertices = vertices[order]
+    cells = cells[order]
+    _, starts, counts = numpy.unique(vertices, return_index=True,
+                                     return_counts=True)
+    starts = starts[counts == 3]
+    return numpy.stack([cells[starts], cells[starts + 1],
+                        cells[starts + 2]], axis=1)  # }}}
+
+
+def _compute_barycentric_weights(sourcePoints, triangles,
+                                 destPoints):  # {{{
+    '''
+    Find the triangle containing each destination point and compute its
+    barycentric coordinates (the coordinates of the point where the ray from
+    the center of the sphere through the destination point intersects the
+    triangle), returning the rows, columns and values of the weight matrix
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    vertices = sourcePoints[triangles]
+    # the barycentric coordinate of each vertex is proportional to the
+    # triple product of the destination point with the opposite edge
+    crossProducts = numpy.stack(
+        [numpy.cross(vertices[:, 1, :], vertices[:, 2, :]),
+         numpy.cross(vertices[:, 2, :], vertices[:, 0, :]),
+         numpy.cross(vertices[:, 0, :], vertices[:, 1, :])], axis=1)
+    # make the coordinates positive inside clockwise triangles, too
+    orientation = numpy.sign(numpy.sum(
+        vertices[:, 0, :]*crossProducts[:, 0, :], axis=1))
+    crossProducts *= orientation[:, numpy.newaxis, numpy.newaxis]
+    centers = numpy.mean(vertices, axis=1)
+    tree = cKDTree(centers)
+    candidateCount = min(_candidateCount, len(triangles))
+
+    rows = []
+    cols = []
+    weights = []
+    for start in range(0, len(destPoints), _chunkSize):
+        points = destPoints[start:start + _chunkSize]
+        _, candidates = tree.query(points, k=candidateCount)
+        if candidateCount == 1:
+            candidates = candidates[:, numpy.newaxis]
+        coordinates = numpy.einsum('nkij,nj->nki', crossProducts[candidates],
+                                   points)
+        total = numpy.sum(coordinates, axis=2)
+        inside = numpy.logical_and(
+            numpy.all(coordinates >= -1e-12*total[:, :, numpy.newaxis],
+                      axis=2),
+            total > 0.)
+        found = numpy.any(inside, axis=1)
+        # the nearest candidate that contains each point
+        first = numpy.argmax(inside, axis=1)
+        pointIndices = numpy.nonzero(found)[0]
+        triangleIndices = candidates[pointIndices, first[pointIndices]]
+        pointCoordinates = coordinates[pointIndices, first[pointIndices], :]
+        pointCoordinates = numpy.maximum(pointCoordinates, 0.)
+        pointCoordinates /= numpy.sum(pointCoordinates,
+                                      axis=1)[:, numpy.newaxis]
+
+        rows.append(numpy.repeat(start + pointIndices, 3))
+        cols.append(triangles[triangleIndices].ravel())
+        weights.append(pointCoordinates.ravel())
+
+    return numpy.concatenate(rows), numpy.concatenate(cols), \
+        numpy.concatenate(weights)  # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -28,6 +28,12 @@ from __future__ import absolute_import, division, print_function, \
 import subprocess
 import tempfile
 import os
+import shutil
+import threading
+import fcntl
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from contextlib import contextmanager
 from distutils.spawn import find_executable
 import numpy
 from scipy.sparse import csr_matrix
@@ -36,6 +42,24 @@ import sys
 
 from mpas_analysis.shared.grid import MpasMeshDescriptor, \
     LatLonGridDescriptor, ProjectionGridDescriptor, PointCollectionDescriptor
+from mpas_analysis.shared.io.utility import get_temp_file_name
+from mpas_analysis.shared.interpolation.native_weights import \
+    supports_native_weights, compute_native_weights, write_esmf_mapping_file
+
+# locks that prevent two threads from building the same mapping file at once
+# (a lock file prevents two processes from doing so)
+_mappingFileLocks = {}
+_mappingFileLocksLock = threading.Lock()
+
+# the most recently used interpolation weights, which persist from one task to
+# the next when tasks are run by long-lived worker processes
+_mappingCache = OrderedDict()
+_mappingCacheSize = 4
+_mappingCacheLock = threading.Lock()
+
+# the arrays in the binary copy of each mapping file in CSR format
+_csrArrayNames = ['indptr', 'indices', 'data', 'shape', 'frac_b',
+                  'src_grid_dims', 'dst_grid_dims']
 
 
 class Remapper(object):
@@ -48,6 +72,10 @@ class Remapper(object):
     # -------
     # Xylar Asay-Davis
 
+    # the maximum size (in bytes) of the blocks of columns and their masks on
+    # the source and destination grids in each sparse-dense matrix product
+    maxBlockBytes = 2**28
+
     def __init__(self, sourceDescriptor, destinationDescriptor,
                  mappingFileName=None):  # {{{
         '''
@@ -100,7 +128,8 @@ class Remapper(object):
         # }}}
 
     def build_mapping_file(self, method='bilinear',
-                           additionalArgs=None, logger=None):  # {{{
+                           additionalArgs=None, logger=None,
+                           useNative=False):  # {{{
         '''
         Given a source file defining either an MPAS mesh or a lat-lon grid and
         a destination file or set of arrays defining a lat-lon grid, constructs
@@ -119,10 +148,19 @@ class Remapper(object):
         logger : ``logging.Logger``, optional
             A logger to which ncclimo output should be redirected
 
+        useNative : bool, optional
+            Whether to compute the weights in MPAS-Analysis with
+            ``compute_native_weights()`` instead of with
+            ``ESMF_RegridWeightGen``, if the method and grids are supported
+            (see ``supports_native_weights()``).  The weights are kept in
+            memory for remapping and written to the mapping file in the
+            format used by ESMF.
+
         Raises
         ------
         OSError
-            If ``ESMF_RegridWeightGen`` is not in the system path.
+            If ``ESMF_RegridWeightGen`` is needed but is not in the system
+            path.
 
         ValueError
             If sourceDescriptor or destinationDescriptor is of an unknown type
@@ -143,6 +181,53 @@ class Remapper(object):
             # a valid weight file already exists, so nothing to do
             return
 
+        with _lock_mapping_file(self.mappingFileName):
+            if os.path.exists(self.mappingFileName):
+                # another thread or process built the mapping file while we
+                # were waiting for the lock
+                return
+
+            if useNative and supports_native_weights(
+                    self.sourceDescriptor, self.destinationDescriptor,
+                    method):
+                self._build_native_mapping_file(method, logger)
+            else:
+                self._build_mapping_file(method, additionalArgs, logger)
+
+        # }}}
+
+    def _build_native_mapping_file(self, method, logger):  # {{{
+        '''
+        Compute the weights with ``compute_native_weights()``, keeping them
+        for remapping, and write them to the mapping file
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        message = 'computing {} weights from {} to {}'.format(
+            method, self.sourceDescriptor.meshName,
+            self.destinationDescriptor.meshName)
+        if logger is None:
+            print(message)
+        else:
+            logger.info(message)
+
+        mapping = compute_native_weights(self.sourceDescriptor,
+                                         self.destinationDescriptor, method)
+        write_esmf_mapping_file(self.mappingFileName, self.sourceDescriptor,
+                                self.destinationDescriptor, mapping, method)
+        self._set_mapping(*mapping)
+        # }}}
+
+    def _build_mapping_file(self, method, additionalArgs, logger):  # {{{
+        '''
+        Run ``ESMF_RegridWeightGen`` to build the mapping file
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
         if find_executable('ESMF_RegridWeightGen') is None:
             raise OSError('ESMF_RegridWeightGen not found. Make sure esmf '
                           'package is installed via\n'
@@ -155,10 +240,12 @@ class Remapper(object):
         self.sourceDescriptor.to_scrip(_get_temp_path())
         self.destinationDescriptor.to_scrip(_get_temp_path())
 
+        tempFileName = get_temp_file_name(self.mappingFileName)
+
         args = ['ESMF_RegridWeightGen',
                 '--source', self.sourceDescriptor.scripFileName,
                 '--destination', self.destinationDescriptor.scripFileName,
-                '--weight', self.mappingFileName,
+                '--weight', tempFileName,
                 '--method', method,
                 '--netcdf4',
                 '--no_log']
@@ -207,6 +294,8 @@ class Remapper(object):
                 raise subprocess.CalledProcessError(process.returncode,
                                                     ' '.join(args))
 
+        os.rename(tempFileName, self.mappingFileName)
+
         # remove the temporary SCRIP files
         os.remove(self.sourceDescriptor.scripFileName)
         os.remove(self.destinationDescriptor.scripFileName)
@@ -214,7 +303,8 @@ class Remapper(object):
         # }}}
 
     def remap_file(self, inFileName, outFileName, variableList=None,
-                   overwrite=False, renormalize=None, logger=None):  # {{{
+                   overwrite=False, renormalize=None, logger=None,
+                   cores=None):  # {{{
         '''
         Given a source file defining either an MPAS mesh or a lat-lon grid and
         a destination file or set of arrays defining a lat-lon grid, constructs
@@ -244,6 +334,10 @@ class Remapper(object):
         logger : ``logging.Logger``, optional
             A logger to which ncclimo output should be redirected
 
+        cores : int, optional
+            The number of cores ``ncremap`` may use, passed on as the number
+            of OpenMP threads.  By default, the environment is left as is.
+
         Raises
         ------
         OSError
@@ -286,11 +380,13 @@ class Remapper(object):
                           'Note: this presumes use of the conda-forge '
                           'channel.')
 
+        tempFileName = get_temp_file_name(outFileName)
+
         args = ['ncremap',
                 '-i', inFileName,
                 '-m', self.mappingFileName,
                 '--vrb=1',
-                '-o', outFileName]
+                '-o', tempFileName]
 
         regridArgs = []
 
@@ -319,6 +415,8 @@ class Remapper(object):
         # local version of NCO instead of one we have intentionally loaded
         env = os.environ.copy()
         env['NCO_PATH_OVERRIDE'] = 'No'
+        if cores is not None:
+            env['OMP_NUM_THREADS'] = '{}'.format(cores)
 
         if logger is None:
             print('running: {}'.format(' '.join(args)))
@@ -349,12 +447,15 @@ class Remapper(object):
             if process.returncode != 0:
                 raise subprocess.CalledProcessError(process.returncode,
                                                     ' '.join(args))
+
+        os.rename(tempFileName, outFileName)
         # }}}
 
-    def remap(self, ds, renormalizationThreshold=None):  # {{{
+    def remap(self, ds, renormalizationThreshold=None, cores=None):  # {{{
         '''
         Given a source data set, returns a remapped version of the data set,
-        possibly masked and renormalized.
+        possibly masked and renormalized.  Data sets are remapped with
+        ``remap_datasets()``.
 
         Parameters
         ----------
@@ -367,6 +468,11 @@ class Remapper(object):
             which it is masked out, or ``None`` for no renormalization and
             masking.
 
+        cores : int, optional
+            The number of threads among which the rows of the mapping matrix
+            are split in the sparse matrix multiply.  By default, remapping
+            is serial.  Results are identical for any number of threads.
+
         Returns
         -------
         remappedDs : `xarray.Dataset`` or ``xarray.DataArray``
@@ -392,41 +498,111 @@ class Remapper(object):
             # No remapping is needed
             return ds
 
-        self._load_mapping()
-
-        for index, dim in enumerate(self.sourceDescriptor.dims):
-            if self.src_grid_dims[index] != ds.sizes[dim]:
-                raise ValueError('data set and remapping source dimension {} '
-                                 'don\'t have the same size: {} != {}'.format(
-                                     dim, self.src_grid_dims[index],
-                                     len(ds.sizes[dim])))
+        if isinstance(ds, xr.Dataset):
+            return self.remap_datasets([ds], renormalizationThreshold,
+                                       cores)[0]
 
-        if isinstance(ds, xr.DataArray):
-            remappedDs = self._remap_data_array(ds, renormalizationThreshold)
-        elif isinstance(ds, xr.Dataset):
-            drop = []
-            for var in ds.data_vars:
-                if self._check_drop(ds[var]):
-                    drop.append(var)
-            remappedDs = ds.drop(drop)
-            remappedDs = remappedDs.apply(self._remap_data_array,
-                                          keep_attrs=True,
-                                          args=(renormalizationThreshold,))
-        else:
+        if not isinstance(ds, xr.DataArray):
             raise TypeError('ds not an xarray Dataset or DataArray.')
 
-        # Update history attribute of netCDF file
-        if 'history' in remappedDs.attrs:
-            newhist = '\n'.join([remappedDs.attrs['history'],
-                                 ' '.join(sys.argv[:])])
-        else:
-            newhist = sys.argv[:]
-        remappedDs.attrs['history'] = newhist
+        self._load_mapping()
+        self._check_source_dims(ds)
 
-        remappedDs.attrs['meshName'] = self.destinationDescriptor.meshName
+        remappedDs = self._remap_data_arrays([ds], renormalizationThreshold,
+                                             cores)[0]
+        self._add_remapped_attrs(remappedDs)
 
         return remappedDs  # }}}
 
+    def remap_datasets(self, datasets, renormalizationThreshold=None,
+                       cores=None):  # {{{
+        '''
+        Given several source data sets (e.g. the climatologies of all
+        seasons), returns remapped versions of the data sets, possibly masked
+        and renormalized.  Every field in every data set is flattened to
+        columns (one per vertical level, etc.) that are stacked into blocks
+        of at most ``maxBlockBytes``, so the weights are applied with one
+        sparse-dense matrix product per block.  The masks of fields that need
+        renormalization are remapped together in a second product, with each
+        distinct mask in a block remapped only once.  The data sets and their
+        remapped versions are all held in memory, so callers with many large
+        data sets should remap a few at a time.
+
+        Parameters
+        ----------
+        datasets : list of ``xarray.Dataset``
+            The data sets to remap.  The dimention(s) along
+            ``self.sourceDimNames`` must match ``self.src_grid_dims`` read
+            from the mapping file.
+
+        renormalizationThreshold : float, optional
+            The minimum weight of a denstination cell after remapping, below
+            which it is masked out, or ``None`` for no renormalization and
+            masking.
+
+        cores : int, optional
+            The number of threads among which the rows of the mapping matrix
+            are split in the sparse matrix multiply.  By default, remapping
+            is serial.  Results are identical for any number of threads.
+
+        Returns
+        -------
+        remappedDatasets : list of ``xarray.Dataset``
+            The remapped data sets, in the same order as ``datasets``, where
+            dimensions other than ``self.sourceDimNames`` are the same as in
+            the original data sets and the dimension(s) given by
+            ``self.sourceDimNames`` have been replaced by
+            ``self.destinationDimNames``.
+
+        Raises
+        ------
+        ValueError
+            If the size of ``self.sourceDimNames`` in a data set do not match
+            the source dimensions read in from the mapping file
+            (``self.src_grid_dims``).
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.mappingFileName is None:
+            # No remapping is needed
+            return list(datasets)
+
+        self._load_mapping()
+
+        # find the variables with the source dimension(s), dropping those
+        # that have some but not all of them
+        dataArrays = []
+        for ds in datasets:
+            self._check_source_dims(ds)
+            for var in ds.data_vars:
+                if self._get_remap_axes(ds[var]) is not None:
+                    dataArrays.append(ds[var])
+
+        remappedArrays = self._remap_data_arrays(dataArrays,
+                                                 renormalizationThreshold,
+                                                 cores)
+
+        remappedDatasets = []
+        index = 0
+        for ds in datasets:
+            variables = OrderedDict()
+            for var in ds.data_vars:
+                if self._check_drop(ds[var]):
+                    continue
+                if self._get_remap_axes(ds[var]) is None:
+                    # no remapping is needed
+                    variables[var] = ds[var]
+                else:
+                    variables[var] = remappedArrays[index]
+                    index += 1
+            remappedDs = xr.Dataset(variables, attrs=ds.attrs)
+            self._add_remapped_attrs(remappedDs)
+            remappedDatasets.append(remappedDs)
+
+        return remappedDatasets  # }}}
+
     def _load_mapping(self):  # {{{
         '''
         Load weights and indices from a mapping file, if this has not already
@@ -439,14 +615,23 @@ class Remapper(object):
         if self.mappingLoaded:
             return
 
-        dsMapping = xr.open_dataset(self.mappingFileName)
-        n_a = dsMapping.dims['n_a']
-        n_b = dsMapping.dims['n_b']
+        self._set_mapping(*_read_mapping_file(self.mappingFileName))
+        # }}}
+
+    def _set_mapping(self, src_grid_dims, dst_grid_dims, frac_b,
+                     matrix):  # {{{
+        '''
+        Check the grid dimensions of the mapping against the source and
+        destination descriptors and store the weights for remapping
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
 
         nSourceDims = len(self.sourceDescriptor.dims)
-        src_grid_rank = dsMapping.dims['src_grid_rank']
+        src_grid_rank = len(src_grid_dims)
         nDestinationDims = len(self.destinationDescriptor.dims)
-        dst_grid_rank = dsMapping.dims['dst_grid_rank']
+        dst_grid_rank = len(dst_grid_dims)
 
         # check that the mapping file has the right number of dimensions
         if nSourceDims != src_grid_rank or \
@@ -459,9 +644,8 @@ class Remapper(object):
                                  nSourceDims, src_grid_rank,
                                  nDestinationDims, dst_grid_rank))
 
-        # grid dimensions need to be reversed because they are in Fortran order
-        self.src_grid_dims = dsMapping['src_grid_dims'].values[::-1]
-        self.dst_grid_dims = dsMapping['dst_grid_dims'].values[::-1]
+        self.src_grid_dims = src_grid_dims
+        self.dst_grid_dims = dst_grid_dims
 
         # now, check that each source and destination dimension is right
         for index in range(len(self.sourceDescriptor.dims)):
@@ -481,12 +665,8 @@ class Remapper(object):
                                  'dimension {} don\'t have the same size: \n'
                                  '{} != {}'.format(dim, dimSize, checkDimSize))
 
-        self.frac_b = dsMapping['frac_b'].values
-
-        col = dsMapping['col'].values-1
-        row = dsMapping['row'].values-1
-        S = dsMapping['S'].values
-        self.matrix = csr_matrix((S, (row, col)), shape=(n_b, n_a))
+        self.frac_b = frac_b
+        self.matrix = matrix
 
         self.mappingLoaded = True  # }}}
 
@@ -498,9 +678,51 @@ class Remapper(object):
         return (numpy.any(sourceDimsInArray) and not
                 numpy.all(sourceDimsInArray))  # }}}
 
-    def _remap_data_array(self, dataArray, renormalizationThreshold):  # {{{
+    def _check_source_dims(self, ds):  # {{{
+        '''
+        Check that the source dimensions of a data set or data array match
+        those in the mapping file
+        '''
+        for index, dim in enumerate(self.sourceDescriptor.dims):
+            if self.src_grid_dims[index] != ds.sizes[dim]:
+                raise ValueError('data set and remapping source dimension {} '
+                                 'don\'t have the same size: {} != {}'.format(
+                                     dim, self.src_grid_dims[index],
+                                     ds.sizes[dim]))  # }}}
+
+    def _add_remapped_attrs(self, remappedDs):  # {{{
+        '''
+        Update the history attribute and add the destination mesh name
+        '''
+        if 'history' in remappedDs.attrs:
+            newhist = '\n'.join([remappedDs.attrs['history'],
+                                 ' '.join(sys.argv[:])])
+        else:
+            newhist = sys.argv[:]
+        remappedDs.attrs['history'] = newhist
+
+        remappedDs.attrs['meshName'] = self.destinationDescriptor.meshName
+        # }}}
+
+    def _get_remap_axes(self, dataArray):  # {{{
         '''
-        Remap a single xarray data array
+        The axes of a data array along the source dimension(s), or ``None``
+        if it doesn't have all of the source dimensions
+        '''
+        if self._check_drop(dataArray):
+            return None
+
+        remapAxes = [index for index, dim in enumerate(dataArray.dims) if
+                     dim in self.sourceDescriptor.dims]
+        if len(remapAxes) == 0:
+            return None
+        return remapAxes  # }}}
+
+    def _remap_data_arrays(self, dataArrays, renormalizationThreshold,
+                           cores=None):  # {{{
+        '''
+        Remap xarray data arrays together, returning data arrays with the
+        destination dimension(s) in place of the source dimension(s)
         '''
         # Authors
         # -------
@@ -509,111 +731,204 @@ class Remapper(object):
         sourceDims = self.sourceDescriptor.dims
         destDims = self.destinationDescriptor.dims
 
-        sourceDimsInArray = [dim in dataArray.dims for dim in sourceDims]
-
-        if not numpy.any(sourceDimsInArray):
-            # no remapping is needed
-            return dataArray
-
-        if not numpy.all(sourceDimsInArray):
-            # no remapping is possible so the variable array should have been
-            # dropped
-            raise ValueError('Data array with some (but not all) required '
-                             'source dims cannot be remapped\n'
-                             'and should have been dropped.')
-
-        # make a list of dims and remapAxes
-        dims = []
-        remapAxes = []
-        destDimsAdded = False
-        for index, dim in enumerate(dataArray.dims):
-            if dim in sourceDims:
-                remapAxes.append(index)
-                if not destDimsAdded:
-                    dims.extend(destDims)
-                    destDimsAdded = True
-            else:
-                dims.append(dim)
-
-        # make a dict of coords
-        coordDict = {}
-        # copy unmodified coords
-        for coord in dataArray.coords:
-            sourceDimInCoord = numpy.any([dim in dataArray.coords[coord].dims
-                                          for dim in sourceDims])
-            if not sourceDimInCoord:
-                coordDict[coord] = {'dims': dataArray.coords[coord].dims,
-                                    'data': dataArray.coords[coord].values}
-
-        # add dest coords
-        coordDict.update(self.destinationDescriptor.coords)
+        fields = []
+        layouts = []
+        for dataArray in dataArrays:
+            remapAxes = self._get_remap_axes(dataArray)
+            if remapAxes is None:
+                raise ValueError('Data array with some (but not all) '
+                                 'required source dims cannot be remapped\n'
+                                 'and should have been dropped.')
+            field, extraShape = _flatten_field(dataArray.values, remapAxes)
+            fields.append(field)
+            layouts.append((remapAxes, extraShape))
+
+        remappedFields = self._remap_fields(fields, renormalizationThreshold,
+                                            cores)
+
+        remappedArrays = []
+        for dataArray, remappedField, (remapAxes, extraShape) in zip(
+                dataArrays, remappedFields, layouts):
+            # make a list of dims with the destination dim(s) in place of
+            # the source dim(s)
+            dims = []
+            destDimsAdded = False
+            for dim in dataArray.dims:
+                if dim in sourceDims:
+                    if not destDimsAdded:
+                        dims.extend(destDims)
+                        destDimsAdded = True
+                else:
+                    dims.append(dim)
+
+            # make a dict of coords
+            coordDict = {}
+            # copy unmodified coords
+            for coord in dataArray.coords:
+                sourceDimInCoord = numpy.any(
+                    [dim in dataArray.coords[coord].dims
+                     for dim in sourceDims])
+                if not sourceDimInCoord:
+                    coordDict[coord] = {
+                        'dims': dataArray.coords[coord].dims,
+                        'data': dataArray.coords[coord].values}
+
+            # add dest coords
+            coordDict.update(self.destinationDescriptor.coords)
+
+            arrayDict = {'coords': coordDict,
+                         'attrs': dataArray.attrs,
+                         'dims': dims,
+                         'data': self._unflatten_field(
+                             remappedField, remapAxes, extraShape),
+                         'name': dataArray.name}
+
+            # make a new data array
+            remappedArrays.append(xr.DataArray.from_dict(arrayDict))
+
+        return remappedArrays  # }}}
+
+    def _remap_fields(self, fields, renormalizationThreshold,
+                      cores=None):  # {{{
+        '''
+        Remap 2D numpy arrays with the source dimension first.  The columns of
+        the arrays are stacked into blocks of at most ``maxBlockBytes`` (with
+        their masks and remapped values) so the weights are applied in as few
+        sparse-dense matrix products (split among ``cores`` threads) as
+        possible without a large temporary copy of all the fields.  If
+        ``renormalizationThreshold`` is not ``None``, fields with NaNs are
+        renormalized by the remapped mask of valid values and masked where it
+        is below the threshold.  Other fields are normalized by ``frac_b``.
+        Masked values are NaN.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
 
-        # remap the values
-        field = dataArray.values
-        mask = numpy.isnan(field)
-        if numpy.count_nonzero(mask) > 0:
-            field = numpy.ma.masked_array(field, mask)
-        remappedField = self._remap_numpy_array(field, remapAxes,
-                                                renormalizationThreshold)
+        destCount, sourceCount = self.matrix.shape
 
-        arrayDict = {'coords': coordDict,
-                     'attrs': dataArray.attrs,
-                     'dims': dims,
-                     'data': remappedField,
-                     'name': dataArray.name}
+        # the data and mask blocks on the source and destination grids
+        chunkSize = max(1, int(self.maxBlockBytes //
+                               (16*(sourceCount + destCount))))
 
-        # make a new data array
-        remappedArray = xr.DataArray.from_dict(arrayDict)
+        # the index of the field of each column of the stacked fields
+        columns = []
+        for fieldIndex, field in enumerate(fields):
+            columns.extend([fieldIndex]*field.shape[1])
 
-        return remappedArray  # }}}
+        remappedFields = [numpy.full((destCount, field.shape[1]), numpy.nan)
+                          for field in fields]
 
-    def _remap_numpy_array(self, inField, remapAxes,
-                           renormalizationThreshold):  # {{{
+        # the rows of the matrix are split among the threads of one pool that
+        # is used for all blocks
+        bounds = _get_row_bounds(self.matrix, cores)
+        if len(bounds) > 2:
+            pool = ThreadPool(len(bounds) - 1)
+        else:
+            pool = None
+
+        fieldStarts = numpy.cumsum([0] + [field.shape[1] for field in fields])
+        try:
+            for chunkStart in range(0, len(columns), chunkSize):
+                chunkStop = min(chunkStart + chunkSize, len(columns))
+                self._remap_chunk(fields, remappedFields, fieldStarts,
+                                  columns[chunkStart:chunkStop], chunkStart,
+                                  renormalizationThreshold, bounds, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return remappedFields  # }}}
+
+    def _remap_chunk(self, fields, remappedFields, fieldStarts,
+                     columns, chunkStart, renormalizationThreshold, bounds,
+                     pool):  # {{{
         '''
-        Remap a single numpy array
+        Remap a contiguous range of the stacked columns of the fields, given
+        the field of each column and the index of the first, into
+        ``remappedFields``.  Each distinct mask in the range is remapped only
+        once.  The rows of the matrix are split among the threads of ``pool``
+        as given by ``bounds``.
         '''
         # Authors
         # -------
         # Xylar Asay-Davis
 
-        # permute the dimensions of inField so the axes to remap are first,
-        # then flatten the remapping and the extra dimensions separately for
-        # the matrix multiply
-        extraAxes = [axis for axis in numpy.arange(inField.ndim)
-                     if axis not in remapAxes]
-
-        newShape = [numpy.prod([inField.shape[axis] for axis in remapAxes])]
-        if len(extraAxes) > 0:
-            extraShape = [inField.shape[axis] for axis in extraAxes]
-            newShape.append(numpy.prod(extraShape))
-        else:
-            extraShape = []
-            newShape.append(1)
-
-        permutedAxes = remapAxes + extraAxes
-
-        # permute axes so the remapped dimension(s) come first and "flatten"
-        # the remapping dimension
-        inField = inField.transpose(permutedAxes).reshape(newShape)
-
-        masked = (isinstance(inField, numpy.ma.MaskedArray) and
-                  renormalizationThreshold is not None)
-        if masked:
-            inMask = numpy.array(numpy.logical_not(inField.mask), float)
-            outField = self.matrix.dot(inMask*inField)
-            outMask = self.matrix.dot(inMask)
-            mask = outMask > renormalizationThreshold
-        else:
-            outField = self.matrix.dot(inField)
-            # make frac_b match the shape of outField
-            outMask = numpy.reshape(self.frac_b, (len(self.frac_b), 1)).repeat(
-                newShape[1], axis=1)
-            mask = outMask > 0.
+        sourceCount = self.matrix.shape[1]
+        block = numpy.zeros((sourceCount, len(columns)))
+
+        # the part of each field in the block (as slices of the field and of
+        # the block) and the indices of the masks of its columns in
+        # maskColumns (if it is renormalized)
+        segments = []
+        uniqueMasks = {}
+        maskColumns = []
+        for fieldIndex in sorted(set(columns)):
+            field = fields[fieldIndex]
+            blockStart = columns.index(fieldIndex)
+            blockStop = blockStart + columns.count(fieldIndex)
+            fieldStart = chunkStart + blockStart - fieldStarts[fieldIndex]
+            fieldColumns = slice(fieldStart,
+                                 fieldStart + blockStop - blockStart)
+            blockColumns = slice(blockStart, blockStop)
+
+            values = field[:, fieldColumns]
+            block[:, blockColumns] = values
+
+            invalid = numpy.isnan(values)
+            if renormalizationThreshold is None or not numpy.any(invalid):
+                segments.append((fieldIndex, fieldColumns, blockColumns,
+                                 None))
+                continue
+
+            # masked values don't contribute to the remapped field
+            block[:, blockColumns][invalid] = 0.
+            indices = []
+            for column in range(values.shape[1]):
+                valid = numpy.logical_not(invalid[:, column])
+                key = numpy.packbits(valid).tobytes()
+                if key not in uniqueMasks:
+                    uniqueMasks[key] = len(maskColumns)
+                    maskColumns.append(valid)
+                indices.append(uniqueMasks[key])
+            segments.append((fieldIndex, fieldColumns, blockColumns,
+                             indices))
+
+        outBlock = _multiply(self.matrix, block, bounds, pool)
+        del block
+
+        if len(maskColumns) > 0:
+            maskBlock = numpy.zeros((sourceCount, len(maskColumns)))
+            for index, valid in enumerate(maskColumns):
+                maskBlock[:, index] = valid
+            outMasks = _multiply(self.matrix, maskBlock, bounds, pool)
+            del maskBlock
+
+        for fieldIndex, fieldColumns, blockColumns, indices in segments:
+            outField = outBlock[:, blockColumns]
+            if indices is None:
+                outMask = self.frac_b[:, numpy.newaxis]
+                threshold = 0.
+            else:
+                outMask = outMasks[:, indices]
+                threshold = renormalizationThreshold
+            valid = numpy.broadcast_to(outMask > threshold, outField.shape)
+
+            # normalize the result based on outMask
+            numpy.divide(outField, outMask,
+                         out=remappedFields[fieldIndex][:, fieldColumns],
+                         where=valid)
+        # }}}
 
-        # normalize the result based on outMask
-        outField[mask] /= outMask[mask]
-        outField = numpy.ma.masked_array(outField,
-                                         mask=numpy.logical_not(mask))
+    def _unflatten_field(self, outField, remapAxes, extraShape):  # {{{
+        '''
+        "Unflatten" a remapped field to the destination dimension(s) and the
+        extra dimensions, in the order of the original field
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
 
         destRemapDimCount = len(self.dst_grid_dims)
         outDimCount = len(extraShape) + destRemapDimCount
@@ -628,9 +943,280 @@ class Remapper(object):
         unpermuteAxes = (unpermuteAxes[0:index] +
                          list(numpy.arange(destRemapDimCount)) +
                          unpermuteAxes[index:])
-        outField = numpy.transpose(outField, axes=unpermuteAxes)
+        return numpy.transpose(outField, axes=unpermuteAxes)  # }}}
+
+
+def _flatten_field(inField, remapAxes):  # {{{
+    '''
+    Permute the dimensions of a field so the axes to remap are first, then
+    flatten the remapping and the extra dimensions separately into a 2D array
+    for the matrix multiply, returning the 2D array and the shape of the extra
+    dimensions
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    extraAxes = [axis for axis in numpy.arange(inField.ndim)
+                 if axis not in remapAxes]
+
+    newShape = [numpy.prod([inField.shape[axis] for axis in remapAxes])]
+    if len(extraAxes) > 0:
+        extraShape = [inField.shape[axis] for axis in extraAxes]
+        newShape.append(numpy.prod(extraShape))
+    else:
+        extraShape = []
+        newShape.append(1)
+
+    permutedAxes = remapAxes + extraAxes
+
+    # permute axes so the remapped dimension(s) come first and "flatten"
+    # the remapping dimension
+    return inField.transpose(permutedAxes).reshape(newShape), extraShape
+    # }}}
+
+
+def _get_row_bounds(matrix, cores):  # {{{
+    '''
+    Split the rows of a CSR matrix into at most ``cores`` contiguous chunks
+    with about the same number of nonzeros, returning the first row of each
+    chunk followed by the number of rows
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    rowCount = matrix.shape[0]
+    if cores is None or cores <= 1 or rowCount < 2:
+        return numpy.array([0, rowCount])
+
+    chunkCount = min(cores, rowCount)
+    indptr = matrix.indptr
+    bounds = numpy.searchsorted(
+        indptr, numpy.linspace(0, indptr[-1], chunkCount + 1)[1:-1])
+    return numpy.unique(numpy.concatenate(
+        ([0], numpy.minimum(bounds, rowCount), [rowCount])))  # }}}
+
+
+def _multiply(matrix, block, bounds, pool):  # {{{
+    '''
+    Multiply a CSR matrix by a dense block, with each chunk of rows given by
+    ``bounds`` (from ``_get_row_bounds()``) multiplied by a thread of
+    ``pool``.  SciPy releases the GIL while multiplying each chunk, and each
+    row is computed exactly as in the serial product, so the result doesn't
+    depend on the number of threads.  If ``pool`` is ``None``, the product
+    is serial.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    if pool is None or len(bounds) <= 2:
+        return matrix.dot(block)
+
+    indptr = matrix.indptr
+    outBlock = numpy.zeros((matrix.shape[0], block.shape[1]),
+                           dtype=numpy.result_type(matrix.dtype,
+                                                   block.dtype))
+
+    def multiply_chunk(bound):
+        start, stop = bound
+        if start == stop:
+            return
+        # views of the indices and weights of the chunk (no copying)
+        chunk = csr_matrix(
+            (matrix.data[indptr[start]:indptr[stop]],
+             matrix.indices[indptr[start]:indptr[stop]],
+             indptr[start:stop + 1] - indptr[start]),
+            shape=(stop - start, matrix.shape[1]))
+        outBlock[start:stop, :] = chunk.dot(block)
+
+    pool.map(multiply_chunk, list(zip(bounds[:-1], bounds[1:])),
+             chunksize=1)
+
+    return outBlock  # }}}
+
+
+def _read_mapping_file(mappingFileName):  # {{{
+    '''
+    Read the grid dimensions, destination fractions and sparse weight matrix
+    from a mapping file, reusing them if the same (unmodified) file was read
+    recently in this process.  Otherwise, they are read from a binary copy of
+    the mapping file in compressed sparse row (CSR) format, which is created
+    the first time the mapping file is read.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    fileStat = os.stat(mappingFileName)
+    cacheKey = (os.path.abspath(mappingFileName), fileStat.st_mtime,
+                fileStat.st_size)
+
+    with _mappingCacheLock:
+        if cacheKey in _mappingCache:
+            mapping = _mappingCache.pop(cacheKey)
+            # move the mapping to the end as the most recently used
+            _mappingCache[cacheKey] = mapping
+            return mapping
+
+    source = _get_csr_source(fileStat)
+    mapping = _read_csr_mapping(mappingFileName, source)
+    if mapping is None:
+        mapping = _read_esmf_mapping(mappingFileName)
+        _write_csr_mapping(mappingFileName, source, mapping)
+
+    with _mappingCacheLock:
+        _mappingCache[cacheKey] = mapping
+        while len(_mappingCache) > _mappingCacheSize:
+            _mappingCache.popitem(last=False)
+
+    return mapping  # }}}
+
+
+def _read_esmf_mapping(mappingFileName):  # {{{
+    '''
+    Read the grid dimensions, destination fractions and sparse weight matrix
+    from a mapping file in the format produced by ``ESMF_RegridWeightGen``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    dsMapping = xr.open_dataset(mappingFileName)
+    n_a = dsMapping.dims['n_a']
+    n_b = dsMapping.dims['n_b']
+
+    # grid dimensions need to be reversed because they are in Fortran order
+    src_grid_dims = dsMapping['src_grid_dims'].values[::-1]
+    dst_grid_dims = dsMapping['dst_grid_dims'].values[::-1]
+
+    frac_b = dsMapping['frac_b'].values
+
+    col = dsMapping['col'].values-1
+    row = dsMapping['row'].values-1
+    S = dsMapping['S'].values
+    matrix = csr_matrix((S, (row, col)), shape=(n_b, n_a))
+    dsMapping.close()
+
+    return src_grid_dims, dst_grid_dims, frac_b, matrix  # }}}
+
+
+def _get_csr_directory(mappingFileName):  # {{{
+    '''
+    The directory next to a mapping file that holds its binary CSR copy
+    '''
+    return '{}.csr'.format(os.path.splitext(mappingFileName)[0])  # }}}
+
+
+def _get_csr_source(fileStat):  # {{{
+    '''
+    A description of the mapping file, used to check whether its binary CSR
+    copy is still valid
+    '''
+    return '{}:{!r}'.format(fileStat.st_size, fileStat.st_mtime)  # }}}
+
+
+def _read_csr_mapping(mappingFileName, source):  # {{{
+    '''
+    Read the grid dimensions, destination fractions and sparse weight matrix
+    from the binary CSR copy of a mapping file, returning ``None`` if there is
+    no valid copy.  The large arrays are memory mapped, so processes using
+    the same mapping share the pages in the operating system's file cache.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    directory = _get_csr_directory(mappingFileName)
+    try:
+        with open('{}/source'.format(directory)) as sourceFile:
+            if sourceFile.read() != source:
+                # the mapping file has changed since the copy was made
+                return None
+        arrays = {}
+        for name in _csrArrayNames:
+            arrays[name] = numpy.load('{}/{}.npy'.format(directory, name),
+                                      mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+
+    matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                        shape=tuple(arrays['shape']), copy=False)
+
+    return numpy.array(arrays['src_grid_dims']), \
+        numpy.array(arrays['dst_grid_dims']), arrays['frac_b'], \
+        matrix  # }}}
+
+
+def _write_csr_mapping(mappingFileName, source, mapping):  # {{{
+    '''
+    Write a binary CSR copy of a mapping file, if possible.  The copy is
+    written to a temporary directory that is renamed once it is complete, so
+    other processes never read a partial copy.  Failures (e.g. because the
+    mapping directory is read-only) are ignored, since the mapping file
+    itself can always be read instead.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    src_grid_dims, dst_grid_dims, frac_b, matrix = mapping
+    arrays = {'indptr': matrix.indptr,
+              'indices': matrix.indices,
+              'data': matrix.data,
+              'shape': numpy.array(matrix.shape),
+              'frac_b': frac_b,
+              'src_grid_dims': src_grid_dims,
+              'dst_grid_dims': dst_grid_dims}
+
+    directory = _get_csr_directory(mappingFileName)
+    tempDirectory = None
+    try:
+        tempDirectory = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(directory)),
+            prefix='.{}.'.format(os.path.basename(directory)))
+        for name in _csrArrayNames:
+            numpy.save('{}/{}.npy'.format(tempDirectory, name), arrays[name])
+        with open('{}/source'.format(tempDirectory), 'w') as sourceFile:
+            sourceFile.write(source)
+        if os.path.exists(directory):
+            # the copy is out of date
+            shutil.rmtree(directory)
+        os.rename(tempDirectory, directory)
+    except (IOError, OSError):
+        # the directory isn't writable or another process just made a copy
+        pass
+    finally:
+        if tempDirectory is not None and os.path.exists(tempDirectory):
+            shutil.rmtree(tempDirectory, ignore_errors=True)
+    # }}}
+
+
+@contextmanager
+def _lock_mapping_file(mappingFileName):  # {{{
+    '''
+    Hold an exclusive lock for building the given mapping file, shared
+    between threads and (through a lock file next to the mapping file)
+    between processes, including other runs of MPAS-Analysis
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
 
-        return outField  # }}}
+    with _mappingFileLocksLock:
+        if mappingFileName not in _mappingFileLocks:
+            _mappingFileLocks[mappingFileName] = threading.Lock()
+        threadLock = _mappingFileLocks[mappingFileName]
+
+    with threadLock:
+        with open('{}.lock'.format(mappingFileName), 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+    # }}}
 
 
 def _get_temp_path():  # {{{
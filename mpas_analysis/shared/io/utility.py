@@ -19,9 +19,14 @@ from __future__ import absolute_import, division, print_function, \
 
 import glob
 import os
+import re
+import time
+import errno
 import random
 import string
 from datetime import datetime
+import numpy
+import netCDF4
 
 
 def paths(*args):  # {{{
@@ -225,6 +230,94 @@ def check_path_exists(path):  # {{{
         raise OSError('Path {} not found'.format(path))  # }}}
 
 
+# temporary files are named after the process that writes them
+_tempFilePattern = re.compile(r'\.tmp(\d+)(\.[^.]*)?$')
+
+# temporary files that haven't been modified for this many seconds and whose
+# process no longer exists are removed
+_staleTempFileAge = 600.
+
+# the directories where stale temporary files have already been removed
+_cleanedTempDirectories = set()
+
+
+def get_temp_file_name(fileName):  # {{{
+    """
+    Get the name of a temporary file to write to in place of the given file.
+    The temporary file is in the same directory and has the same extension.
+    Writing to the temporary file and renaming it to ``fileName`` once it
+    has been written completely means a partial file (e.g. from a task that
+    was killed) is never mistaken for a finished one.
+
+    The first time a process writes to a directory, temporary files left
+    behind there by processes that no longer exist (e.g. tasks killed after
+    a timeout) are removed.
+
+    Parameters
+    ----------
+    fileName : str
+        The file that will eventually be written
+
+    Returns
+    -------
+    tempFileName : str
+        The name of the temporary file, unique to this process
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    directory = os.path.dirname(os.path.abspath(fileName))
+    if directory not in _cleanedTempDirectories:
+        _cleanedTempDirectories.add(directory)
+        _remove_stale_temp_files(directory)
+
+    base, extension = os.path.splitext(fileName)
+    return '{}.tmp{}{}'.format(base, os.getpid(), extension)  # }}}
+
+
+def _remove_stale_temp_files(directory):  # {{{
+    """
+    Remove temporary files from ``get_temp_file_name()`` in a directory that
+    were written by processes that no longer exist and haven't been modified
+    recently (in case the directory is shared with other machines)
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    try:
+        fileNames = os.listdir(directory)
+    except OSError:
+        return
+
+    now = time.time()
+    for fileName in fileNames:
+        match = _tempFilePattern.search(fileName)
+        if match is None or _process_exists(int(match.group(1))):
+            continue
+        fileName = '{}/{}'.format(directory, fileName)
+        try:
+            if now - os.path.getmtime(fileName) > _staleTempFileAge:
+                os.remove(fileName)
+        except OSError:
+            # removed by another process in the meantime
+            pass
+    # }}}
+
+
+def _process_exists(pid):  # {{{
+    """
+    Whether a process with the given ID exists on this machine
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # we may not have permission to signal someone else's process
+        return e.errno == errno.EPERM
+    return True  # }}}
+
+
 def get_files_year_month(fileNames, streamsFile, streamName):  # {{{
     """
     Extract the year and month from file names associated with a stream
@@ -259,4 +352,46 @@ def get_files_year_month(fileNames, streamsFile, streamName):  # {{{
 
     return years, months  # }}}
 
+
+def get_variable_bytes(fileNames, variableList=None):  # {{{
+    """
+    Get the total size of the given variables in a set of NetCDF files, as
+    found in the file headers (so without reading the data)
+
+    Parameters
+    ----------
+    fileNames : list of str
+        The NetCDF files
+
+    variableList : list of str, optional
+        The variables to include (those not in a file are ignored).  By
+        default, all variables are included.
+
+    Returns
+    -------
+    totalBytes : int
+        The total size of the (uncompressed) variables in bytes
+    """
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    totalBytes = 0
+    for fileName in fileNames:
+        with netCDF4.Dataset(fileName, 'r') as ds:
+            if variableList is None:
+                variableNames = list(ds.variables.keys())
+            else:
+                variableNames = [variable for variable in variableList
+                                 if variable in ds.variables]
+            for variableName in variableNames:
+                variable = ds.variables[variableName]
+                if variable.dtype is str:
+                    # variable-length strings have no fixed size
+                    continue
+                itemSize = numpy.dtype(variable.dtype).itemsize
+                totalBytes += variable.size*itemSize
+
+    return totalBytes  # }}}
+
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -13,11 +13,17 @@ from __future__ import absolute_import, division, print_function, \
 
 import netCDF4
 import numpy
+import os
+
+from mpas_analysis.shared.io.utility import get_temp_file_name
 
 
 def write_netcdf(ds, fileName, fillValues=netCDF4.default_fillvals):  # {{{
     '''
-    Write an xarray data set to a NetCDF file using finite fill values
+    Write an xarray data set to a NetCDF file using finite fill values.  The
+    data set is written to a temporary file that is renamed once it is
+    complete, so that a task that is killed while writing doesn't leave a
+    partial file behind.
 
     Parameters
     ----------
@@ -47,7 +53,14 @@ def write_netcdf(ds, fileName, fillValues=netCDF4.default_fillvals):  # {{{
                     {'_FillValue': fillValues[fillType]}
                 break
 
-    ds.to_netcdf(fileName, encoding=encodingDict)
+    tempFileName = get_temp_file_name(fileName)
+    try:
+        ds.to_netcdf(tempFileName, encoding=encodingDict)
+    except BaseException:
+        if os.path.exists(tempFileName):
+            os.remove(tempFileName)
+        raise
+    os.rename(tempFileName, fileName)
 
     # }}}
 
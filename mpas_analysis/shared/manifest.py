@@ -0,0 +1,222 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+A manifest of fingerprints of the inputs to each task, used to skip tasks
+whose inputs have not changed since they last ran successfully
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import json
+import hashlib
+
+import mpas_analysis
+
+# config sections and options that don't affect the results of tasks (only
+# how and which tasks are run and how the web page is built)
+_ignoredConfigSections = ['execute', 'html']
+_ignoredConfigOptions = [('output', 'generate')]
+
+
+class TaskManifest(object):  # {{{
+    '''
+    A manifest of the fingerprint of each task that has run successfully,
+    stored in a JSON file.
+
+    The fingerprint of a task is a hash of:
+
+    * the MPAS-Analysis version and the class and name of the task
+
+    * the path, size and modification time of each file returned by the
+      task's ``get_input_files()``
+
+    * the parameters returned by the task's ``get_fingerprint_parameters()``
+
+    * all config options, except those in the ``execute`` and ``html``
+      sections and the ``generate`` option, which determine how and which
+      tasks are run but not their results.  Tasks may read options from
+      any section (e.g. ``climatology``, ``plot`` or the observations of a
+      component), so a change to any other option reruns every task.
+
+    * the fingerprints of the task's prerequisites and subtasks
+
+    Attributes
+    ----------
+    fileName : str
+        The JSON file the manifest is read from and written to
+
+    fingerprints : dict
+        The fingerprint of each task that last ran successfully, with the
+        full task name as the key
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, fileName):  # {{{
+        '''
+        Read the manifest if it exists
+
+        Parameters
+        ----------
+        fileName : str
+            The JSON file the manifest is read from and written to
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.fileName = fileName
+        self.fingerprints = {}
+
+        if os.path.exists(fileName):
+            try:
+                with open(fileName) as manifestFile:
+                    self.fingerprints = json.load(manifestFile)['tasks']
+            except (IOError, ValueError, KeyError):
+                # a damaged manifest just means tasks will be rerun
+                self.fingerprints = {}
+        # }}}
+
+    def compute_fingerprint(self, analysisTask, prereqFingerprints):  # {{{
+        '''
+        Compute the fingerprint of the inputs to a task
+
+        Parameters
+        ----------
+        analysisTask : ``AnalysisTask``
+            The task, which must have been set up
+
+        prereqFingerprints : list of str
+            The fingerprints of the prerequisites and subtasks of the task
+
+        Returns
+        -------
+        fingerprint : str
+            A hash of the inputs to the task
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        config = analysisTask.config
+        configOptions = {}
+        for section in config.sections():
+            if section in _ignoredConfigSections:
+                continue
+            options = sorted(
+                [(option, value) for option, value in
+                 config.items(section, raw=True)
+                 if (section, option) not in _ignoredConfigOptions])
+            if len(options) > 0:
+                configOptions[section] = options
+
+        inputFiles = []
+        for fileName in sorted(set(analysisTask.get_input_files())):
+            if os.path.exists(fileName):
+                fileStat = os.stat(fileName)
+                inputFiles.append([os.path.abspath(fileName),
+                                   fileStat.st_size, fileStat.st_mtime])
+            else:
+                inputFiles.append([os.path.abspath(fileName), None, None])
+
+        taskClass = type(analysisTask)
+        contents = {'version': mpas_analysis.__version__,
+                    'class': '{}.{}'.format(taskClass.__module__,
+                                            taskClass.__name__),
+                    'task': analysisTask.fullTaskName,
+                    'config': configOptions,
+                    'inputFiles': inputFiles,
+                    'parameters': analysisTask.get_fingerprint_parameters(),
+                    'prereqs': sorted(prereqFingerprints)}
+
+        # repr is used for anything JSON can't handle (e.g. numpy arrays)
+        encoded = json.dumps(contents, sort_keys=True, default=repr)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()  # }}}
+
+    def is_unchanged(self, analysisTask, fingerprint):  # {{{
+        '''
+        Whether the task last ran successfully with the same fingerprint and
+        the files it writes (from its ``get_output_files()``) still exist
+
+        Parameters
+        ----------
+        analysisTask : ``AnalysisTask``
+            The task
+
+        fingerprint : str
+            The current fingerprint of the task
+
+        Returns
+        -------
+        unchanged : bool
+            Whether the task can be skipped
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.fingerprints.get(analysisTask.fullTaskName) != fingerprint:
+            return False
+
+        for fileName in analysisTask.get_output_files():
+            if not os.path.exists(fileName):
+                return False
+
+        return True  # }}}
+
+    def record(self, analysisTask, fingerprint):  # {{{
+        '''
+        Record the fingerprint of a task that ran successfully, or remove
+        the task from the manifest if ``fingerprint`` is ``None``
+
+        Parameters
+        ----------
+        analysisTask : ``AnalysisTask``
+            The task
+
+        fingerprint : str or None
+            The fingerprint of the task
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if fingerprint is None:
+            self.fingerprints.pop(analysisTask.fullTaskName, None)
+        else:
+            self.fingerprints[analysisTask.fullTaskName] = fingerprint
+        # }}}
+
+    def write(self):  # {{{
+        '''
+        Write the manifest to its JSON file
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # write to a temporary file first so an interrupted write doesn't
+        # damage the existing manifest
+        tempFileName = '{}.tmp'.format(self.fileName)
+        with open(tempFileName, 'w') as manifestFile:
+            json.dump({'tasks': self.fingerprints}, manifestFile, indent=2,
+                      sort_keys=True)
+        os.rename(tempFileName, self.fileName)  # }}}
+
+    # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,319 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+Measuring the resources (CPU time, memory, I/O and child processes) used by
+analysis tasks and reporting the tasks that use the most
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import csv
+import json
+import threading
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# the fields of a resource report, in the order they appear in the CSV file
+reportFields = ['task', 'status', 'wallTime', 'userTime', 'systemTime',
+                'maxRss', 'readBytes', 'writeBytes', 'childProcesses']
+
+
+class ResourceUsage(object):  # {{{
+    '''
+    Measures the resources used by the current process, including any child
+    processes it has waited for (e.g. ``ncclimo``), from the time the object
+    is created until ``stop()`` is called.
+
+    Peak memory is the high-water mark of the process (or of its largest
+    child), so it is only reported for a task that runs in its own process.
+    A task run in serial or by a long-lived worker would otherwise report the
+    peak of any task that ran earlier in the same process.
+
+    Child processes are counted by polling ``/proc`` (on Linux) for the
+    children of the process every ``pollInterval`` seconds, so children
+    that exit sooner than that may be missed.
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    pollInterval = 0.1
+
+    def __init__(self, ownProcess=False):  # {{{
+        '''
+        Start measuring resource usage
+
+        Parameters
+        ----------
+        ownProcess : bool, optional
+            Whether the measured task runs in its own process, so that the
+            peak memory of the process can be attributed to it
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.ownProcess = ownProcess
+        self._children = set()
+        self._stopEvent = threading.Event()
+        self._monitor = None
+        initialChildren = _get_child_pids()
+        if initialChildren is not None:
+            self._monitor = threading.Thread(target=self._poll_children,
+                                             args=(initialChildren,))
+            self._monitor.daemon = True
+            self._monitor.start()
+
+        self._start = _get_snapshot()  # }}}
+
+    def stop(self):  # {{{
+        '''
+        Stop measuring resource usage
+
+        Returns
+        -------
+        usage : dict
+            The ``userTime`` and ``systemTime`` (in seconds), ``maxRss`` (the
+            peak resident memory in bytes), ``readBytes`` and ``writeBytes``
+            (the bytes passed to read and write system calls, including reads
+            from the file cache) and the number of ``childProcesses``
+            launched.  Values that can't be measured on this platform (or,
+            for ``maxRss``, outside of the task's own process) are ``None``.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        end = _get_snapshot()
+        usage = {}
+        for key in ['userTime', 'systemTime', 'readBytes', 'writeBytes']:
+            if self._start[key] is None or end[key] is None:
+                usage[key] = None
+            else:
+                usage[key] = end[key] - self._start[key]
+
+        if self.ownProcess:
+            usage['maxRss'] = end['maxRss']
+        else:
+            usage['maxRss'] = None
+
+        if self._monitor is None:
+            usage['childProcesses'] = None
+        else:
+            self._stopEvent.set()
+            self._monitor.join()
+            usage['childProcesses'] = len(self._children)
+        return usage  # }}}
+
+    def _poll_children(self, initialChildren):  # {{{
+        '''
+        Record the child processes of this process until ``stop()`` is
+        called, ignoring those that were already running at the start
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        while True:
+            childPids = _get_child_pids()
+            if childPids is not None:
+                self._children.update(childPids - initialChildren)
+            if self._stopEvent.wait(self.pollInterval):
+                break
+        # }}}
+
+    # }}}
+
+
+def write_resource_report(analyses, logsDirectory):  # {{{
+    '''
+    Write the resources used by each task that ran to ``taskResources.json``
+    and ``taskResources.csv`` in the logs directory
+
+    Parameters
+    ----------
+    analyses : ``OrderedDict`` of ``AnalysisTask`` objects
+        The analysis tasks that were run
+
+    logsDirectory : str
+        The directory to write the reports to
+
+    Returns
+    -------
+    report : list of dict
+        The entry for each task that ran, with the fields in ``reportFields``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    report = get_resource_report(analyses)
+
+    with open('{}/taskResources.json'.format(logsDirectory), 'w') as \
+            reportFile:
+        json.dump({'tasks': report}, reportFile, indent=2, sort_keys=True)
+
+    if sys.version_info[0] < 3:
+        csvFile = open('{}/taskResources.csv'.format(logsDirectory), 'wb')
+    else:
+        csvFile = open('{}/taskResources.csv'.format(logsDirectory), 'w',
+                       newline='')
+    with csvFile:
+        writer = csv.DictWriter(csvFile, fieldnames=reportFields)
+        writer.writeheader()
+        for entry in report:
+            writer.writerow(entry)
+
+    return report  # }}}
+
+
+def get_resource_report(analyses):  # {{{
+    '''
+    Get the resources used by each task that ran
+
+    Parameters
+    ----------
+    analyses : ``OrderedDict`` of ``AnalysisTask`` objects
+        The analysis tasks that were run
+
+    Returns
+    -------
+    report : list of dict
+        The entry for each task that ran, with the fields in ``reportFields``
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    report = []
+    for analysisTask in analyses.values():
+        usage = analysisTask._resourceUsage
+        if usage is None:
+            # the task didn't run (e.g. it was skipped)
+            continue
+        if analysisTask._runStatus.value == analysisTask.SUCCESS:
+            status = 'success'
+        else:
+            status = 'fail'
+        entry = {'task': analysisTask.fullTaskName,
+                 'status': status,
+                 'wallTime': analysisTask._runDuration}
+        for field in reportFields[3:]:
+            entry[field] = usage.get(field)
+        report.append(entry)
+    return report  # }}}
+
+
+def get_top_consumers(report, count=10):  # {{{
+    '''
+    Get the tasks that used the most CPU time, memory or I/O
+
+    Parameters
+    ----------
+    report : list of dict
+        The entry for each task, as returned by ``get_resource_report()``
+
+    count : int, optional
+        The number of tasks to take from the top of each ranking
+
+    Returns
+    -------
+    topConsumers : list of dict
+        The entries of the top ``count`` tasks by CPU time, by peak memory
+        and by bytes read and written, sorted by CPU time
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def cpu_time(entry):
+        return (entry['userTime'] or 0.) + (entry['systemTime'] or 0.)
+
+    def memory(entry):
+        return entry['maxRss'] or 0
+
+    def io_bytes(entry):
+        return (entry['readBytes'] or 0) + (entry['writeBytes'] or 0)
+
+    taskNames = set()
+    for key in [cpu_time, memory, io_bytes]:
+        for entry in sorted(report, key=key, reverse=True)[0:count]:
+            taskNames.add(entry['task'])
+
+    topConsumers = [entry for entry in report if entry['task'] in taskNames]
+    return sorted(topConsumers, key=cpu_time, reverse=True)  # }}}
+
+
+def _get_snapshot():  # {{{
+    '''
+    The resources used by this process and its children so far
+    '''
+    snapshot = {'userTime': None, 'systemTime': None, 'maxRss': None,
+                'readBytes': None, 'writeBytes': None}
+
+    if resource is not None:
+        selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+        childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        snapshot['userTime'] = selfUsage.ru_utime + childUsage.ru_utime
+        snapshot['systemTime'] = selfUsage.ru_stime + childUsage.ru_stime
+        maxRss = max(selfUsage.ru_maxrss, childUsage.ru_maxrss)
+        if sys.platform != 'darwin':
+            # Linux reports kilobytes, macOS bytes
+            maxRss *= 1024
+        snapshot['maxRss'] = maxRss
+
+    try:
+        # on Linux, these include I/O of child processes that have exited
+        with open('/proc/self/io') as ioFile:
+            for line in ioFile:
+                name, value = line.split(':')
+                if name == 'rchar':
+                    snapshot['readBytes'] = int(value)
+                elif name == 'wchar':
+                    snapshot['writeBytes'] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+
+    return snapshot  # }}}
+
+
+def _get_child_pids():  # {{{
+    '''
+    The IDs of the child processes of all threads of this process, or
+    ``None`` if they can't be determined on this platform
+    '''
+    taskDirectory = '/proc/{}/task'.format(os.getpid())
+    if not os.path.exists('{}/{}/children'.format(taskDirectory,
+                                                   os.getpid())):
+        return None
+
+    childPids = set()
+    for threadId in os.listdir(taskDirectory):
+        try:
+            with open('{}/{}/children'.format(taskDirectory,
+                                              threadId)) as childFile:
+                childPids.update(childFile.read().split())
+        except (IOError, OSError):
+            # the thread exited in the meantime
+            pass
+    return childPids  # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,1346 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+'''
+An event-driven scheduler for running analysis tasks, either in serial or as
+parallel processes
+'''
+# Authors
+# -------
+# Xylar Asay-Davis
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import heapq
+import logging
+import sys
+import os
+import json
+import time
+import signal
+import multiprocessing
+from multiprocessing import Pipe
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    # python 2 can't wait on several connections and sentinels at once, so
+    # we fall back on polling
+    wait = None
+
+try:
+    # workers inherit the analysis tasks from the parent process rather than
+    # having them pickled, so they need to be forked
+    _workerContext = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _workerContext = multiprocessing
+
+from mpas_analysis.shared.analysis_task import AnalysisTask
+
+
+class TaskScheduler(object):  # {{{
+    '''
+    A scheduler that launches each analysis task as soon as all of its
+    prerequisites and subtasks have finished.
+
+    Rather than repeatedly checking the status of every task, the scheduler
+    keeps a count of unfinished prerequisites for each task and a queue of
+    tasks that are ready to run.  In parallel mode, it blocks until a
+    running task reports its result through a completion pipe or its
+    process exits, whichever comes first.
+
+    Each task declares an estimate of the cores and memory it uses.  If a
+    core or memory budget is supplied, ready tasks are only launched while
+    the tasks already running leave enough room.  A ready task that doesn't
+    fit is skipped (but stays at the front of the queue) so that smaller
+    tasks behind it can still run.  A task that exceeds a budget on its own
+    is launched once nothing else is running.
+
+    A task with a ``minCores`` can make use of anywhere between ``minCores``
+    and ``cores`` cores (e.g. by running ``ncclimo`` with several parallel
+    jobs).  Such a task is launched as long as ``minCores`` are free and is
+    allotted as many cores as are available, up to ``cores``.  The allotment
+    is stored in the task's ``allottedCores`` before it runs, and counts
+    against the core budget until the task finishes.
+
+    In parallel mode, ready tasks are launched in order of the longest
+    remaining critical path: the expected duration of the task plus that of
+    the longest chain of tasks that depend on it.  Expected durations come
+    from a ``TaskDurations`` database of previous runs if one is supplied.
+
+    By default, each task runs in its own process.  In the ``pool``
+    execution mode, tasks are instead sent by name to a fixed pool of
+    long-lived worker processes that run them one after another, so that
+    anything a worker caches (e.g. mapping matrices) can be reused by later
+    tasks.  A worker that dies is replaced and its task is marked as failed.
+
+    If a ``TaskManifest`` is supplied, a task is marked as successful without
+    being run if it ran successfully before with the same fingerprint (see
+    ``TaskManifest``) and all of its prerequisites and subtasks were also
+    skipped.
+
+    In parallel mode, a task (or the worker running it) that runs longer
+    than its timeout is killed along with any processes it launched (e.g.
+    ``ncclimo`` or ``ESMF_RegridWeightGen``), since each task process or
+    worker runs in its own process group.  A task that fails or times out
+    is retried up to ``retryCount`` times, waiting ``retryDelay`` seconds
+    before the first retry and twice as long before each retry after that.
+    Tasks that depend on it are only failed once it has run out of retries.
+
+    Attributes
+    ----------
+    analyses : ``OrderedDict`` of ``AnalysisTask`` objects
+        The analysis tasks to run with (task, subtask) names as keys
+
+    parallelTaskCount : int
+        The maximum number of tasks that run at the same time
+
+    isParallel : bool
+        Whether tasks are run as separate processes.  If not, tasks are run
+        one at a time in the current process.
+
+    logger : ``logging.Logger``
+        A logger for the progress of tasks (typically writing to
+        ``taskProgress.log``)
+
+    progress : ``progressbar.ProgressBar``
+        A progress bar that is updated each time a task finishes
+
+    coreBudget : int or None
+        The total number of cores available to running tasks, or ``None``
+        for no limit
+
+    memoryBudget : float or None
+        The total memory (in GB) available to running tasks, or ``None``
+        for no limit
+
+    durations : ``TaskDurations`` or None
+        A database of task durations from previous runs, which is updated
+        as tasks finish
+
+    executionMode : {'process', 'pool'}
+        Whether each task runs in its own process or in a pool of worker
+        processes
+
+    manifest : ``TaskManifest`` or None
+        The fingerprints of tasks that ran successfully in previous runs,
+        which is updated as tasks finish
+
+    forceTasks : list of str
+        The names of tasks (or full names of subtasks) that are run even if
+        they are unchanged
+
+    timeout : float or None
+        The number of seconds a task may run before it is killed, or ``None``
+        for no limit
+
+    timeouts : dict
+        Timeouts (in seconds or ``None``) for specific tasks that take
+        precedence over ``timeout``, with the full task name, task name or
+        task class name as the key
+
+    retryCount : int
+        The number of times a task that failed or timed out is retried
+
+    retryDelay : float
+        The number of seconds to wait before retrying a task the first time
+
+    tasksWithErrors : list of str
+        The names of tasks that failed while running
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, analyses, parallelTaskCount, logger, progress=None,
+                 coreBudget=None, memoryBudget=None, durations=None,
+                 executionMode='process', manifest=None, forceTasks=None,
+                 timeout=None, timeouts=None, retryCount=0, retryDelay=0.):
+        # {{{
+        '''
+        Construct the scheduler and determine which tasks are ready to run
+
+        Parameters
+        ----------
+        analyses : ``OrderedDict`` of ``AnalysisTask`` objects
+            The analysis tasks to run with (task, subtask) names as keys
+
+        parallelTaskCount : int
+            The maximum number of tasks that run at the same time (1 means
+            tasks are run in serial)
+
+        logger : ``logging.Logger``
+            A logger for the progress of tasks
+
+        progress : ``progressbar.ProgressBar``, optional
+            A progress bar that is updated each time a task finishes
+
+        coreBudget : int, optional
+            The total number of cores available to running tasks (no limit
+            by default)
+
+        memoryBudget : float, optional
+            The total memory (in GB) available to running tasks (no limit by
+            default)
+
+        durations : ``TaskDurations``, optional
+            A database of task durations from previous runs used to
+            prioritize tasks on the critical path.  If not supplied, the
+            ``expectedDuration`` of each task is used.
+
+        executionMode : {'process', 'pool'}, optional
+            Whether each task runs in its own process or in a pool of
+            ``parallelTaskCount`` long-lived worker processes (only used in
+            parallel mode)
+
+        manifest : ``TaskManifest``, optional
+            The fingerprints of tasks from previous runs.  If supplied, tasks
+            that are unchanged are skipped.
+
+        forceTasks : list of str, optional
+            The names of tasks (or full names of subtasks) that are run even
+            if they are unchanged.  Tasks that depend on them are also run.
+
+        timeout : float, optional
+            The number of seconds a task may run before it is killed (no
+            limit by default).  Timeouts only apply in parallel mode.
+
+        timeouts : dict, optional
+            Timeouts (in seconds or ``None``) for specific tasks that take
+            precedence over ``timeout``, with the full task name, task name
+            or task class name as the key
+
+        retryCount : int, optional
+            The number of times a task that failed or timed out is retried
+
+        retryDelay : float, optional
+            The number of seconds to wait before retrying a task the first
+            time, doubling for each subsequent retry
+
+        Raises
+        ------
+        ValueError
+            If ``executionMode`` is not one of the supported modes
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.analyses = analyses
+        self.parallelTaskCount = parallelTaskCount
+        self.isParallel = parallelTaskCount > 1 and len(analyses) > 1
+        self.logger = logger
+        self.progress = progress
+        self.coreBudget = coreBudget
+        self.memoryBudget = memoryBudget
+        self.durations = durations
+        if executionMode not in ['process', 'pool']:
+            raise ValueError('Unexpected executionMode {}'.format(
+                executionMode))
+        self.executionMode = executionMode
+        self.manifest = manifest
+        if forceTasks is None:
+            forceTasks = []
+        self.forceTasks = forceTasks
+        self.timeout = timeout
+        if timeouts is None:
+            timeouts = {}
+        self.timeouts = timeouts
+        self.retryCount = retryCount
+        self.retryDelay = retryDelay
+        self.tasksWithErrors = []
+
+        # the workers in pool mode, either idle or running a task
+        self._idleWorkers = []
+        self._busyWorkers = {}
+        # the process running each task in process mode
+        self._processes = {}
+
+        # the number of times each task has been launched, the time by which
+        # each running task must finish, the tasks that were killed because
+        # they ran out of time and a queue of failed tasks waiting to be
+        # retried, with the time they can be retried first
+        self._attempts = {}
+        self._deadlines = {}
+        self._timedOutKeys = set()
+        self._retryQueue = []
+
+        # the cores and memory estimated to be in use by running tasks
+        self._coresInUse = 0
+        self._memoryInUse = 0.
+        self._allottedCores = {}
+
+        self._finishedCount = 0
+        # the reading end of the completion pipe for each running task
+        self._runningTasks = {}
+        self._readyQueue = []
+        # the order in which tasks were added, used to break ties between
+        # ready tasks
+        self._order = {}
+        for index, key in enumerate(analyses.keys()):
+            self._order[key] = index
+
+        self._dependents = {}
+        self._prereqKeys = {}
+        self._prereqCounts = {}
+        self._criticalPaths = {}
+        self._fingerprints = {}
+        # tasks that were skipped because they are unchanged
+        self._skippedKeys = set()
+        self._build_dependencies()
+        if self.manifest is not None:
+            self._compute_fingerprints()
+        # }}}
+
+    def run(self):  # {{{
+        '''
+        Run all tasks, returning once every task has either finished or
+        failed (possibly because a prerequisite failed)
+
+        Returns
+        -------
+        tasksWithErrors : list of str
+            The names of tasks that failed while running
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        try:
+            while True:
+                self._release_retries()
+                self._launch_ready_tasks()
+
+                if len(self._runningTasks) == 0:
+                    if len(self._retryQueue) == 0:
+                        # nothing is running and nothing more can be
+                        # launched, so we're done
+                        break
+                    # wait until the next failed task can be retried
+                    time.sleep(max(0., self._retryQueue[0][0] - time.time()))
+                    continue
+
+                self._wait_for_tasks()
+        finally:
+            # make sure no tasks outlive the scheduler (e.g. after a keyboard
+            # interrupt)
+            for key in list(self._runningTasks.keys()):
+                self._kill_task(key)
+
+            for worker in self._idleWorkers:
+                worker.stop()
+            self._idleWorkers = []
+
+        return self.tasksWithErrors  # }}}
+
+    def plan(self):  # {{{
+        '''
+        Determine which tasks would run or be skipped, and how long they are
+        expected to take, without running anything
+
+        Returns
+        -------
+        plan : list of dict
+            An entry for each task, with prerequisites before the tasks that
+            depend on them, containing the (task, subtask) ``key``, the
+            ``taskName`` and ``subtaskName``, the ``status`` (``'run'`` or
+            ``'skip'``), the keys of its ``prerequisites``, its
+            ``expectedDuration`` and its ``criticalPath`` (the expected
+            duration of the longest chain of tasks starting with this one)
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if len(self._criticalPaths) == 0:
+            self._compute_critical_paths()
+
+        plan = []
+        skippedKeys = set()
+        for key in self._get_topological_order():
+            analysisTask = self.analyses[key]
+            if self._is_unchanged(key, skippedKeys):
+                skippedKeys.add(key)
+                status = 'skip'
+            else:
+                status = 'run'
+            plan.append({'key': key,
+                         'taskName': analysisTask.taskName,
+                         'subtaskName': analysisTask.subtaskName,
+                         'status': status,
+                         'prerequisites': sorted(self._prereqKeys[key],
+                                                 key=str),
+                         'expectedDuration':
+                             self._expected_duration(analysisTask),
+                         'criticalPath': self._criticalPaths[key]})
+
+        return plan  # }}}
+
+    def _get_topological_order(self):  # {{{
+        '''
+        The keys of all tasks, with prerequisites and subtasks before the
+        tasks that depend on them but otherwise in the order they were added
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        order = []
+        visited = set()
+        for key in self.analyses:
+            stack = [(key, False)]
+            while len(stack) > 0:
+                currentKey, prereqsDone = stack.pop()
+                if currentKey in visited:
+                    continue
+                if prereqsDone:
+                    visited.add(currentKey)
+                    order.append(currentKey)
+                else:
+                    stack.append((currentKey, True))
+                    # reversed so prerequisites are visited in order
+                    for prereqKey in sorted(self._prereqKeys[currentKey],
+                                            key=self._order.get,
+                                            reverse=True):
+                        if prereqKey in self.analyses and \
+                                prereqKey not in visited:
+                            stack.append((prereqKey, False))
+        return order  # }}}
+
+    def _build_dependencies(self):  # {{{
+        '''
+        Count the prerequisites of each task, find the dependents of each
+        task and queue the tasks with no prerequisites
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        for key in self.analyses:
+            self._dependents[key] = []
+
+        missingPrereqs = []
+        for key, analysisTask in self.analyses.items():
+            # a task may list the same prerequisite more than once
+            prereqKeys = set()
+            for prereq in analysisTask.runAfterTasks + analysisTask.subtasks:
+                prereqKeys.add(_get_key(prereq))
+
+            for prereqKey in prereqKeys:
+                if prereqKey in self.analyses:
+                    self._dependents[prereqKey].append(key)
+                else:
+                    missingPrereqs.append(key)
+
+            self._prereqKeys[key] = prereqKeys
+            self._prereqCounts[key] = len(prereqKeys)
+
+        if self.isParallel:
+            self._compute_critical_paths()
+
+        for key, analysisTask in self.analyses.items():
+            if self._prereqCounts[key] == 0:
+                analysisTask._runStatus.value = AnalysisTask.READY
+                self._push_ready(key)
+            else:
+                analysisTask._runStatus.value = AnalysisTask.BLOCKED
+
+        for key in missingPrereqs:
+            # a prerequisite will never run, so this task can't either
+            if self.analyses[key]._runStatus.value != AnalysisTask.FAIL:
+                self._fail_dependents(key, includeSelf=True)
+
+        # }}}
+
+    def _compute_critical_paths(self):  # {{{
+        '''
+        Find the expected duration of the longest chain of tasks starting
+        with each task
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        for key in self.analyses:
+            if key in self._criticalPaths:
+                continue
+            # visit dependents before the tasks they depend on
+            stack = [(key, False)]
+            while len(stack) > 0:
+                currentKey, dependentsDone = stack.pop()
+                if currentKey in self._criticalPaths:
+                    continue
+                if dependentsDone:
+                    longest = 0.
+                    for dependentKey in self._dependents[currentKey]:
+                        longest = max(longest,
+                                      self._criticalPaths[dependentKey])
+                    self._criticalPaths[currentKey] = longest + \
+                        self._expected_duration(self.analyses[currentKey])
+                else:
+                    stack.append((currentKey, True))
+                    for dependentKey in self._dependents[currentKey]:
+                        if dependentKey not in self._criticalPaths:
+                            stack.append((dependentKey, False))
+        # }}}
+
+    def _compute_fingerprints(self):  # {{{
+        '''
+        Compute the fingerprint of each task, which depends on the
+        fingerprints of its prerequisites and subtasks
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        for key in self.analyses:
+            # visit prerequisites before the tasks that depend on them
+            stack = [(key, False)]
+            while len(stack) > 0:
+                currentKey, prereqsDone = stack.pop()
+                if currentKey in self._fingerprints:
+                    continue
+                prereqKeys = [prereqKey for prereqKey in
+                              self._prereqKeys[currentKey]
+                              if prereqKey in self.analyses]
+                if prereqsDone:
+                    prereqFingerprints = [self._fingerprints[prereqKey]
+                                          for prereqKey in prereqKeys]
+                    self._fingerprints[currentKey] = \
+                        self.manifest.compute_fingerprint(
+                            self.analyses[currentKey], prereqFingerprints)
+                else:
+                    stack.append((currentKey, True))
+                    for prereqKey in prereqKeys:
+                        if prereqKey not in self._fingerprints:
+                            stack.append((prereqKey, False))
+        # }}}
+
+    def _is_unchanged(self, key, skippedKeys):  # {{{
+        '''
+        Whether a task is unchanged since it last ran successfully, is not
+        forced to run and all its prerequisites were skipped
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.manifest is None:
+            return False
+
+        analysisTask = self.analyses[key]
+        if analysisTask.taskName in self.forceTasks or \
+                analysisTask.fullTaskName in self.forceTasks:
+            return False
+
+        for prereqKey in self._prereqKeys[key]:
+            if prereqKey not in skippedKeys:
+                # a prerequisite ran, so its output may have changed
+                return False
+
+        return self.manifest.is_unchanged(analysisTask,
+                                          self._fingerprints[key])  # }}}
+
+    def _skip_if_unchanged(self, key):  # {{{
+        '''
+        Mark a task as successful without running it if it is unchanged since
+        it last ran successfully and all its prerequisites were skipped
+
+        Returns
+        -------
+        skipped : bool
+            Whether the task was skipped
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if not self._is_unchanged(key, self._skippedKeys):
+            return False
+
+        analysisTask = self.analyses[key]
+        self.logger.info('Skipping {} because it is unchanged'.format(
+            analysisTask.printTaskName))
+        analysisTask._runStatus.value = AnalysisTask.SUCCESS
+        self._skippedKeys.add(key)
+        self._task_finished(key)
+        return True  # }}}
+
+    def _expected_duration(self, analysisTask):  # {{{
+        '''
+        The expected duration of a task from previous runs or its default
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.durations is None:
+            return analysisTask.expectedDuration
+        else:
+            return self.durations.expected_duration(analysisTask)  # }}}
+
+    def _push_ready(self, key):  # {{{
+        '''
+        Add a task to the queue of tasks that are ready to run, with tasks
+        on the longest critical path first (in parallel mode) and then in the
+        order they were added
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.isParallel:
+            priority = -self._criticalPaths[key]
+        else:
+            priority = 0.
+        heapq.heappush(self._readyQueue, (priority, self._order[key], key))
+        # }}}
+
+    def _launch_ready_tasks(self):  # {{{
+        '''
+        Launch as many ready tasks as allowed.  In serial mode, each task is
+        run to completion in this process.  In parallel mode, tasks are
+        launched in queue order as long as they fit within the core and
+        memory budgets.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if not self.isParallel:
+            while len(self._readyQueue) > 0:
+                key = heapq.heappop(self._readyQueue)[-1]
+                if self._skip_if_unchanged(key):
+                    continue
+                analysisTask = self.analyses[key]
+                analysisTask.allottedCores = self._allot_cores(analysisTask)
+                while True:
+                    self._attempts[key] = self._attempts.get(key, 0) + 1
+                    analysisTask._runStatus.value = AnalysisTask.RUNNING
+                    analysisTask.run(writeLogFile=False)
+                    if analysisTask._runStatus.value != AnalysisTask.FAIL or \
+                            self._attempts[key] > self.retryCount:
+                        break
+                    time.sleep(self._get_retry_delay(key))
+                if analysisTask._runStatus.value == AnalysisTask.FAIL:
+                    sys.exit(1)
+                self._task_finished(key)
+            return
+
+        # tasks that are ready but don't fit right now
+        deferred = []
+        while len(self._readyQueue) > 0 and \
+                len(self._runningTasks) < self.parallelTaskCount:
+            entry = heapq.heappop(self._readyQueue)
+            key = entry[-1]
+            if self._skip_if_unchanged(key):
+                continue
+            analysisTask = self.analyses[key]
+            allottedCores = self._allot_cores(analysisTask)
+            if allottedCores is None:
+                deferred.append(entry)
+            else:
+                self._start_task(key, analysisTask, allottedCores)
+
+        for entry in deferred:
+            heapq.heappush(self._readyQueue, entry)
+        # }}}
+
+    def _allot_cores(self, analysisTask):  # {{{
+        '''
+        The number of cores to allot to a task, or ``None`` if it can't be
+        launched without exceeding the core or memory budget, given the
+        tasks already running
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        cores = analysisTask.cores
+        if analysisTask.minCores is None:
+            minCores = cores
+        else:
+            minCores = min(analysisTask.minCores, cores)
+
+        if self.coreBudget is None:
+            availableCores = cores
+        else:
+            availableCores = self.coreBudget - self._coresInUse
+
+        if len(self._runningTasks) == 0:
+            # a task that is too big for the budget still has to run at some
+            # point, so we let it run on its own
+            return max(minCores, min(cores, availableCores))
+
+        if availableCores < minCores:
+            return None
+
+        if self.memoryBudget is not None and \
+                self._memoryInUse + analysisTask.memory > self.memoryBudget:
+            return None
+
+        return min(cores, availableCores)  # }}}
+
+    def _start_task(self, key, analysisTask, allottedCores):  # {{{
+        '''
+        Start a task in a new process with a pipe for reporting its result,
+        or send it to a worker in pool mode
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.logger.info('Running {}'.format(analysisTask.printTaskName))
+        analysisTask._runStatus.value = AnalysisTask.RUNNING
+        self._attempts[key] = self._attempts.get(key, 0) + 1
+        timeout = self._get_timeout(analysisTask)
+        if timeout is not None:
+            self._deadlines[key] = time.time() + timeout
+        analysisTask.allottedCores = allottedCores
+        self._allottedCores[key] = allottedCores
+        self._coresInUse += allottedCores
+        self._memoryInUse += analysisTask.memory
+
+        if self.executionMode == 'pool':
+            worker = None
+            while worker is None and len(self._idleWorkers) > 0:
+                worker = self._idleWorkers.pop()
+                if not worker.process.is_alive():
+                    # the worker died after its last task finished
+                    worker.stop()
+                    worker = None
+            if worker is None:
+                worker = _TaskWorker(self.analyses)
+            worker.connection.send((key, allottedCores))
+            self._busyWorkers[key] = worker
+            self._runningTasks[key] = worker.connection
+            return
+
+        reader, writer = Pipe(duplex=False)
+        analysisTask._completionConnection = writer
+        # the task runs in a new process (rather than being started itself)
+        # so that it can be run again if it needs to be retried
+        process = _workerContext.Process(target=_run_task,
+                                         args=(analysisTask,))
+        process.start()
+        self._processes[key] = process
+        # the child process has its own copy of the writing end, so we close
+        # ours so that we see the end of file if the child dies
+        writer.close()
+        analysisTask._completionConnection = None
+
+        self._runningTasks[key] = reader  # }}}
+
+    def _wait_for_tasks(self):  # {{{
+        '''
+        Block until at least one running task has finished, then handle all
+        tasks that have finished
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if wait is None:
+            finishedKeys = self._poll_for_tasks()
+        else:
+            waitObjects = {}
+            for key, reader in self._runningTasks.items():
+                waitObjects[reader] = key
+                waitObjects[self._get_process(key).sentinel] = key
+
+            finishedKeys = []
+            readyObjects = wait(list(waitObjects.keys()),
+                                timeout=self._get_wait_timeout())
+            for readyObject in readyObjects:
+                key = waitObjects[readyObject]
+                if key not in finishedKeys:
+                    finishedKeys.append(key)
+
+        now = time.time()
+        for key in list(self._runningTasks.keys()):
+            if key not in finishedKeys and key in self._deadlines and \
+                    self._deadlines[key] <= now:
+                self._time_out_task(key)
+                finishedKeys.append(key)
+
+        for key in finishedKeys:
+            self._collect_task(key)
+        # }}}
+
+    def _get_wait_timeout(self):  # {{{
+        '''
+        The number of seconds until the next running task times out or the
+        next failed task can be retried, or ``None`` if there are neither
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        times = [self._deadlines[key] for key in self._runningTasks
+                 if key in self._deadlines]
+        if len(self._retryQueue) > 0:
+            times.append(self._retryQueue[0][0])
+        if len(times) == 0:
+            return None
+        return max(0., min(times) - time.time())  # }}}
+
+    def _poll_for_tasks(self, timeout=0.1):  # {{{
+        '''
+        Poll running tasks until at least one has finished (used only if
+        ``multiprocessing.connection.wait`` is not available)
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # necessary to have a timeout so we can kill the whole thing
+        # with a keyboard interrupt
+        while True:
+            for key, reader in self._runningTasks.items():
+                process = self._get_process(key)
+                process.join(timeout=timeout)
+                if reader.poll() or not process.is_alive():
+                    return [key]
+                if key in self._deadlines and \
+                        self._deadlines[key] <= time.time():
+                    # the caller will time out the task
+                    return []
+            if len(self._retryQueue) > 0 and \
+                    self._retryQueue[0][0] <= time.time():
+                return []  # }}}
+
+    def _get_process(self, key):  # {{{
+        '''
+        The process that is running the given task
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if key in self._busyWorkers:
+            return self._busyWorkers[key].process
+        else:
+            return self._processes[key]  # }}}
+
+    def _get_timeout(self, analysisTask):  # {{{
+        '''
+        The timeout of a task, looked up by full task name, task name and
+        class name before falling back on the default timeout
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        for name in [analysisTask.fullTaskName, analysisTask.taskName,
+                     type(analysisTask).__name__]:
+            if name in self.timeouts:
+                return self.timeouts[name]
+        return self.timeout  # }}}
+
+    def _get_retry_delay(self, key):  # {{{
+        '''
+        The number of seconds to wait before retrying a task that failed,
+        doubling with each retry
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        retryIndex = self._attempts[key]
+        analysisTask = self.analyses[key]
+        delay = self.retryDelay * 2**(retryIndex - 1)
+        self._log_task_message(
+            analysisTask, logging.INFO,
+            'Retrying task {} in {} s (retry {} of {})'.format(
+                analysisTask.printTaskName, delay, retryIndex,
+                self.retryCount))
+        return delay  # }}}
+
+    def _release_retries(self):  # {{{
+        '''
+        Queue failed tasks that have waited long enough to be retried
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        now = time.time()
+        while len(self._retryQueue) > 0 and self._retryQueue[0][0] <= now:
+            key = heapq.heappop(self._retryQueue)[-1]
+            self.analyses[key]._runStatus.value = AnalysisTask.READY
+            self._push_ready(key)
+        # }}}
+
+    def _time_out_task(self, key):  # {{{
+        '''
+        Kill a task that has run past its deadline
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        analysisTask = self.analyses[key]
+        message = 'Task {} exceeded its timeout of {} s and was ' \
+                  'killed'.format(analysisTask.printTaskName,
+                                  self._get_timeout(analysisTask))
+        self._log_task_message(analysisTask, logging.ERROR, message)
+        self._timedOutKeys.add(key)
+        self._kill_task(key)
+        analysisTask._runStatus.value = AnalysisTask.FAIL  # }}}
+
+    def _kill_task(self, key, gracePeriod=5.):  # {{{
+        '''
+        Kill the process running a task, along with any processes it
+        launched, first asking politely and then forcefully after
+        ``gracePeriod`` seconds
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        process = self._get_process(key)
+        for signalNumber in [signal.SIGTERM, getattr(signal, 'SIGKILL',
+                                                     signal.SIGTERM)]:
+            try:
+                # the task process is the leader of its own process group
+                os.killpg(process.pid, signalNumber)
+            except (AttributeError, OSError):
+                # the group doesn't exist (yet), so just kill the process
+                if process.is_alive():
+                    process.terminate()
+            process.join(timeout=gracePeriod)
+        # }}}
+
+    def _collect_task(self, key):  # {{{
+        '''
+        Read the result of a task that has finished, report it and release
+        or fail the tasks that depend on it
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        reader = self._runningTasks.pop(key)
+        analysisTask = self.analyses[key]
+
+        message = None
+        try:
+            if reader.poll():
+                message = reader.recv()
+                analysisTask._runDuration = message['duration']
+                analysisTask._resourceUsage = message['usage']
+        except EOFError:
+            # the task died without reporting back
+            pass
+
+        if key in self._busyWorkers:
+            worker = self._busyWorkers.pop(key)
+            if message is None:
+                # the worker died (or was killed) while running the task, so
+                # it will be replaced by a new one when needed
+                if key not in self._timedOutKeys:
+                    self._log_task_message(
+                        analysisTask, logging.ERROR,
+                        'The worker running task {} died '
+                        'unexpectedly'.format(analysisTask.printTaskName))
+                worker.stop()
+                if analysisTask._runStatus.value == AnalysisTask.RUNNING:
+                    analysisTask._runStatus.value = AnalysisTask.FAIL
+            else:
+                self._idleWorkers.append(worker)
+        else:
+            reader.close()
+            self._processes.pop(key).join()
+
+        self._coresInUse -= self._allottedCores.pop(key)
+        self._memoryInUse -= analysisTask.memory
+        self._deadlines.pop(key, None)
+        self._timedOutKeys.discard(key)
+
+        taskTitle = analysisTask.printTaskName
+
+        if analysisTask._runStatus.value != AnalysisTask.SUCCESS and \
+                self._attempts[key] <= self.retryCount:
+            self._log_task_message(
+                analysisTask, logging.ERROR,
+                'Task {} failed.  See log file {} for details'.format(
+                    taskTitle, analysisTask._logFileName))
+            retryTime = time.time() + self._get_retry_delay(key)
+            analysisTask._runStatus.value = AnalysisTask.BLOCKED
+            heapq.heappush(self._retryQueue,
+                           (retryTime, self._order[key], key))
+            return
+
+        if analysisTask._runStatus.value == AnalysisTask.SUCCESS:
+            self.logger.info("   Task {} has finished successfully.".format(
+                taskTitle))
+        elif analysisTask._runStatus.value == AnalysisTask.FAIL:
+            message = "ERROR in task {}.  See log file {} for " \
+                      "details".format(taskTitle,
+                                       analysisTask._logFileName)
+            self._log_task_message(analysisTask, logging.ERROR, message)
+            self.tasksWithErrors.append(taskTitle)
+        else:
+            message = "Unexpected status from in task {}.  This may be " \
+                      "a bug.".format(taskTitle)
+            self._log_task_message(analysisTask, logging.ERROR, message)
+            analysisTask._runStatus.value = AnalysisTask.FAIL
+            self.tasksWithErrors.append(taskTitle)
+
+        self._task_finished(key)  # }}}
+
+    def _log_task_message(self, analysisTask, level, message):  # {{{
+        '''
+        Log a message about a task to the progress log and append it to the
+        task's own log file.  The task can't report being killed, timing out
+        or being retried itself, so this keeps the whole story of each
+        attempt in its log file.
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.logger.log(level, message)
+        if analysisTask._logFileName is None:
+            return
+        try:
+            with open(analysisTask._logFileName, 'a') as logFile:
+                logFile.write('{}\n'.format(message))
+        except (IOError, OSError):
+            # the log directory isn't available (e.g. in tests)
+            pass
+        # }}}
+
+    def _task_finished(self, key):  # {{{
+        '''
+        Update dependency counts once a task has finished, queuing any
+        dependent tasks that are now ready or failing them if this task failed
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        analysisTask = self.analyses[key]
+        self._finishedCount += 1
+
+        if self.manifest is not None and key not in self._skippedKeys:
+            if analysisTask._runStatus.value == AnalysisTask.SUCCESS:
+                self.manifest.record(analysisTask, self._fingerprints[key])
+            else:
+                self.manifest.record(analysisTask, None)
+
+        if analysisTask._runStatus.value == AnalysisTask.SUCCESS:
+            if self.durations is not None and \
+                    analysisTask._runDuration is not None:
+                self.durations.add(analysisTask, analysisTask._runDuration)
+            for dependentKey in self._dependents[key]:
+                self._prereqCounts[dependentKey] -= 1
+                dependent = self.analyses[dependentKey]
+                if self._prereqCounts[dependentKey] == 0 and \
+                        dependent._runStatus.value == AnalysisTask.BLOCKED:
+                    dependent._runStatus.value = AnalysisTask.READY
+                    self._push_ready(dependentKey)
+        else:
+            self._fail_dependents(key)
+
+        self._update_progress()  # }}}
+
+    def _fail_dependents(self, key, includeSelf=False):  # {{{
+        '''
+        Mark all tasks that depend (directly or indirectly) on the given task
+        as failed, since they can't succeed
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if includeSelf:
+            keysToFail = [key]
+        else:
+            keysToFail = list(self._dependents[key])
+
+        while len(keysToFail) > 0:
+            failKey = keysToFail.pop()
+            analysisTask = self.analyses[failKey]
+            if analysisTask._runStatus.value in [AnalysisTask.SUCCESS,
+                                                 AnalysisTask.FAIL,
+                                                 AnalysisTask.RUNNING]:
+                continue
+            analysisTask._runStatus.value = AnalysisTask.FAIL
+            self._finishedCount += 1
+            keysToFail.extend(self._dependents[failKey])
+
+        self._update_progress()  # }}}
+
+    def _update_progress(self):  # {{{
+        if self.progress is not None:
+            self.progress.update(self._finishedCount)  # }}}
+
+    # }}}
+
+
+class _TaskWorker(object):  # {{{
+    '''
+    A long-lived worker process that runs the tasks it receives by name
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, analyses):  # {{{
+        '''
+        Start a worker process
+
+        Parameters
+        ----------
+        analyses : ``OrderedDict`` of ``AnalysisTask`` objects
+            The analysis tasks the worker can run with (task, subtask) names
+            as keys
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.connection, workerConnection = Pipe()
+        self.process = _workerContext.Process(
+            target=_run_worker, args=(analyses, workerConnection))
+        self.process.start()
+        # the worker has its own copy of its end of the pipe
+        workerConnection.close()  # }}}
+
+    def stop(self):  # {{{
+        '''
+        Ask the worker to exit (if it is still alive) and wait until it does
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except (IOError, OSError):
+                # the worker already closed its end of the pipe
+                pass
+        self.process.join()
+        self.connection.close()  # }}}
+
+    # }}}
+
+
+class TaskDurations(object):  # {{{
+    '''
+    A database of how long each task took to run in previous runs, stored
+    in a JSON file.  Durations are stored both for each task and as a mean
+    for each task class, so that tasks that haven't been run before can use
+    the durations of similar tasks.
+
+    Attributes
+    ----------
+    fileName : str
+        The JSON file the database is read from and written to
+
+    taskDurations : dict
+        The most recent duration (in seconds) of each task, with the full
+        task name as the key
+
+    classDurations : dict
+        The number of durations and their mean (in seconds) for each task
+        class, with the module and class name as the key
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    def __init__(self, fileName):  # {{{
+        '''
+        Read the database if it exists
+
+        Parameters
+        ----------
+        fileName : str
+            The JSON file the database is read from and written to
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.fileName = fileName
+        self.taskDurations = {}
+        self.classDurations = {}
+
+        if os.path.exists(fileName):
+            try:
+                with open(fileName) as durationFile:
+                    database = json.load(durationFile)
+                self.taskDurations = database['tasks']
+                self.classDurations = database['classes']
+            except (IOError, ValueError, KeyError):
+                # a damaged database only means we lose the timing
+                # information, so start over
+                self.taskDurations = {}
+                self.classDurations = {}
+        # }}}
+
+    def expected_duration(self, analysisTask):  # {{{
+        '''
+        The expected duration of a task: its duration in the last run if
+        available, otherwise the mean duration of tasks of the same class,
+        otherwise the task's ``expectedDuration``
+
+        Parameters
+        ----------
+        analysisTask : ``AnalysisTask``
+            The task
+
+        Returns
+        -------
+        duration : float
+            The expected duration in seconds
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        if analysisTask.fullTaskName in self.taskDurations:
+            return self.taskDurations[analysisTask.fullTaskName]
+
+        className = _get_class_name(analysisTask)
+        if className in self.classDurations:
+            return self.classDurations[className]['mean']
+
+        return analysisTask.expectedDuration  # }}}
+
+    def add(self, analysisTask, duration):  # {{{
+        '''
+        Add the duration of a task that has just run
+
+        Parameters
+        ----------
+        analysisTask : ``AnalysisTask``
+            The task
+
+        duration : float
+            The duration of the run in seconds
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        self.taskDurations[analysisTask.fullTaskName] = duration
+
+        className = _get_class_name(analysisTask)
+        if className in self.classDurations:
+            classDuration = self.classDurations[className]
+        else:
+            classDuration = {'count': 0, 'mean': 0.}
+            self.classDurations[className] = classDuration
+
+        classDuration['count'] += 1
+        classDuration['mean'] += \
+            (duration - classDuration['mean'])/classDuration['count']
+        # }}}
+
+    def write(self):  # {{{
+        '''
+        Write the database to its JSON file
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        database = {'tasks': self.taskDurations,
+                    'classes': self.classDurations}
+
+        # write to a temporary file first so an interrupted write doesn't
+        # damage the existing database
+        tempFileName = '{}.tmp'.format(self.fileName)
+        with open(tempFileName, 'w') as durationFile:
+            json.dump(database, durationFile, indent=2, sort_keys=True)
+        os.rename(tempFileName, self.fileName)  # }}}
+
+    # }}}
+
+
+def _run_task(analysisTask):  # {{{
+    '''
+    Run a task in a new process, in its own process group so that the task
+    and any processes it launches can be killed together
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    _start_process_group()
+    analysisTask._runInOwnProcess = True
+    analysisTask.run(writeLogFile=True)  # }}}
+
+
+def _start_process_group():  # {{{
+    '''
+    Make the current process the leader of a new process group (if the
+    platform supports it)
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    try:
+        os.setpgrp()
+    except (AttributeError, OSError):
+        pass  # }}}
+
+
+def _run_worker(analyses, connection):  # {{{
+    '''
+    The main loop of a worker process: run each task named in the pipe with
+    the cores allotted to it and report its status until asked to stop
+    '''
+    # Authors
+    # -------
+    # Xylar Asay-Davis
+
+    _start_process_group()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # the scheduler is gone
+            break
+        if message is None:
+            break
+        key, allottedCores = message
+        analysisTask = analyses[key]
+        analysisTask.allottedCores = allottedCores
+        analysisTask.run(writeLogFile=True)
+        connection.send({'status': analysisTask._runStatus.value,
+                         'duration': analysisTask._runDuration,
+                         'usage': analysisTask._resourceUsage})
+
+    connection.close()  # }}}
+
+
+def _get_key(analysisTask):  # {{{
+    '''
+    The key of a task in the dictionary of analyses
+    '''
+    return (analysisTask.taskName, analysisTask.subtaskName)  # }}}
+
+
+def _get_class_name(analysisTask):  # {{{
+    '''
+    The module and class name of a task, used to look up durations of
+    similar tasks
+    '''
+    taskClass = type(analysisTask)
+    return '{}.{}'.format(taskClass.__module__, taskClass.__name__)  # }}}
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -14,6 +14,7 @@ from __future__ import absolute_import, division, print_function, \
 
 import os
 import subprocess
+import threading
 from distutils.spawn import find_executable
 import xarray as xr
 import numpy
@@ -24,6 +25,9 @@ from mpas_analysis.shared.io.utility import build_config_full_path, \
     make_directories, get_files_year_month
 from mpas_analysis.shared.timekeeping.utility import get_simulation_start_time
 
+# tasks may be set up in parallel threads, each adding variables
+_addVariablesLock = threading.Lock()
+
 
 class MpasTimeSeriesTask(AnalysisTask):  # {{{
     '''
@@ -102,6 +106,9 @@ class MpasTimeSeriesTask(AnalysisTask):  # {{{
             componentName=componentName,
             tags=tags)
 
+        # extracting a long time series can take a while
+        self.expectedDuration = 600.
+
         # }}}
 
     def add_variables(self, variableList):  # {{{
@@ -133,14 +140,15 @@ class MpasTimeSeriesTask(AnalysisTask):  # {{{
                              'or add_variables() is being called in the wrong '
                              'place.')
 
-        for variable in variableList:
-            if variable not in self.allVariables:
-                raise ValueError(
-                        '{} is not available in timeSeriesStatsMonthly '
-                        'output:\n{}'.format(variable, self.allVariables))
+        with _addVariablesLock:
+            for variable in variableList:
+                if variable not in self.allVariables:
+                    raise ValueError(
+                            '{} is not available in timeSeriesStatsMonthly '
+                            'output:\n{}'.format(variable, self.allVariables))
 
-            if variable not in self.variableList:
-                self.variableList.append(variable)
+                if variable not in self.variableList:
+                    self.variableList.append(variable)
 
         # }}}
 
@@ -215,6 +223,67 @@ class MpasTimeSeriesTask(AnalysisTask):  # {{{
 
         # }}}
 
+    def get_input_files(self):  # {{{
+        '''
+        Get the history files the time series is extracted from
+
+        Returns
+        -------
+        inputFiles : list of str
+            The input files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.inputFiles)  # }}}
+
+    def get_input_variables(self):  # {{{
+        '''
+        Get the variables read from the history files
+
+        Returns
+        -------
+        variableList : list of str
+            The variables in the time series
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return list(self.variableList)  # }}}
+
+    def get_output_files(self):  # {{{
+        '''
+        Get the time series file
+
+        Returns
+        -------
+        outputFiles : list of str
+            The output files
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        return [self.outputFile]  # }}}
+
+    def get_fingerprint_parameters(self):  # {{{
+        '''
+        Get the variables in the time series
+
+        Returns
+        -------
+        parameters : dict
+            The parameters
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        # the order variables were added doesn't matter
+        return {'variableList': sorted(self.variableList)}  # }}}
+
     def run_task(self):  # {{{
         '''
         Compute the requested time series
@@ -24,6 +24,7 @@ import shutil
 import os
 import numpy
 import xarray
+import six
 
 from mpas_analysis.test import TestCase, loaddatadir
 from mpas_analysis.shared.generalized_reader.generalized_reader \
@@ -32,7 +33,9 @@ from mpas_analysis.configuration import MpasAnalysisConfigParser
 from mpas_analysis.shared.climatology import \
     get_comparison_descriptor, get_remapper, \
     add_years_months_days_in_month, compute_climatology, \
-    compute_monthly_climatology
+    compute_monthly_climatology, compute_seasonal_climatologies, \
+    get_mapping_file_task
+from mpas_analysis.shared import AnalysisTask
 from mpas_analysis.shared.grid import MpasMeshDescriptor, LatLonGridDescriptor
 from mpas_analysis.shared.constants import constants
 
@@ -198,6 +201,57 @@ class TestClimatology(TestCase):
                 shutil.copyfile(defaultMappingFileName,
                                 explicitMappingFileName)
 
+    def test_get_remapper_with_mapping_file_task(self):
+        config = self.setup_config()
+        config.set('climatology', 'useNcremap', 'False')
+        config.set('climatology', 'useNativeMappingWeights', 'True')
+        config.set('diagnostics', 'writeMappingFiles', 'True')
+
+        sharedMappingPath = '{}/maps'.format(self.test_dir)
+        os.makedirs(sharedMappingPath)
+
+        mappingName = 'map_QU240_to_latlon_bilinear'
+        mappingFileTask = get_mapping_file_task(config, 'ocean', mappingName)
+        assert get_mapping_file_task(config, 'ocean', mappingName) is \
+            mappingFileTask
+        assert get_mapping_file_task(self.setup_config(), 'ocean',
+                                     mappingName) is not mappingFileTask
+
+        mpasDescriptor = MpasMeshDescriptor(
+            '{}/mpasMesh.nc'.format(self.datadir), meshName='QU240')
+        comparisonDescriptor = \
+            get_comparison_descriptor(config, comparisonGridName='latlon')
+
+        # two tasks that need the same mapping file
+        remappers = []
+        for index in range(2):
+            remappers.append(get_remapper(
+                config=config, sourceDescriptor=mpasDescriptor,
+                comparisonDescriptor=comparisonDescriptor,
+                mappingFilePrefix='map', method='bilinear',
+                mappingFileTask=mappingFileTask))
+
+        # native mapping files have their own names
+        mappingFileName = \
+            '{}/map_QU240_to_0.5x0.5degree_bilinear_native.nc'.format(
+                sharedMappingPath)
+        self.assertEqual(list(mappingFileTask.remappers.keys()),
+                         [mappingFileName])
+        # the mapping file is built when the task runs, not before
+        assert not os.path.exists(mappingFileName)
+
+        mappingFileTask.run(writeLogFile=False)
+        self.assertEqual(mappingFileTask._runStatus.value,
+                         AnalysisTask.SUCCESS)
+        assert os.path.exists(mappingFileName)
+        assert os.path.exists('{}.lock'.format(mappingFileName))
+
+        ds = xarray.Dataset({'field': ('nCells', numpy.ones(
+            mpasDescriptor.coords['latCell']['data'].shape))})
+        remapped = remappers[1].remap(ds).field.values
+        assert numpy.all(numpy.logical_or(numpy.isnan(remapped),
+                                          numpy.abs(remapped - 1.) < 1e-10))
+
     def test_compute_climatology(self):
         config = self.setup_config()
         calendar = 'gregorian_noleap'
@@ -258,5 +312,111 @@ class TestClimatology(TestCase):
         self.assertArrayApproxEqual(monthlyClimatology.month.values,
                                     refClimatology.month.values)
 
+    def test_compute_climatology_varying_mask(self):
+        months = numpy.array([1, 2, 3, 1, 2, 3])
+        daysInMonth = numpy.array([31., 28., 31., 31., 28., 31.])
+        field = numpy.random.RandomState(0).rand(len(months), 4, 2)
+        field[0, 1, :] = numpy.nan
+        field[:, 2, 0] = numpy.nan
+        ds = xarray.Dataset({'field': (('Time', 'nCells', 'nDepths'), field,
+                                       {'units': 'm'})})
+        ds.coords['month'] = ('Time', months)
+        ds.coords['year'] = ('Time', [1, 1, 1, 2, 2, 2])
+        ds.coords['daysInMonth'] = ('Time', daysInMonth)
+
+        valid = numpy.logical_not(numpy.isnan(field))
+        weights = valid*daysInMonth[:, numpy.newaxis, numpy.newaxis]
+        weightSum = numpy.sum(weights, axis=0)
+        refField = numpy.nansum(field*weights, axis=0)/weightSum
+        refField[weightSum == 0.] = numpy.nan
+
+        for climatology in [compute_climatology(ds, [1, 2, 3]),
+                            compute_climatology(ds.field, [1, 2, 3])]:
+            assert('Time' not in climatology.dims)
+            if isinstance(climatology, xarray.Dataset):
+                climatology = climatology.field
+            self.assertEqual(climatology.dims, ('nCells', 'nDepths'))
+            self.assertEqual(climatology.attrs['units'], 'm')
+            self.assertArrayApproxEqual(climatology.values, refField)
+            assert(numpy.all(numpy.isnan(climatology.values) ==
+                             numpy.isnan(refField)))
+
+    def test_compute_climatology_statistics(self):
+        months = numpy.array([1, 2, 3, 1, 2, 3])
+        daysInMonth = numpy.array([31., 28., 31., 31., 28., 31.])
+        # a large offset tests the numerical stability of the variance
+        field = 1e6 + numpy.random.RandomState(0).rand(len(months), 4)
+        field[0, 1] = numpy.nan
+        field[:, 2] = numpy.nan
+        ds = xarray.Dataset({'field': (('Time', 'nCells'), field,
+                                       {'units': 'm'})})
+        ds.coords['month'] = ('Time', months)
+        ds.coords['year'] = ('Time', [1, 1, 1, 2, 2, 2])
+        ds.coords['daysInMonth'] = ('Time', daysInMonth)
+
+        climatology = compute_climatology(
+            ds, [1, 2, 3], statistics=['variance', 'min', 'max'])
+
+        self.assertArrayApproxEqual(
+            climatology.field.values,
+            compute_climatology(ds, [1, 2, 3]).field.values)
+        self.assertEqual(climatology.field_variance.attrs['units'], '(m)^2')
+        for cell in range(4):
+            valid = numpy.logical_not(numpy.isnan(field[:, cell]))
+            if not numpy.any(valid):
+                for statistic in ['variance', 'min', 'max']:
+                    assert numpy.isnan(climatology['field_{}'.format(
+                        statistic)].values[cell])
+                continue
+            values = field[valid, cell]
+            weights = daysInMonth[valid]
+            mean = numpy.average(values, weights=weights)
+            variance = numpy.average((values - mean)**2, weights=weights)
+            assert numpy.isclose(climatology.field_variance.values[cell],
+                                 variance, rtol=1e-8)
+            self.assertEqual(climatology.field_min.values[cell],
+                             values.min())
+            self.assertEqual(climatology.field_max.values[cell],
+                             values.max())
+
+        with six.assertRaisesRegex(self, ValueError, 'xarray.Dataset'):
+            compute_climatology(ds.field, [1, 2, 3], statistics=['max'])
+        with six.assertRaisesRegex(self, ValueError, 'Unsupported'):
+            compute_climatology(ds, [1, 2, 3], statistics=['median'])
+
+    def test_compute_seasonal_climatologies(self):
+        # two years of monthly data with a mask that varies in time
+        months = numpy.tile(numpy.arange(1, 13), 2)
+        years = numpy.repeat([1, 2], 12)
+        daysInMonth = numpy.array([constants.daysInMonth[month-1] for month
+                                   in months], float)
+        field = numpy.random.RandomState(0).rand(len(months), 5)
+        field[3, 1] = numpy.nan
+        field[14, :] = numpy.nan
+        ds = xarray.Dataset({'field': (('Time', 'nCells'), field)})
+        ds.coords['month'] = ('Time', months)
+        ds.coords['year'] = ('Time', years)
+        ds.coords['daysInMonth'] = ('Time', daysInMonth)
+
+        seasons = ['Jan', 'Mar', 'JFM', 'JAS', 'ANN']
+        climatologies = compute_seasonal_climatologies(ds, seasons)
+
+        self.assertEqual(list(climatologies.keys()), seasons)
+        for season in seasons:
+            monthValues = constants.monthDictionary[season]
+            refClimatology = compute_climatology(ds, monthValues)
+            assert('Time' not in climatologies[season].dims)
+            self.assertArrayApproxEqual(climatologies[season].field.values,
+                                        refClimatology.field.values)
+
+        climatologies = compute_seasonal_climatologies(ds, seasons,
+                                                       maskVaries=False)
+        for season in seasons:
+            monthValues = constants.monthDictionary[season]
+            refClimatology = compute_climatology(ds, monthValues,
+                                                 maskVaries=False)
+            self.assertArrayApproxEqual(climatologies[season].field.values,
+                                        refClimatology.field.values)
+
 
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -27,8 +27,11 @@ import xarray
 import pyproj
 
 from mpas_analysis.shared.interpolation import Remapper
+from mpas_analysis.shared.interpolation import remapper as remapper_module
+from mpas_analysis.shared.interpolation.native_weights import \
+    compute_native_weights
 from mpas_analysis.shared.grid import MpasMeshDescriptor, \
-    LatLonGridDescriptor, ProjectionGridDescriptor
+    LatLonGridDescriptor, ProjectionGridDescriptor, PointCollectionDescriptor
 from mpas_analysis.test import TestCase, loaddatadir
 from mpas_analysis.configuration import MpasAnalysisConfigParser
 
@@ -282,5 +285,253 @@ class TestInterp(TestCase):
 
         self.check_remap(inFileName, outFileName, refFileName,
                          remapper, remap_file=False)
+    def test_csr_mapping_copy(self):
+        '''
+        test that a binary CSR copy of a mapping file is made and reused
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        descriptor = LatLonGridDescriptor.create(
+            numpy.linspace(-80., 80., 6), numpy.linspace(0., 360., 9),
+            units='degrees')
+        cellCount = 40
+        weightFileName = '{}/weights_csr.nc'.format(self.test_dir)
+
+        def write_mapping_file(weight):
+            # each destination cell averages two neighboring source cells
+            rows = numpy.repeat(numpy.arange(cellCount), 2)
+            cols = (rows + numpy.tile([0, 1], cellCount)) % cellCount
+            dsMapping = xarray.Dataset(
+                {'S': ('n_s', numpy.tile([weight, 1. - weight], cellCount)),
+                 'row': ('n_s', rows + 1),
+                 'col': ('n_s', cols + 1),
+                 'frac_b': ('n_b', numpy.ones(cellCount)),
+                 'src_grid_dims': ('src_grid_rank', [8, 5]),
+                 'dst_grid_dims': ('dst_grid_rank', [8, 5]),
+                 'dummy_a': ('n_a', numpy.zeros(cellCount))})
+            dsMapping.to_netcdf(weightFileName)
+
+        field = numpy.random.RandomState(0).rand(5, 8)
+        ds = xarray.Dataset({'field': (('lat', 'lon'), field)})
+
+        def remap():
+            # make sure the mapping isn't reused from memory
+            remapper_module._mappingCache.clear()
+            remapper = Remapper(descriptor, descriptor, weightFileName)
+            return remapper, remapper.remap(ds).field.values
+
+        write_mapping_file(0.5)
+        _, expected = remap()
+        csrDirectory = '{}/weights_csr.csr'.format(self.test_dir)
+        assert os.path.exists('{}/indptr.npy'.format(csrDirectory))
+
+        # the weights are memory mapped (so read-only) from the copy
+        remapper, remapped = remap()
+        assert not remapper.matrix.data.flags.writeable
+        self.assertArrayApproxEqual(remapped, expected)
+
+        # a new mapping file replaces the out-of-date copy
+        os.utime(weightFileName, (0, 0))
+        write_mapping_file(0.25)
+        remapper, remapped = remap()
+        assert remapper.matrix.data.flags.writeable
+        flatField = field.ravel()
+        expected = 0.25*flatField + 0.75*numpy.roll(flatField, -1)
+        self.assertArrayApproxEqual(remapped.ravel(), expected)
+        remapper, _ = remap()
+        assert not remapper.matrix.data.flags.writeable
+
+    def test_native_nearest_weights(self):
+        '''
+        test that native nearest-neighbor weights at MPAS cell centers pick
+        out the value at each cell
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        sourceDescriptor, mpasMeshFileName, _ = self.get_mpas_descriptor()
+        dsMesh = xarray.open_dataset(mpasMeshFileName)
+        destinationDescriptor = PointCollectionDescriptor(
+            dsMesh.latCell.values, dsMesh.lonCell.values, 'cellCenters',
+            units='radians')
+
+        _, dst_grid_dims, frac_b, matrix = compute_native_weights(
+            sourceDescriptor, destinationDescriptor, 'neareststod')
+
+        self.assertArrayEqual(dst_grid_dims, [dsMesh.sizes['nCells']])
+        self.assertArrayEqual(frac_b, numpy.ones(dsMesh.sizes['nCells']))
+        field = numpy.random.RandomState(0).rand(dsMesh.sizes['nCells'])
+        self.assertArrayApproxEqual(matrix.dot(field), field)
+
+    def test_native_bilinear_weights(self):
+        '''
+        test native barycentric weights from an MPAS mesh, written to and
+        read back from a mapping file
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        sourceDescriptor, mpasMeshFileName, _ = self.get_mpas_descriptor()
+        destinationDescriptor = self.get_latlon_array_descriptor()
+        weightFileName = '{}/weights_native.nc'.format(self.test_dir)
+
+        remapper = Remapper(sourceDescriptor, destinationDescriptor,
+                            weightFileName)
+        remapper.build_mapping_file(method='bilinear', useNative=True)
+        assert os.path.exists(weightFileName)
+
+        frac_b = remapper.frac_b
+        mapped = frac_b > 0.
+        assert numpy.any(mapped)
+        self.assertArrayApproxEqual(frac_b[mapped],
+                                    numpy.ones(numpy.count_nonzero(mapped)))
+        assert remapper.matrix.min() >= 0.
+
+        # barycentric interpolation of a smooth field is nearly exact
+        dsMesh = xarray.open_dataset(mpasMeshFileName)
+        ds = xarray.Dataset({'field': ('nCells',
+                                       numpy.sin(dsMesh.latCell.values))})
+        remapped = remapper.remap(ds).field.values
+        lon, lat = numpy.meshgrid(destinationDescriptor.lon,
+                                  destinationDescriptor.lat)
+        expected = numpy.sin(numpy.deg2rad(lat))
+        mapped = mapped.reshape(expected.shape)
+        assert numpy.abs(remapped[mapped] - expected[mapped]).max() < 0.05
+
+        # the mapping file gives the same weights
+        remapper_module._mappingCache.clear()
+        remapper = Remapper(sourceDescriptor, destinationDescriptor,
+                            weightFileName)
+        self.assertArrayApproxEqual(remapper.remap(ds).field.values,
+                                    remapped)
+
+    def test_remap_datasets(self):
+        '''
+        test that remapping several datasets at once gives the same result as
+        remapping each variable of each dataset separately
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        sourceDescriptor, mpasMeshFileName, _ = self.get_mpas_descriptor()
+        destinationDescriptor = self.get_latlon_array_descriptor()
+        weightFileName = '{}/weights_native.nc'.format(self.test_dir)
+
+        remapper = Remapper(sourceDescriptor, destinationDescriptor,
+                            weightFileName)
+        remapper.build_mapping_file(method='bilinear', useNative=True)
+
+        dsMesh = xarray.open_dataset(mpasMeshFileName)
+        nCells = dsMesh.sizes['nCells']
+        random = numpy.random.RandomState(0)
+        datasets = []
+        for _ in range(2):
+            field = random.rand(nCells, 3)
+            field[random.rand(nCells, 3) < 0.2] = numpy.nan
+            ds = xarray.Dataset(
+                {'field': (('nCells', 'nVertLevels'), field),
+                 'noNaNs': ('nCells', random.rand(nCells)),
+                 'depth': ('nVertLevels', numpy.arange(3.))})
+            datasets.append(ds)
+
+        for threshold in [None, self.renormalizationThreshold]:
+            remappedList = remapper.remap_datasets(datasets, threshold)
+            assert len(remappedList) == len(datasets)
+            for ds, remapped in zip(datasets, remappedList):
+                self.assertEqual(remapped.field.dims,
+                                 ('lat', 'lon', 'nVertLevels'))
+                self.assertEqual(remapped.noNaNs.dims, ('lat', 'lon'))
+                self.assertArrayEqual(remapped.depth.values,
+                                      ds.depth.values)
+                for varName in ['field', 'noNaNs']:
+                    expected = remapper.remap(ds[varName], threshold)
+                    assert numpy.array_equal(remapped[varName].values,
+                                             expected.values,
+                                             equal_nan=True)
+
+    def test_chunked_remap_datasets(self):
+        '''
+        test that remapping the columns of several datasets in small blocks
+        gives the same result as remapping them in a single block
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        sourceDescriptor, mpasMeshFileName, _ = self.get_mpas_descriptor()
+        destinationDescriptor = self.get_latlon_array_descriptor()
+        weightFileName = '{}/weights_native.nc'.format(self.test_dir)
+
+        remapper = Remapper(sourceDescriptor, destinationDescriptor,
+                            weightFileName)
+        remapper.build_mapping_file(method='bilinear', useNative=True)
+
+        dsMesh = xarray.open_dataset(mpasMeshFileName)
+        nCells = dsMesh.sizes['nCells']
+        random = numpy.random.RandomState(0)
+        datasets = []
+        for _ in range(3):
+            field = random.rand(nCells, 5)
+            field[random.rand(nCells, 5) < 0.2] = numpy.nan
+            # a mask shared by all columns of another field
+            shared = random.rand(nCells, 4)
+            shared[random.rand(nCells) < 0.2, :] = numpy.nan
+            ds = xarray.Dataset(
+                {'field': (('nCells', 'nVertLevels'), field),
+                 'shared': (('nCells', 'nTracers'), shared),
+                 'noNaNs': ('nCells', random.rand(nCells))})
+            datasets.append(ds)
+
+        for threshold in [None, self.renormalizationThreshold]:
+            expectedList = remapper.remap_datasets(datasets, threshold)
+            # blocks of 1, 2 and 3 columns
+            sizes = remapper.matrix.shape[0] + remapper.matrix.shape[1]
+            for columnCount in [1, 2, 3]:
+                remapper.maxBlockBytes = 16*sizes*columnCount
+                remappedList = remapper.remap_datasets(datasets, threshold,
+                                                       cores=2)
+                del remapper.maxBlockBytes
+                for expected, remapped in zip(expectedList, remappedList):
+                    for varName in ['field', 'shared', 'noNaNs']:
+                        assert numpy.array_equal(remapped[varName].values,
+                                                 expected[varName].values,
+                                                 equal_nan=True)
+
+    def test_threaded_remap(self):
+        '''
+        test that splitting the mapping matrix among threads gives the same
+        result as remapping in serial
+        '''
+        # Authors
+        # -------
+        # Xylar Asay-Davis
+
+        sourceDescriptor, mpasMeshFileName, _ = self.get_mpas_descriptor()
+        destinationDescriptor = self.get_latlon_array_descriptor()
+        weightFileName = '{}/weights_native.nc'.format(self.test_dir)
+
+        remapper = Remapper(sourceDescriptor, destinationDescriptor,
+                            weightFileName)
+        remapper.build_mapping_file(method='bilinear', useNative=True)
+
+        dsMesh = xarray.open_dataset(mpasMeshFileName)
+        nCells = dsMesh.sizes['nCells']
+        random = numpy.random.RandomState(0)
+        field = random.rand(nCells, 4)
+        field[random.rand(nCells, 4) < 0.2] = numpy.nan
+        ds = xarray.Dataset({'field': (('nCells', 'nVertLevels'), field)})
+
+        expected = remapper.remap(ds, self.renormalizationThreshold)
+        for cores in [2, 3, 1000]:
+            remapped = remapper.remap(ds, self.renormalizationThreshold,
+                                      cores=cores)
+            assert numpy.array_equal(remapped.field.values,
+                                     expected.field.values, equal_nan=True)
+
 
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -19,9 +19,16 @@ from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
 import os
+import subprocess
+import tempfile
+import shutil
 import pytest
+import numpy
+import xarray
 from mpas_analysis.test import TestCase, loaddatadir
 from mpas_analysis.shared.io import paths
+from mpas_analysis.shared.io.utility import get_variable_bytes, \
+    get_temp_file_name
 
 
 @pytest.mark.usefixtures("loaddatadir")
@@ -33,4 +40,54 @@ class TestPaths(TestCase):
                           'c.txt'])
 
 
+class TestVariableBytes(TestCase):
+    def test_get_variable_bytes(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileNames = []
+            for index in range(2):
+                ds = xarray.Dataset()
+                ds['a'] = (('x',), numpy.zeros(10, dtype=float))
+                ds['b'] = (('x', 'y'), numpy.zeros((10, 4), dtype='int32'))
+                fileName = '{}/file{}.nc'.format(tempDir, index)
+                ds.to_netcdf(fileName)
+                fileNames.append(fileName)
+
+            self.assertEqual(get_variable_bytes(fileNames, ['a']), 2*80)
+            self.assertEqual(get_variable_bytes(fileNames, ['b', 'missing']),
+                             2*160)
+            self.assertEqual(get_variable_bytes(fileNames), 2*(80+160))
+        finally:
+            shutil.rmtree(tempDir)
+
+
+class TestTempFileName(TestCase):
+    def test_remove_stale_temp_files(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            # the ID of a process that has finished
+            process = subprocess.Popen(['true'])
+            process.wait()
+
+            fileNames = {}
+            for name, pid in [('stale', process.pid),
+                              ('recent', process.pid),
+                              ('running', os.getpid())]:
+                fileNames[name] = '{}/{}.tmp{}.nc'.format(tempDir, name, pid)
+                with open(fileNames[name], 'w'):
+                    pass
+                if name != 'recent':
+                    os.utime(fileNames[name], (0, 0))
+
+            tempFileName = get_temp_file_name('{}/out.nc'.format(tempDir))
+            self.assertEqual(tempFileName, '{}/out.tmp{}.nc'.format(
+                tempDir, os.getpid()))
+
+            assert not os.path.exists(fileNames['stale'])
+            assert os.path.exists(fileNames['recent'])
+            assert os.path.exists(fileNames['running'])
+        finally:
+            shutil.rmtree(tempDir)
+
+
 # vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -21,6 +21,8 @@ import pytest
 import tempfile
 import shutil
 import os
+import numpy
+import xarray
 
 from mpas_analysis.test import TestCase, loaddatadir
 from mpas_analysis.configuration import MpasAnalysisConfigParser
@@ -72,6 +74,8 @@ class TestMpasClimatologyTask(TestCase):
                 mpasClimatologyTask, parentTask, climatologyName,
                 variableList, seasons, comparisonGridNames=['latlon'])
 
+        for mappingFileTask in remapSubtask.mappingFileTasks.values():
+            mappingFileTask.setup_and_check()
         remapSubtask.setup_and_check()
         return remapSubtask
 
@@ -123,6 +127,130 @@ class TestMpasClimatologyTask(TestCase):
             fileName = mpasClimatologyTask.get_file_name(season=season)
             assert(os.path.exists(fileName))
 
+    def test_run_analysis_native(self):
+        fields = {}
+        for processCount in [1, 2]:
+            shutil.rmtree(self.test_dir)
+            self.test_dir = tempfile.mkdtemp()
+            config = self.setup_config()
+            config.set('climatology', 'useNcclimo', 'False')
+            config.set('execute', 'climatologyProcessCount',
+                       str(processCount))
+            mpasClimatologyTask = MpasClimatologyTask(config=config,
+                                                      componentName='ocean')
+            mpasClimatologyTask.setup_and_check()
+            variableList, seasons = self.add_variables(mpasClimatologyTask)
+            assert mpasClimatologyTask.cores == processCount
+
+            mpasClimatologyTask.run(writeLogFile=False)
+            assert mpasClimatologyTask._runStatus.value == \
+                AnalysisTask.SUCCESS
+
+            for season in ['Jan', 'Dec'] + seasons:
+                fileName = mpasClimatologyTask.get_file_name(season=season)
+                with xarray.open_dataset(fileName) as ds:
+                    fields[(processCount, season)] = \
+                        ds.timeMonthly_avg_ssh.values
+                    assert ds.timeMonthly_avg_ssh.dims == ('Time', 'nCells')
+                    for variableName in variableList:
+                        assert variableName in ds
+
+        # JFM is the mean of the first three months weighted by days
+        monthly = []
+        for month in [1, 2, 3]:
+            fileName = str(self.datadir.join(
+                'mpaso.hist.am.timeSeriesStatsMonthly.0002-{:02d}-01.'
+                'nc'.format(month)))
+            with xarray.open_dataset(fileName) as ds:
+                monthly.append(ds.timeMonthly_avg_ssh.values)
+        expected = (31.*monthly[0] + 28.*monthly[1] + 31.*monthly[2])/90.
+        assert numpy.allclose(fields[(1, 'JFM')], expected, rtol=1e-12)
+        assert numpy.allclose(fields[(1, 'Jan')], monthly[0], rtol=1e-14)
+
+        # splitting variables among processes doesn't change the results
+        for season in ['Jan', 'Dec'] + seasons:
+            assert numpy.all(fields[(1, season)] == fields[(2, season)])
+
+        # partial sums aren't cached by default
+        assert not os.path.exists('{}/clim/mpas/partialSums'.format(
+            self.test_dir))
+
+    def test_add_variables_native(self):
+        config = self.setup_config()
+        config.set('climatology', 'useNcclimo', 'False')
+        config.set('climatology', 'cachePartialSums', 'True')
+        mpasClimatologyTask = MpasClimatologyTask(config=config,
+                                                  componentName='ocean')
+        mpasClimatologyTask.setup_and_check()
+        mpasClimatologyTask.add_variables(
+            variableList=['timeMonthly_avg_ssh'], seasons=['JFM'])
+        mpasClimatologyTask.run(writeLogFile=False)
+        assert mpasClimatologyTask._runStatus.value == AnalysisTask.SUCCESS
+
+        fileName = mpasClimatologyTask.get_file_name(season='JFM')
+        with xarray.open_dataset(fileName) as ds:
+            ssh = ds.timeMonthly_avg_ssh.values
+            assert 'timeMonthly_avg_tThreshMLD' not in ds
+
+        # without the partial sums, recomputing ssh would recreate them
+        partialSumsDirectory = '{}/clim/mpas/partialSums/mpaso'.format(
+            self.test_dir)
+        shutil.rmtree('{}/timeMonthly_avg_ssh'.format(partialSumsDirectory))
+
+        mpasClimatologyTask = MpasClimatologyTask(config=config,
+                                                  componentName='ocean')
+        mpasClimatologyTask.setup_and_check()
+        mpasClimatologyTask.add_variables(
+            variableList=['timeMonthly_avg_ssh', 'timeMonthly_avg_tThreshMLD'],
+            seasons=['JFM'])
+        mpasClimatologyTask.run(writeLogFile=False)
+        assert mpasClimatologyTask._runStatus.value == AnalysisTask.SUCCESS
+
+        assert not os.path.exists('{}/timeMonthly_avg_ssh'.format(
+            partialSumsDirectory))
+        assert os.path.exists('{}/timeMonthly_avg_tThreshMLD'.format(
+            partialSumsDirectory))
+        for season in ['Jan', 'Dec', 'JFM']:
+            fileName = mpasClimatologyTask.get_file_name(season=season)
+            with xarray.open_dataset(fileName) as ds:
+                assert 'timeMonthly_avg_ssh' in ds
+                assert 'timeMonthly_avg_tThreshMLD' in ds
+                if season == 'JFM':
+                    assert numpy.all(ds.timeMonthly_avg_ssh.values == ssh)
+
+        # turning off the cache removes the partial sums
+        config.set('climatology', 'cachePartialSums', 'False')
+        mpasClimatologyTask = MpasClimatologyTask(config=config,
+                                                  componentName='ocean')
+        mpasClimatologyTask.setup_and_check()
+        mpasClimatologyTask.add_variables(
+            variableList=['timeMonthly_avg_ssh'], seasons=['JFM'])
+        mpasClimatologyTask.run(writeLogFile=False)
+        assert mpasClimatologyTask._runStatus.value == AnalysisTask.SUCCESS
+        assert not os.path.exists(partialSumsDirectory)
+
+    def test_slice_file_name(self):
+        config = self.setup_config()
+        config.set('climatology', 'useNcclimo', 'False')
+        mpasClimatologyTask = MpasClimatologyTask(config=config,
+                                                  componentName='ocean')
+        mpasClimatologyTask.setup_and_check()
+
+        with self.assertRaisesRegex(ValueError, 'have not been added'):
+            mpasClimatologyTask.get_slice_file_name('JFM', 'depths')
+
+        fileNames = []
+        for verticalIndices in [[[0, 0, 0]], [[0, 0, 0]], [[0, 1, 0]]]:
+            mpasClimatologyTask.add_vertical_slices(
+                'depths', ['timeMonthly_avg_ssh'],
+                numpy.array(verticalIndices), ['JFM'])
+            fileNames.append(mpasClimatologyTask.get_slice_file_name(
+                'JFM', 'depths'))
+
+        # a file for other vertical levels is never reused
+        assert fileNames[0] == fileNames[1]
+        assert fileNames[0] != fileNames[2]
+
     def test_update_climatology_bounds_and_create_symlinks(self):
         mpasClimatologyTask = self.setup_task()
         config = mpasClimatologyTask.config
@@ -179,6 +307,8 @@ class TestMpasClimatologyTask(TestCase):
         make_directories('{}/configs/'.format(logsDirectory))
 
         mpasClimatologyTask.run(writeLogFile=False)
+        for mappingFileTask in remapSubtask.mappingFileTasks.values():
+            mappingFileTask.run(writeLogFile=False)
         remapSubtask.run(writeLogFile=False)
 
         for season in remapSubtask.seasons:
@@ -189,6 +319,19 @@ class TestMpasClimatologyTask(TestCase):
                     season=season, comparisonGridName='latlon')
             assert(os.path.exists(fileName))
 
+    def test_subtask_memory(self):
+        mpasClimatologyTask = self.setup_task()
+        self.add_variables(mpasClimatologyTask)
+        remapSubtask = self.setup_subtask(mpasClimatologyTask)
+        memory = remapSubtask.memory
+        assert(memory > 1.)
+
+        # a smaller batch of seasons takes less memory
+        mpasClimatologyTask.config.set('climatology', 'remapSeasonBatchSize',
+                                       '1')
+        remapSubtask = self.setup_subtask(mpasClimatologyTask)
+        assert(1. < remapSubtask.memory < memory)
+
     def test_subtask_get_file_name(self):
         mpasClimatologyTask = self.setup_task()
         variableList, seasons = self.add_variables(mpasClimatologyTask)
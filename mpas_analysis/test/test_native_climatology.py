@@ -0,0 +1,301 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+"""
+Unit tests for computing climatologies directly in MPAS-Analysis
+
+Xylar Asay-Davis
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import time
+import tempfile
+import shutil
+import numpy
+import netCDF4
+import six
+
+from mpas_analysis.test import TestCase
+from mpas_analysis.shared.climatology.native_climatology import \
+    compute_native_climatologies, compute_native_climatology_windows, \
+    get_days_in_month, mpasFillValue
+from mpas_analysis.shared.constants import constants
+
+
+class TestNativeClimatology(TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_monthly_file(self, year, month, values):
+        fileName = '{}/mpaso.hist.am.timeSeriesStatsMonthly.{:04d}-{:02d}-' \
+            '01.nc'.format(self.test_dir, year, month)
+        with netCDF4.Dataset(fileName, 'w') as ds:
+            ds.createDimension('Time', None)
+            ds.createDimension('nCells', len(values))
+            ds.createDimension('nVertLevels', 2)
+            var = ds.createVariable('timeMonthly_avg_ssh', 'f8',
+                                    ('Time', 'nCells'))
+            var.units = 'm'
+            var[0, :] = values
+            var = ds.createVariable('timeMonthly_avg_temperature', 'f4',
+                                    ('Time', 'nCells', 'nVertLevels'))
+            field = numpy.outer(values, [1., 2.])
+            field[values == mpasFillValue, :] = mpasFillValue
+            var[0, :, :] = field
+        return fileName
+
+    def write_monthly_files(self, years):
+        inputFiles = []
+        fileYears = []
+        fileMonths = []
+        for year in years:
+            for month in range(1, 13):
+                values = numpy.array([float(year), float(month), 1.])
+                if year == 3:
+                    # the last cell is invalid in the first year
+                    values[2] = mpasFillValue
+                inputFiles.append(self.write_monthly_file(year, month,
+                                                          values))
+                fileYears.append(year)
+                fileMonths.append(month)
+        return inputFiles, fileYears, fileMonths
+
+    def compute(self, inputFiles, years, months, suffix,
+                cacheDirectory=None):
+        variableList = ['timeMonthly_avg_ssh', 'timeMonthly_avg_temperature']
+        outFileNames = {}
+        for season in ['Feb', 'JFM']:
+            outFileNames[season] = '{}/{}_{}.nc'.format(self.test_dir,
+                                                        season, suffix)
+        compute_native_climatologies(inputFiles, years, months,
+                                     variableList, outFileNames,
+                                     calendar='gregorian',
+                                     cacheDirectory=cacheDirectory)
+        results = {}
+        for season, fileName in outFileNames.items():
+            with netCDF4.Dataset(fileName, 'r') as ds:
+                for variableName in variableList:
+                    results[(season, variableName)] = \
+                        ds.variables[variableName][:]
+        return results
+
+    def test_days_in_month(self):
+        assert get_days_in_month(4, 2, 'gregorian') == 29
+        assert get_days_in_month(4, 2, 'gregorian_noleap') == 28
+        assert get_days_in_month(5, 2, 'gregorian') == 28
+        assert get_days_in_month(4, 12, 'gregorian') == 31
+
+    def test_climatologies(self):
+        inputFiles, years, months = self.write_monthly_files([3, 4])
+
+        variableList = ['timeMonthly_avg_ssh', 'timeMonthly_avg_temperature']
+        results = {}
+        for processCount in [1, 2]:
+            outFileNames = {}
+            for season in ['Feb', 'Mar', 'JFM']:
+                outFileNames[season] = '{}/{}_{}.nc'.format(
+                    self.test_dir, season, processCount)
+            compute_native_climatologies(inputFiles, years, months,
+                                         variableList, outFileNames,
+                                         calendar='gregorian',
+                                         processCount=processCount)
+            for season, fileName in outFileNames.items():
+                with netCDF4.Dataset(fileName, 'r') as ds:
+                    assert ds.variables['timeMonthly_avg_ssh'].units == 'm'
+                    assert ds.variables['timeMonthly_avg_temperature'].dtype \
+                        == numpy.float32
+                    results[(processCount, season)] = \
+                        ds.variables['timeMonthly_avg_ssh'][0, :]
+
+        # year 4 is a leap year, so it has more weight in February
+        feb = results[(1, 'Feb')]
+        assert numpy.isclose(feb[0], (28.*3. + 29.*4.)/57.)
+        assert numpy.isclose(feb[1], 2.)
+        # only the second year is valid in the last cell
+        assert numpy.isclose(feb[2], 1.)
+        assert numpy.isclose(results[(1, 'Mar')][0], 3.5)
+
+        # the seasonal mean weights monthly climatologies by days
+        assert numpy.isclose(results[(1, 'JFM')][1],
+                             (31.*1. + 28.*2. + 31.*3.)/90.)
+
+        for season in ['Feb', 'Mar', 'JFM']:
+            assert numpy.all(results[(1, season)] == results[(2, season)])
+
+    def test_partial_sums(self):
+        inputFiles, years, months = self.write_monthly_files([3, 4, 5])
+        cacheDirectory = '{}/partialSums'.format(self.test_dir)
+        cacheFileName = '{}/timeMonthly_avg_ssh/0003.nc'.format(
+            cacheDirectory)
+
+        # climatologies over the first two years fill the cache
+        self.compute(inputFiles[0:24], years[0:24], months[0:24], 'first',
+                     cacheDirectory)
+        assert os.path.exists(cacheFileName)
+        mtime = os.path.getmtime(cacheFileName)
+
+        # only the new year should be read after extending the range
+        cached = self.compute(inputFiles, years, months, 'cached',
+                              cacheDirectory)
+        assert os.path.getmtime(cacheFileName) == mtime
+        assert os.path.exists('{}/timeMonthly_avg_ssh/0005.nc'.format(
+            cacheDirectory))
+
+        # the cached sums must give identical results to a fresh computation
+        fresh = self.compute(inputFiles, years, months, 'fresh')
+        for key in fresh:
+            assert numpy.all(cached[key] == fresh[key])
+
+        # a changed input file invalidates the partial sums for its year
+        time.sleep(0.01)
+        self.write_monthly_file(3, 2, numpy.array([10., 10., 10.]))
+        changed = self.compute(inputFiles, years, months, 'changed',
+                               cacheDirectory)
+        assert os.path.getmtime(cacheFileName) != mtime
+        feb = changed[('Feb', 'timeMonthly_avg_ssh')][0, :]
+        assert numpy.isclose(feb[0], (28.*10. + 29.*4. + 28.*5.)/85.)
+
+    def test_vertical_slices(self):
+        inputFiles, years, months = self.write_monthly_files([3, 4])
+        variableList = ['timeMonthly_avg_ssh', 'timeMonthly_avg_temperature']
+        full = self.compute(inputFiles, years, months, 'full')
+
+        # the top level in every cell, then the bottom level except in a
+        # cell where it is invalid
+        verticalIndices = numpy.array([[0, 0, 0], [1, -1, 1]])
+        outFileNames = {}
+        for season in ['Feb', 'JFM']:
+            outFileNames[season] = '{}/{}_sliced.nc'.format(self.test_dir,
+                                                           season)
+        compute_native_climatologies(inputFiles, years, months, variableList,
+                                     outFileNames, calendar='gregorian',
+                                     cacheDirectory='{}/partialSums'.format(
+                                         self.test_dir),
+                                     verticalIndices=verticalIndices)
+
+        for season, fileName in outFileNames.items():
+            with netCDF4.Dataset(fileName, 'r') as ds:
+                ssh = ds.variables['timeMonthly_avg_ssh']
+                assert ssh.dimensions == ('Time', 'nCells')
+                assert numpy.all(
+                    ssh[:] == full[(season, 'timeMonthly_avg_ssh')])
+
+                temperature = ds.variables['timeMonthly_avg_temperature']
+                assert temperature.dimensions == \
+                    ('Time', 'depthSlice', 'nCells')
+                temperature = temperature[0, :, :]
+                fullTemperature = \
+                    full[(season, 'timeMonthly_avg_temperature')][0, :, :]
+                assert numpy.all(temperature[0, :] == fullTemperature[:, 0])
+                assert temperature[1, 0] == fullTemperature[0, 1]
+                assert temperature[1, 1] == mpasFillValue
+                assert temperature[1, 2] == fullTemperature[2, 1]
+
+    def test_statistics(self):
+        inputFiles, years, months = self.write_monthly_files([3, 4, 5])
+        variableList = ['timeMonthly_avg_ssh', 'timeMonthly_avg_temperature']
+        statistics = {'timeMonthly_avg_ssh': ['variance', 'min', 'max']}
+        cacheDirectory = '{}/partialSums'.format(self.test_dir)
+
+        def compute(fileCount, suffix):
+            outFileNames = {}
+            for season in ['Feb', 'JFM']:
+                outFileNames[season] = '{}/{}_{}.nc'.format(
+                    self.test_dir, season, suffix)
+            compute_native_climatologies(
+                inputFiles[0:fileCount], years[0:fileCount],
+                months[0:fileCount], variableList, outFileNames,
+                calendar='gregorian', cacheDirectory=cacheDirectory,
+                statistics=statistics)
+            results = {}
+            for season, fileName in outFileNames.items():
+                with netCDF4.Dataset(fileName, 'r') as ds:
+                    assert 'timeMonthly_avg_temperature_variance' not in \
+                        ds.variables
+                    assert ds.variables['timeMonthly_avg_ssh_variance'].units \
+                        == '(m)^2'
+                    for statistic in statistics['timeMonthly_avg_ssh']:
+                        results[(season, statistic)] = ds.variables[
+                            'timeMonthly_avg_ssh_{}'.format(statistic)][0, :]
+            return results
+
+        # sums without moments in the cache are recomputed with them
+        self.compute(inputFiles[0:24], years[0:24], months[0:24], 'first',
+                     cacheDirectory)
+        compute(24, 'partial')
+        results = compute(len(inputFiles), 'full')
+
+        for season in ['Feb', 'JFM']:
+            seasonMonths = constants.monthDictionary[season]
+            for cell in range(3):
+                values = []
+                days = []
+                for year, month in zip(years, months):
+                    if month not in seasonMonths or (cell == 2 and year == 3):
+                        continue
+                    values.append([year, month, 1.][cell])
+                    days.append(get_days_in_month(year, month, 'gregorian'))
+                mean = numpy.average(values, weights=days)
+                variance = numpy.average((numpy.array(values) - mean)**2,
+                                         weights=days)
+                assert numpy.isclose(results[(season, 'variance')][cell],
+                                     variance, atol=1e-12)
+                assert results[(season, 'min')][cell] == min(values)
+                assert results[(season, 'max')][cell] == max(values)
+
+    def test_windows(self):
+        inputFiles, years, months = self.write_monthly_files([3, 4, 5])
+        variableList = ['timeMonthly_avg_ssh', 'timeMonthly_avg_temperature']
+        windows = [(3, 3), (4, 5), (3, 5), (5, 6)]
+        climatologies = compute_native_climatology_windows(
+            inputFiles, years, months, variableList, windows,
+            seasons=['Feb', 'JFM'], calendar='gregorian')
+
+        for startYear, endYear in windows:
+            indices = [index for index, year in enumerate(years)
+                       if startYear <= year <= endYear]
+            expected = self.compute(
+                [inputFiles[index] for index in indices],
+                [years[index] for index in indices],
+                [months[index] for index in indices],
+                '{}_{}'.format(startYear, endYear))
+            for season in ['Feb', 'JFM']:
+                ds = climatologies[(startYear, endYear)][season]
+                for variableName in variableList:
+                    field = ds[variableName].values
+                    expectedField = expected[(season, variableName)][0]
+                    expectedField = numpy.where(
+                        expectedField == mpasFillValue, numpy.nan,
+                        expectedField)
+                    assert field.shape == expectedField.shape
+                    # the expected temperature has been cast to float32
+                    assert numpy.allclose(field, expectedField, rtol=1e-6,
+                                          equal_nan=True)
+
+        # only the second year is valid in the last cell
+        ds = climatologies[(3, 3)]['Feb']
+        assert numpy.isnan(ds.timeMonthly_avg_ssh.values[2])
+
+        with six.assertRaisesRegex(self, ValueError, 'No input files'):
+            compute_native_climatology_windows(
+                inputFiles, years, months, variableList, [(7, 8)],
+                seasons=['Feb'], calendar='gregorian')
+
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
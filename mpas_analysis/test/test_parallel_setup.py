@@ -0,0 +1,131 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+"""
+Unit tests for setting up analysis tasks in parallel threads
+
+Xylar Asay-Davis
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import time
+import threading
+
+from mpas_analysis.test import TestCase
+from mpas_analysis.shared.analysis_task import AnalysisTask
+from mpas_analysis.configuration import MpasAnalysisConfigParser
+from mpas_analysis.__main__ import determine_analyses_to_generate
+
+
+class SetupTask(AnalysisTask):
+    '''
+    A task that records the tasks that had been set up when its own setup
+    began
+    '''
+    def __init__(self, config, taskName, subtaskName=None, fail=False):
+        super(SetupTask, self).__init__(config=config, taskName=taskName,
+                                        subtaskName=subtaskName,
+                                        componentName='ocean')
+        self.fail = fail
+        self.setUpBefore = None
+        self.setUpCount = 0
+
+    def setup_and_check(self):
+        with _setupLock:
+            self.setUpBefore = list(_setUpTasks)
+        # give other threads a chance to run
+        time.sleep(0.02)
+        self.setUpCount += 1
+        if self.fail:
+            raise ValueError('failing on purpose')
+        with _setupLock:
+            _setUpTasks.append(self.fullTaskName)
+
+
+_setupLock = threading.Lock()
+_setUpTasks = []
+
+
+class TestParallelSetup(TestCase):
+
+    def build_tasks(self, failClimatology=False):
+        config = MpasAnalysisConfigParser()
+        config.add_section('output')
+        config.set('output', 'generate', "['all']")
+
+        climatology = SetupTask(config, 'climatology', fail=failClimatology)
+        tasks = {'climatology': climatology}
+        analyses = []
+        for taskName in ['mapA', 'mapB', 'broken']:
+            parent = SetupTask(config, taskName)
+            parent.run_after(climatology)
+            tasks[taskName] = parent
+            for subtaskName in ['remap', 'plot']:
+                subtask = SetupTask(config, taskName, subtaskName,
+                                    fail=(taskName == 'broken' and
+                                          subtaskName == 'remap'))
+                parent.add_subtask(subtask)
+                tasks[subtask.fullTaskName] = subtask
+            tasks['{}_plot'.format(taskName)].run_after(
+                tasks['{}_remap'.format(taskName)])
+            analyses.append(parent)
+
+        return tasks, analyses
+
+    def test_parallel_setup(self):
+        results = {}
+        for setupTaskCount in [1, 4]:
+            del _setUpTasks[:]
+            tasks, analyses = self.build_tasks()
+            analysesToGenerate = determine_analyses_to_generate(
+                analyses, setupTaskCount=setupTaskCount)
+            results[setupTaskCount] = list(analysesToGenerate.keys())
+
+            for taskName in ['mapA', 'mapB']:
+                parent = tasks[taskName]
+                remap = tasks['{}_remap'.format(taskName)]
+                plot = tasks['{}_plot'.format(taskName)]
+                assert 'climatology' in parent.setUpBefore
+                assert taskName in remap.setUpBefore
+                assert '{}_remap'.format(taskName) in plot.setUpBefore
+                for task in [parent, remap, plot]:
+                    assert task._setupStatus == 'success'
+                    assert task.setUpCount == 1
+
+            assert tasks['broken']._setupStatus == 'fail'
+            # the plot subtask runs after the remap subtask, which failed
+            assert tasks['broken_plot'].setUpCount == 0
+
+        assert results[1] == results[4]
+        assert ('broken', None) not in results[4]
+        assert ('mapA', 'plot') in results[4]
+
+    def test_parallel_setup_failed_prereq(self):
+        results = {}
+        for setupTaskCount in [1, 4]:
+            del _setUpTasks[:]
+            tasks, analyses = self.build_tasks(failClimatology=True)
+            analysesToGenerate = determine_analyses_to_generate(
+                analyses, setupTaskCount=setupTaskCount)
+            results[setupTaskCount] = list(analysesToGenerate.keys())
+
+            assert tasks['climatology']._setupStatus == 'fail'
+            # no task that depends on the climatology gets set up
+            for key, task in tasks.items():
+                if key != 'climatology':
+                    assert task.setUpCount == 0
+
+        assert results[1] == []
+        assert results[4] == []
+
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
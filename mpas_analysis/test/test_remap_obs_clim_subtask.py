@@ -125,6 +125,8 @@ class TestRemapObsClimSubtask(TestCase):
                 outFilePrefix='mld',
                 comparisonGridNames=['latlon', 'antarctic'])
 
+        for mappingFileTask in remapObsTask.mappingFileTasks.values():
+            mappingFileTask.setup_and_check()
         remapObsTask.setup_and_check()
         return remapObsTask
 
@@ -137,6 +139,8 @@ class TestRemapObsClimSubtask(TestCase):
         make_directories(logsDirectory)
         make_directories('{}/configs/'.format(logsDirectory))
 
+        for mappingFileTask in remapSubtask.mappingFileTasks.values():
+            mappingFileTask.run(writeLogFile=False)
         remapSubtask.run(writeLogFile=False)
 
         for comparisonGridName in remapSubtask.comparisonGridNames:
@@ -0,0 +1,118 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+"""
+Unit tests for the cache of remapped observational climatologies
+
+Xylar Asay-Davis
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import tempfile
+import shutil
+
+from mpas_analysis.test import TestCase
+from mpas_analysis.configuration import MpasAnalysisConfigParser
+from mpas_analysis.shared.climatology.remapped_obs_cache import \
+    RemappedObsCache, compute_checksum
+
+
+class TestRemappedObsCache(TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def write_file(self, name, size):
+        fileName = '{}/{}.nc'.format(self.test_dir, name)
+        with open(fileName, 'wb') as outFile:
+            outFile.write(name.encode('utf-8')*size)
+        return fileName
+
+    def test_from_config(self):
+        config = MpasAnalysisConfigParser()
+        config.add_section('diagnostics')
+        config.set('diagnostics', 'baseDirectory', self.test_dir)
+
+        assert RemappedObsCache.from_config(config) is None
+
+        config.set('diagnostics', 'remappedObsCacheSubdirectory', 'cache')
+        config.set('diagnostics', 'remappedObsCacheMaxSize', '2.')
+        cache = RemappedObsCache.from_config(config)
+        self.assertEqual(cache.directory, '{}/cache'.format(self.test_dir))
+        self.assertEqual(cache.maxSize, 2e9)
+
+    def test_fetch_and_publish(self):
+        cache = RemappedObsCache('{}/cache'.format(self.test_dir))
+        fileName = self.write_file('remapped', 10)
+        key = cache.get_key({'observations': compute_checksum(fileName),
+                             'season': 'JFM'})
+        assert key != cache.get_key({'observations':
+                                     compute_checksum(fileName),
+                                     'season': 'ANN'})
+
+        outFileName = '{}/fetched.nc'.format(self.test_dir)
+        assert not cache.fetch(key, outFileName)
+        assert not os.path.exists(outFileName)
+
+        cache.publish(key, fileName)
+        assert cache.fetch(key, outFileName)
+        self.assertEqual(compute_checksum(outFileName),
+                         compute_checksum(fileName))
+
+    def test_evict(self):
+        cache = RemappedObsCache('{}/cache'.format(self.test_dir),
+                                 maxSize=250)
+        keys = []
+        for index, name in enumerate(['first', 'second', 'third']):
+            fileName = self.write_file(name, 100//len(name) + 1)
+            keys.append(cache.get_key({'name': name}))
+            cache.publish(keys[-1], fileName)
+            # make sure each file is more recent than the last
+            cacheFileName = '{}/{}.nc'.format(cache.directory, keys[-1])
+            os.utime(cacheFileName, (index, index))
+            if index == 1:
+                # using the first file makes it the most recently used
+                assert cache.fetch(keys[0], '{}/out.nc'.format(self.test_dir))
+                os.utime('{}/{}.nc'.format(cache.directory, keys[0]),
+                         (10, 10))
+
+        outFileName = '{}/out.nc'.format(self.test_dir)
+        assert cache.fetch(keys[0], outFileName)
+        assert not cache.fetch(keys[1], outFileName)
+        assert cache.fetch(keys[2], outFileName)
+
+    def test_evict_keeps_new_file(self):
+        cache = RemappedObsCache('{}/cache'.format(self.test_dir),
+                                 maxSize=250)
+        oldKey = cache.get_key({'name': 'old'})
+        cache.publish(oldKey, self.write_file('old', 10))
+
+        # the new file is kept (and the older one removed) even though it is
+        # larger than the cache and no more recent than the older file
+        newKey = cache.get_key({'name': 'large'})
+        cache.publish(newKey, self.write_file('large', 100))
+        oldCacheFileName = '{}/{}.nc'.format(cache.directory, oldKey)
+        newCacheFileName = '{}/{}.nc'.format(cache.directory, newKey)
+        assert not os.path.exists(oldCacheFileName)
+        assert os.path.exists(newCacheFileName)
+
+        outFileName = '{}/out.nc'.format(self.test_dir)
+        assert cache.fetch(newKey, outFileName)
+
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,133 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+"""
+Unit tests for measuring and reporting the resources used by tasks
+
+Xylar Asay-Davis
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import tempfile
+import shutil
+import logging
+import csv
+import json
+import subprocess
+from collections import OrderedDict
+
+from mpas_analysis.test import TestCase
+from mpas_analysis.shared.analysis_task import AnalysisTask
+from mpas_analysis.shared.scheduler import TaskScheduler
+from mpas_analysis.shared.resource_usage import ResourceUsage, \
+    write_resource_report, get_top_consumers
+from mpas_analysis.configuration import MpasAnalysisConfigParser
+
+
+class BusyTask(AnalysisTask):
+    '''
+    A task that launches child processes and writes a file
+    '''
+    def __init__(self, config, taskName, outFileName, childCount):
+        super(BusyTask, self).__init__(config=config, taskName=taskName,
+                                       componentName='ocean')
+        self.outFileName = outFileName
+        self.childCount = childCount
+
+    def run_task(self):
+        for index in range(self.childCount):
+            # long enough for the child to be seen by polling
+            subprocess.check_call(['sleep', '0.5'])
+        with open(self.outFileName, 'w') as outFile:
+            outFile.write('x'*100000)
+
+
+class TestResourceUsage(TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def test_resource_usage(self):
+        for ownProcess in [False, True]:
+            usage = ResourceUsage(ownProcess=ownProcess)
+            for index in range(3):
+                subprocess.check_call(['sleep', '0.5'])
+            with open('{}/out.txt'.format(self.test_dir), 'w') as outFile:
+                outFile.write('x'*100000)
+            usage = usage.stop()
+
+            if usage['childProcesses'] is not None:
+                assert usage['childProcesses'] == 3
+            if usage['writeBytes'] is not None:
+                assert usage['writeBytes'] >= 100000
+            if usage['userTime'] is not None:
+                assert usage['userTime'] >= 0.
+                if ownProcess:
+                    assert usage['maxRss'] > 0
+            if not ownProcess:
+                # the peak memory of a shared process can't be attributed
+                assert usage['maxRss'] is None
+
+    def test_report(self):
+        config = MpasAnalysisConfigParser()
+        analyses = OrderedDict()
+        for childCount in [1, 2, 3]:
+            taskName = 'busy{}'.format(childCount)
+            task = BusyTask(config, taskName,
+                            '{}/{}.txt'.format(self.test_dir, taskName),
+                            childCount)
+            task._logFileName = '{}/{}.log'.format(self.test_dir, taskName)
+            analyses[(taskName, None)] = task
+
+        scheduler = TaskScheduler(analyses, 2,
+                                  logging.getLogger('test_resource_usage'))
+        assert scheduler.run() == []
+
+        report = write_resource_report(analyses, self.test_dir)
+        assert [entry['task'] for entry in report] == \
+            ['busy1', 'busy2', 'busy3']
+        for entry in report:
+            assert entry['status'] == 'success'
+            # the usage was measured in the task's own process
+            assert entry['childProcesses'] == int(entry['task'][-1])
+            assert entry['maxRss'] > 0
+
+        with open('{}/taskResources.json'.format(self.test_dir)) as \
+                reportFile:
+            assert json.load(reportFile)['tasks'] == report
+
+        with open('{}/taskResources.csv'.format(self.test_dir)) as csvFile:
+            rows = list(csv.DictReader(csvFile))
+        assert [row['task'] for row in rows] == ['busy1', 'busy2', 'busy3']
+        assert [row['childProcesses'] for row in rows] == ['1', '2', '3']
+
+    def test_top_consumers(self):
+        report = []
+        for index in range(5):
+            report.append({'task': 'task{}'.format(index),
+                           'userTime': float(index), 'systemTime': 0.,
+                           'maxRss': index, 'readBytes': index,
+                           'writeBytes': 0})
+        # a task that uses little CPU time but a lot of memory
+        report[0]['maxRss'] = 1000
+
+        topConsumers = get_top_consumers(report, count=2)
+        assert [entry['task'] for entry in topConsumers] == \
+            ['task4', 'task3', 'task0']
+
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python
@@ -0,0 +1,560 @@
+# This software is open source software available under the BSD-3 license.
+#
+# Copyright (c) 2018 Los Alamos National Security, LLC. All rights reserved.
+# Copyright (c) 2018 Lawrence Livermore National Security, LLC. All rights
+# reserved.
+# Copyright (c) 2018 UT-Battelle, LLC. All rights reserved.
+#
+# Additional copyright and license information can be found in the LICENSE file
+# distributed with this code, or at
+# https://raw.githubusercontent.com/MPAS-Dev/MPAS-Analysis/master/LICENSE
+"""
+Unit tests for the TaskScheduler used to run analysis tasks
+
+Xylar Asay-Davis
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import tempfile
+import shutil
+import logging
+import os
+import time
+import heapq
+import subprocess
+from collections import OrderedDict
+
+from mpas_analysis.test import TestCase
+from mpas_analysis.shared.analysis_task import AnalysisTask
+from mpas_analysis.shared.scheduler import TaskScheduler, TaskDurations
+from mpas_analysis.shared.manifest import TaskManifest
+from mpas_analysis.configuration import MpasAnalysisConfigParser
+
+
+class RecordingTask(AnalysisTask):
+    '''
+    A task that appends its name to a file when it runs (and optionally
+    fails)
+    '''
+    def __init__(self, config, taskName, recordFileName, fail=False,
+                 duration=0., crash=False):
+        super(RecordingTask, self).__init__(config=config, taskName=taskName,
+                                            componentName='ocean')
+        self.recordFileName = recordFileName
+        self.fail = fail
+        self.duration = duration
+        self.crash = crash
+        self.inputFileName = None
+        self.outputFileName = None
+        # the number of times the task fails before it succeeds
+        self.failureCount = 0
+        # whether the task launches a child process that outlives it
+        self.spawnChild = False
+
+    def get_input_files(self):
+        if self.inputFileName is None:
+            return []
+        return [self.inputFileName]
+
+    def get_output_files(self):
+        outputFiles = list(self.xmlFileNames)
+        if self.outputFileName is not None:
+            outputFiles.append(self.outputFileName)
+        return outputFiles
+
+    def run_task(self):
+        self.write_record('start')
+        if self.spawnChild:
+            child = subprocess.Popen(['sleep', '60'])
+            self.write_record('child{}'.format(child.pid))
+        time.sleep(self.duration)
+        if self.crash:
+            # kill the process running the task without cleaning up
+            os._exit(1)
+        self.write_record('end')
+        if self.outputFileName is not None:
+            with open(self.outputFileName, 'w') as outputFile:
+                outputFile.write('{}\n'.format(self.taskName))
+        self.write_record('pid{}'.format(os.getpid()))
+        self.write_record('cores{}'.format(self.allottedCores))
+        if self.fail:
+            raise ValueError('failing on purpose')
+        with open(self.recordFileName) as recordFile:
+            startCount = recordFile.read().split().count(
+                'start:{}'.format(self.taskName))
+        if startCount <= self.failureCount:
+            raise ValueError('failing on purpose this time')
+
+    def write_record(self, event):
+        with open(self.recordFileName, 'a') as recordFile:
+            recordFile.write('{}:{}\n'.format(event, self.taskName))
+
+
+def is_running(pid):
+    '''
+    Whether a process is running (and not just waiting to be reaped)
+    '''
+    statFileName = '/proc/{}/stat'.format(pid)
+    if os.path.exists('/proc'):
+        try:
+            with open(statFileName) as statFile:
+                state = statFile.read().split(')')[-1].split()[0]
+        except IOError:
+            return False
+        return state != 'Z'
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        # Create a temporary directory
+        self.test_dir = tempfile.mkdtemp()
+        self.recordFileName = '{}/record.txt'.format(self.test_dir)
+        self.logger = logging.getLogger('test_scheduler')
+
+    def tearDown(self):
+        # Remove the directory after the test
+        shutil.rmtree(self.test_dir)
+
+    def make_task(self, taskName, fail=False, duration=0., crash=False):
+        config = MpasAnalysisConfigParser()
+        task = RecordingTask(config, taskName, self.recordFileName, fail,
+                             duration, crash)
+        task._logFileName = '{}/{}.log'.format(self.test_dir, taskName)
+        return task
+
+    def read_record(self, event='start'):
+        if not os.path.exists(self.recordFileName):
+            return []
+        with open(self.recordFileName) as recordFile:
+            lines = recordFile.read().split()
+        return [line.split(':')[1] for line in lines
+                if line.split(':')[0] == event]
+
+    def replay_record(self, analyses):
+        # replay the start and end events, finding the cores and memory in
+        # use by other tasks when each task started and the largest totals
+        with open(self.recordFileName) as recordFile:
+            lines = recordFile.read().split()
+        tasks = {}
+        for task in analyses.values():
+            tasks[task.taskName] = task
+        cores = 0
+        memory = 0.
+        coresAtStart = {}
+        maxMemory = 0.
+        for line in lines:
+            event, taskName = line.split(':')
+            if event.startswith('pid') or event.startswith('cores') or \
+                    event.startswith('child'):
+                continue
+            task = tasks[taskName]
+            if event == 'start':
+                coresAtStart[taskName] = cores
+                cores += task.cores
+                memory += task.memory
+            else:
+                cores -= task.cores
+                memory -= task.memory
+            maxMemory = max(memory, maxMemory)
+        return coresAtStart, maxMemory
+
+    def make_analyses(self, tasks):
+        analyses = OrderedDict()
+        for task in tasks:
+            analyses[(task.taskName, task.subtaskName)] = task
+        return analyses
+
+    def test_dependency_order(self):
+        for parallelTaskCount in [1, 3]:
+            if os.path.exists(self.recordFileName):
+                os.remove(self.recordFileName)
+
+            # insert tasks so that dependents come before prerequisites
+            last = self.make_task('last')
+            middle = self.make_task('middle')
+            first = self.make_task('first')
+            other = self.make_task('other')
+            last.run_after(middle)
+            middle.run_after(first)
+
+            analyses = self.make_analyses([last, middle, first, other])
+            scheduler = TaskScheduler(analyses, parallelTaskCount,
+                                      self.logger)
+            tasksWithErrors = scheduler.run()
+
+            assert tasksWithErrors == []
+            record = self.read_record()
+            assert sorted(record) == ['first', 'last', 'middle', 'other']
+            assert record.index('first') < record.index('middle')
+            assert record.index('middle') < record.index('last')
+            for task in analyses.values():
+                assert task._runStatus.value == AnalysisTask.SUCCESS
+
+    def test_worker_pool(self):
+        tasks = []
+        for index in range(6):
+            tasks.append(self.make_task('task{}'.format(index),
+                                        duration=0.05))
+        tasks[5].run_after(tasks[0])
+        failing = self.make_task('failing', fail=True)
+        tasks.append(failing)
+
+        analyses = self.make_analyses(tasks)
+        scheduler = TaskScheduler(analyses, 2, self.logger,
+                                  executionMode='pool')
+        tasksWithErrors = scheduler.run()
+
+        assert tasksWithErrors == ['failing']
+        record = self.read_record()
+        assert sorted(record) == sorted([task.taskName for task in tasks])
+        assert record.index('task0') < record.index('task5')
+        # tasks were run by (at most) two long-lived workers
+        workerIds = set()
+        with open(self.recordFileName) as recordFile:
+            for line in recordFile.read().split():
+                event = line.split(':')[0]
+                if event.startswith('pid'):
+                    workerIds.add(event)
+        assert len(workerIds) <= 2
+        for task in tasks[0:6]:
+            assert task._runStatus.value == AnalysisTask.SUCCESS
+            assert os.path.exists(task._logFileName)
+        assert failing._runStatus.value == AnalysisTask.FAIL
+        assert scheduler._idleWorkers == []
+
+    def test_crashed_worker(self):
+        crashing = self.make_task('crashing', crash=True)
+        dependent = self.make_task('dependent')
+        dependent.run_after(crashing)
+        tasks = [crashing, dependent]
+        for index in range(4):
+            tasks.append(self.make_task('task{}'.format(index),
+                                        duration=0.05))
+
+        analyses = self.make_analyses(tasks)
+        scheduler = TaskScheduler(analyses, 2, self.logger,
+                                  executionMode='pool')
+        tasksWithErrors = scheduler.run()
+
+        assert tasksWithErrors == ['crashing']
+        assert crashing._runStatus.value == AnalysisTask.FAIL
+        assert dependent._runStatus.value == AnalysisTask.FAIL
+        # the remaining tasks still ran on a replacement worker
+        for task in tasks[2:]:
+            assert task._runStatus.value == AnalysisTask.SUCCESS
+
+    def test_failed_prerequisite(self):
+        failing = self.make_task('failing', fail=True)
+        dependent = self.make_task('dependent')
+        indirect = self.make_task('indirect')
+        independent = self.make_task('independent')
+        dependent.run_after(failing)
+        indirect.run_after(dependent)
+
+        analyses = self.make_analyses([failing, dependent, indirect,
+                                       independent])
+        scheduler = TaskScheduler(analyses, 2, self.logger)
+        tasksWithErrors = scheduler.run()
+
+        assert tasksWithErrors == ['failing']
+        assert sorted(self.read_record()) == ['failing', 'independent']
+        for task in [failing, dependent, indirect]:
+            assert task._runStatus.value == AnalysisTask.FAIL
+        assert independent._runStatus.value == AnalysisTask.SUCCESS
+
+    def test_retries(self):
+        for parallelTaskCount, executionMode in [(1, 'process'),
+                                                 (2, 'process'),
+                                                 (2, 'pool')]:
+            if os.path.exists(self.recordFileName):
+                os.remove(self.recordFileName)
+            flaky = self.make_task('flaky')
+            flaky.failureCount = 2
+            dependent = self.make_task('dependent')
+            dependent.run_after(flaky)
+
+            analyses = self.make_analyses([flaky, dependent])
+            scheduler = TaskScheduler(analyses, parallelTaskCount,
+                                      self.logger,
+                                      executionMode=executionMode,
+                                      retryCount=2, retryDelay=0.05)
+            tasksWithErrors = scheduler.run()
+
+            assert tasksWithErrors == []
+            assert self.read_record() == ['flaky', 'flaky', 'flaky',
+                                          'dependent']
+            assert flaky._runStatus.value == AnalysisTask.SUCCESS
+            assert dependent._runStatus.value == AnalysisTask.SUCCESS
+
+    def test_timeout(self):
+        for executionMode in ['process', 'pool']:
+            if os.path.exists(self.recordFileName):
+                os.remove(self.recordFileName)
+            hung = self.make_task('hung', duration=60.)
+            hung.spawnChild = True
+            dependent = self.make_task('dependent')
+            dependent.run_after(hung)
+            other = self.make_task('other', duration=0.5)
+
+            analyses = self.make_analyses([hung, dependent, other])
+            scheduler = TaskScheduler(analyses, 2, self.logger,
+                                      executionMode=executionMode,
+                                      timeout=30., timeouts={'hung': 0.5},
+                                      retryCount=1)
+            startTime = time.time()
+            tasksWithErrors = scheduler.run()
+
+            assert time.time() - startTime < 30.
+            assert tasksWithErrors == ['hung']
+            # the hung task is tried twice and the task that depends on it
+            # never runs
+            assert sorted(self.read_record()) == ['hung', 'hung', 'other']
+            assert self.read_record('end') == ['other']
+            assert dependent._runStatus.value == AnalysisTask.FAIL
+            assert other._runStatus.value == AnalysisTask.SUCCESS
+
+            # the timeouts and the retry are reported in the task's log file
+            with open(hung._logFileName) as logFile:
+                log = logFile.read()
+            os.remove(hung._logFileName)
+            assert log.count('exceeded its timeout') == 2
+            assert log.count('Retrying task hung') == 1
+            assert log.count('ERROR in task hung') == 1
+
+            # the processes launched by the hung task were killed with it
+            with open(self.recordFileName) as recordFile:
+                childPids = [int(line.split(':')[0][len('child'):])
+                             for line in recordFile.read().split()
+                             if line.startswith('child')]
+            assert len(childPids) == 2
+            time.sleep(0.5)
+            for pid in childPids:
+                assert not is_running(pid)
+
+    def test_budgets(self):
+        heavy = self.make_task('heavy', duration=0.5)
+        heavy.cores = 3
+        heavy.memory = 6.
+        huge = self.make_task('huge', duration=0.1)
+        huge.cores = 8
+        tasks = [heavy, huge]
+        for index in range(6):
+            light = self.make_task('light{}'.format(index), duration=0.1)
+            light.memory = 0.5
+            tasks.append(light)
+
+        analyses = self.make_analyses(tasks)
+        scheduler = TaskScheduler(analyses, 8, self.logger, coreBudget=4,
+                                  memoryBudget=8.)
+        tasksWithErrors = scheduler.run()
+
+        assert tasksWithErrors == []
+        assert sorted(self.read_record()) == sorted(
+            [task.taskName for task in tasks])
+
+        coresAtStart, maxMemory = self.replay_record(analyses)
+        assert maxMemory <= 8.
+        # the huge task exceeds the core budget so it must run on its own
+        assert coresAtStart['huge'] == 0
+        for task in tasks:
+            if task.taskName != 'huge':
+                assert coresAtStart[task.taskName] + task.cores <= 4
+        # light tasks are launched alongside the heavy one, ahead of the
+        # huge task that doesn't fit
+        record = self.read_record()
+        assert record.index('light0') < record.index('huge')
+        assert scheduler._coresInUse == 0
+
+    def test_elastic_cores(self):
+        for parallelTaskCount, executionMode, expectedCores in \
+                [(1, 'process', 3), (4, 'process', 2), (4, 'pool', 2)]:
+            if os.path.exists(self.recordFileName):
+                os.remove(self.recordFileName)
+            light = self.make_task('light', duration=0.5)
+            elastic = self.make_task('elastic')
+            elastic.cores = 4
+            elastic.minCores = 1
+
+            analyses = self.make_analyses([light, elastic])
+            scheduler = TaskScheduler(analyses, parallelTaskCount,
+                                      self.logger, coreBudget=3,
+                                      executionMode=executionMode)
+            tasksWithErrors = scheduler.run()
+
+            assert tasksWithErrors == []
+            # in serial, the elastic task gets the whole budget; otherwise,
+            # it gets what the light task leaves free
+            record = self.read_record('cores{}'.format(expectedCores))
+            assert record == ['elastic']
+            assert scheduler._coresInUse == 0
+
+    def test_critical_path(self):
+        short = self.make_task('short')
+        long1 = self.make_task('long1')
+        long2 = self.make_task('long2')
+        other = self.make_task('other')
+        long2.run_after(long1)
+        short.expectedDuration = 100.
+        long1.expectedDuration = 60.
+        long2.expectedDuration = 60.
+        other.expectedDuration = 10.
+
+        analyses = self.make_analyses([short, other, long2, long1])
+        scheduler = TaskScheduler(analyses, 2, self.logger)
+
+        assert scheduler._criticalPaths[('long1', None)] == 120.
+        readyOrder = [heapq.heappop(scheduler._readyQueue)[-1][0]
+                      for index in range(3)]
+        assert readyOrder == ['long1', 'short', 'other']
+
+        # in serial mode, tasks run in the order they were added
+        scheduler = TaskScheduler(analyses, 1, self.logger)
+        readyOrder = [heapq.heappop(scheduler._readyQueue)[-1][0]
+                      for index in range(3)]
+        assert readyOrder == ['short', 'other', 'long1']
+
+    def test_task_durations(self):
+        durationFileName = '{}/taskDurations.json'.format(self.test_dir)
+        short = self.make_task('short', duration=0.01)
+        long1 = self.make_task('long1', duration=0.2)
+        analyses = self.make_analyses([short, long1])
+
+        durations = TaskDurations(durationFileName)
+        assert durations.expected_duration(short) == short.expectedDuration
+        scheduler = TaskScheduler(analyses, 2, self.logger,
+                                  durations=durations)
+        tasksWithErrors = scheduler.run()
+        assert tasksWithErrors == []
+        durations.write()
+
+        durations = TaskDurations(durationFileName)
+        assert durations.expected_duration(long1) >= 0.2
+        assert durations.expected_duration(short) < \
+            durations.expected_duration(long1)
+        # a new task of the same class gets the mean of the class
+        newTask = self.make_task('new')
+        className = 'mpas_analysis.test.test_scheduler.RecordingTask'
+        assert durations.classDurations[className]['count'] == 2
+        assert durations.expected_duration(newTask) == \
+            durations.classDurations[className]['mean']
+
+        # the timed long task now comes first
+        scheduler = TaskScheduler(analyses, 2, self.logger,
+                                  durations=durations)
+        assert heapq.heappop(scheduler._readyQueue)[-1][0] == 'long1'
+
+    def test_skip_unchanged(self):
+        manifestFileName = '{}/taskManifest.json'.format(self.test_dir)
+        inputFileName = '{}/input.txt'.format(self.test_dir)
+        with open(inputFileName, 'w') as inputFile:
+            inputFile.write('first\n')
+
+        def run(forceTasks=None):
+            if os.path.exists(self.recordFileName):
+                os.remove(self.recordFileName)
+            first = self.make_task('first')
+            first.inputFileName = inputFileName
+            first.outputFileName = '{}/first.nc'.format(self.test_dir)
+            second = self.make_task('second')
+            second.run_after(first)
+            other = self.make_task('other')
+            other.xmlFileNames = ['{}/other.xml'.format(self.test_dir)]
+            analyses = self.make_analyses([first, second, other])
+            manifest = TaskManifest(manifestFileName)
+            scheduler = TaskScheduler(analyses, 1, self.logger,
+                                      manifest=manifest,
+                                      forceTasks=forceTasks)
+            assert scheduler.run() == []
+            manifest.write()
+            for task in analyses.values():
+                assert task._runStatus.value == AnalysisTask.SUCCESS
+            return sorted(self.read_record())
+
+        assert run() == ['first', 'other', 'second']
+        # "other" is rerun because its XML file is missing
+        assert run() == ['other']
+        with open('{}/other.xml'.format(self.test_dir), 'w') as xmlFile:
+            xmlFile.write('<xml/>\n')
+        assert run() == []
+
+        # forcing a task also reruns the tasks that depend on it
+        assert run(forceTasks=['first']) == ['first', 'second']
+        assert run(forceTasks=['second']) == ['second']
+
+        # changing an input file reruns the task and its dependents
+        with open(inputFileName, 'w') as inputFile:
+            inputFile.write('second version\n')
+        assert run() == ['first', 'second']
+        assert run() == []
+
+        # a missing output file reruns the task and its dependents
+        os.remove('{}/first.nc'.format(self.test_dir))
+        assert run() == ['first', 'second']
+        assert run() == []
+
+    def test_fingerprint_config(self):
+        manifest = TaskManifest('{}/taskManifest.json'.format(self.test_dir))
+        task = self.make_task('first')
+        config = task.config
+        fingerprint = manifest.compute_fingerprint(task, [])
+
+        # options that only determine how and which tasks run are ignored
+        config.add_section('execute')
+        config.set('execute', 'parallelTaskCount', '4')
+        config.add_section('output')
+        config.set('output', 'generate', "['all']")
+        assert manifest.compute_fingerprint(task, []) == fingerprint
+
+        # options in any other section are included, even those of sections
+        # not named after the task or its tags
+        config.set('output', 'plotsSubdirectory', 'plots')
+        assert manifest.compute_fingerprint(task, []) != fingerprint
+        fingerprint = manifest.compute_fingerprint(task, [])
+        config.add_section('oceanObservations')
+        config.set('oceanObservations', 'interpolationMethod', 'bilinear')
+        assert manifest.compute_fingerprint(task, []) != fingerprint
+
+    def test_plan(self):
+        manifestFileName = '{}/taskManifest.json'.format(self.test_dir)
+        first = self.make_task('first')
+        second = self.make_task('second')
+        second.run_after(first)
+        other = self.make_task('other')
+        first.expectedDuration = 10.
+        second.expectedDuration = 20.
+        other.expectedDuration = 5.
+        analyses = self.make_analyses([second, other, first])
+
+        scheduler = TaskScheduler(analyses, 1, self.logger,
+                                  manifest=TaskManifest(manifestFileName))
+        plan = scheduler.plan()
+        assert [entry['taskName'] for entry in plan] == \
+            ['first', 'second', 'other']
+        assert [entry['status'] for entry in plan] == ['run']*3
+        assert plan[0]['criticalPath'] == 30.
+        assert plan[1]['prerequisites'] == [('first', None)]
+        # planning doesn't run anything
+        assert self.read_record() == []
+
+        manifest = TaskManifest(manifestFileName)
+        scheduler = TaskScheduler(analyses, 1, self.logger,
+                                  manifest=manifest)
+        scheduler.run()
+        manifest.write()
+
+        scheduler = TaskScheduler(analyses, 1, self.logger,
+                                  manifest=TaskManifest(manifestFileName),
+                                  forceTasks=['first'])
+        plan = scheduler.plan()
+        assert [entry['status'] for entry in plan] == ['run', 'run', 'skip']
+
+
+# vim: foldmethod=marker ai ts=4 sts=4 et sw=4 ft=python